@@ -1,7 +1,12 @@
+import asyncio
+import collections
+import concurrent.futures
+import contextlib
 import enum
 import hashlib
 import logging
 import secrets
+import time
 
 import passlib.context
 import starlette.authentication
@@ -9,6 +14,7 @@ import starlette.requests
 
 import app.database as database
 import app.errors as errors
+import app.settings as settings
 
 
 logger = logging.getLogger(__name__)
@@ -32,6 +38,87 @@ def verify_password(password, password_hash):
     return _CONTEXT.verify(password, password_hash)
 
 
+class Hasher:
+    """Hash and verify passwords in a thread pool instead of on the event loop.
+
+    Argon2 is slow by design, but releases the GIL, so the event loop (including the
+    MQTT listener) keeps running while `concurrency` threads compute hashes. At most
+    `capacity` further calls wait for a thread; Beyond that, calls are rejected with
+    ServiceUnavailableError instead of piling up during a login storm.
+    """
+
+    def __init__(self, concurrency, capacity):
+        self.concurrency = concurrency
+        self.capacity = capacity
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=concurrency, thread_name_prefix="hasher"
+        )
+        self._pending = 0
+        self._processed = 0
+        self._rejected = 0
+        self._waiting = 0.0  # Seconds that processed calls spent waiting for a thread
+
+    async def _run(self, function, *arguments):
+        if self._pending >= self.concurrency + self.capacity:
+            self._rejected += 1
+            logger.warning("Rejecting password hashing; Executor is full")
+            raise errors.ServiceUnavailableError
+
+        def call():
+            return time.monotonic(), function(*arguments)
+
+        self._pending += 1
+        submission = time.monotonic()
+        try:
+            start, result = await asyncio.get_running_loop().run_in_executor(
+                self._executor, call
+            )
+        finally:
+            self._pending -= 1
+        self._processed += 1
+        self._waiting += start - submission
+        return result
+
+    async def hash(self, password):
+        """Hash the given password and return the hash as string."""
+        return await self._run(hash_password, password)
+
+    async def verify(self, password, password_hash):
+        """Return true if the password results in the hash, else False."""
+        return await self._run(verify_password, password, password_hash)
+
+    def statistics(self):
+        """Return the number of running and waiting calls and their waiting time."""
+        return {
+            "concurrency": self.concurrency,
+            "capacity": self.capacity,
+            "active": min(self._pending, self.concurrency),
+            "waiting": max(self._pending - self.concurrency, 0),
+            "processed": self._processed,
+            "rejected": self._rejected,
+            "waiting_seconds": (
+                self._waiting / self._processed if self._processed > 0 else 0.0
+            ),
+        }
+
+    def close(self):
+        """Cancel waiting calls and stop the threads without blocking the event loop.
+
+        Running calls finish in the background; Their results are discarded.
+        """
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+@contextlib.contextmanager
+def hasher(concurrency, capacity):
+    """Context manager for a hasher whose threads are stopped on exit."""
+    x = Hasher(concurrency, capacity)
+    try:
+        yield x
+    finally:
+        x.close()
+
+
 ########################################################################################
 # Token Utilities
 ########################################################################################
@@ -47,6 +134,76 @@ def hash_token(token):
     return hashlib.sha512(token.encode("utf-8")).hexdigest()
 
 
+########################################################################################
+# Caching
+########################################################################################
+
+
+class Cache:
+    """In-process cache of authentication and authorization results.
+
+    Values are remembered for `timeout` seconds, so that changes made by other
+    replicas or directly in the database take effect after at most that long. At most
+    `capacity` values are remembered; The least recently used ones are forgotten first.
+    Changes made through this replica's API are applied right away with `discard`.
+    """
+
+    def __init__(self, capacity, timeout):
+        self.capacity = capacity
+        self.timeout = timeout
+        # Map of keys to the values and the time they expire at, least recent first
+        self._values = collections.OrderedDict()
+        self._hits = 0
+        self._misses = 0
+
+    def get(self, key):
+        """Return the value of the key, or None if it's not cached or expired."""
+        value, expiration = self._values.get(key, (None, 0))
+        if expiration <= time.monotonic():
+            self._values.pop(key, None)
+            self._misses += 1
+            return None
+        self._values.move_to_end(key)
+        self._hits += 1
+        return value
+
+    def set(self, key, value):
+        """Remember the value of the key."""
+        self._values[key] = (value, time.monotonic() + self.timeout)
+        self._values.move_to_end(key)
+        if len(self._values) > self.capacity:
+            self._values.popitem(last=False)
+
+    def discard(self, predicate):
+        """Forget all values whose key matches the predicate."""
+        for key in [key for key in self._values if predicate(key)]:
+            del self._values[key]
+
+    def statistics(self):
+        """Return the cache size, the hits and misses and the hit rate."""
+        lookups = self._hits + self._misses
+        return {
+            "size": len(self._values),
+            "hits": self._hits,
+            "misses": self._misses,
+            "hit_rate": self._hits / lookups if lookups else None,
+        }
+
+
+def caches():
+    """Create the caches of the access tokens and of the relationships."""
+    return {
+        "identities": Cache(
+            capacity=settings.AUTHENTICATION_CACHE_SIZE,
+            timeout=settings.AUTHENTICATION_CACHE_TIMEOUT,
+        ),
+        "relationships": Cache(
+            capacity=settings.AUTHENTICATION_CACHE_SIZE,
+            timeout=settings.AUTHENTICATION_CACHE_TIMEOUT,
+        ),
+    }
+
+
 ########################################################################################
 # Authentication middleware
 ########################################################################################
@@ -73,10 +230,15 @@ class AuthenticationMiddleware:
         if scheme.lower() != "bearer":
             logger.warning("Malformed authorization header")
             return None
-        # Check if we have the access token in the database
+        # Check if we have the access token in the cache or in the database; Only
+        # valid tokens are cached, sessions aren't changed once they're created
+        access_token_hash = hash_token(access_token)
+        identity = request.state.identities.get(access_token_hash)
+        if identity is not None:
+            return identity
         query, arguments = database.parametrize(
             identifier="authenticate",
-            arguments={"access_token_hash": hash_token(access_token)},
+            arguments={"access_token_hash": access_token_hash},
         )
         elements = await request.state.dbpool.fetch(query, *arguments)
         elements = database.dictify(elements)
@@ -85,7 +247,9 @@ class AuthenticationMiddleware:
             logger.warning("Invalid access token")
             return None
         # Return the requester's identity
-        return elements[0]["user_identifier"]
+        identity = elements[0]["user_identifier"]
+        request.state.identities.set(access_token_hash, identity)
+        return identity
 
     async def __call__(self, scope, receive, send):
         # Only process HTTP requests, not websockets
@@ -116,6 +280,14 @@ class Resource:
     def __init__(self, identifier):
         self.identifier = identifier
 
+    def _key(self, identity):
+        """Return the key of the relationship in the cache, or None to not cache it.
+
+        Keys start with the network's identifier, so that all relationships within a
+        network can be discarded at once.
+        """
+        return None
+
     async def _authorize(self, request):
         """Return the relationship between the requester and the resource."""
         raise NotImplementedError
@@ -131,6 +303,9 @@ class User(Resource):
 
 
 class Network(Resource):
+    def _key(self, identity):
+        return (self.identifier, identity, None)
+
     async def _authorize(self, request):
         if request.state.identity is None:
             return Relationship.NONE
@@ -153,6 +328,13 @@ class Network(Resource):
 
 
 class Sensor(Resource):
+    def _key(self, identity):
+        return (
+            self.identifier["network_identifier"],
+            identity,
+            self.identifier["sensor_identifier"],
+        )
+
     async def _authorize(self, request):
         if request.state.identity is None:
             return Relationship.NONE
@@ -176,7 +358,23 @@ class Sensor(Resource):
 
 
 async def authorize(request, resource):
-    """Check what relationship (ReBAC) the requester has with the resource."""
-    relationship = await resource._authorize(request)
+    """Check what relationship (ReBAC) the requester has with the resource.
+
+    Relationships of authenticated requesters are cached; Resources that don't exist
+    aren't cached, as they raise NotFoundError.
+    """
+    key = None
+    if request.state.identity is not None:
+        key = resource._key(request.state.identity)
+    relationship = None if key is None else request.state.relationships.get(key)
+    if relationship is None:
+        relationship = await resource._authorize(request)
+        if key is not None:
+            request.state.relationships.set(key, relationship)
     logger.debug(f"Requester has {relationship.name} relationship")
     return relationship
+
+
+def invalidate(request, network_identifier):
+    """Discard the cached relationships within the network after it was changed."""
+    request.state.relationships.discard(lambda key: key[0] == network_identifier)
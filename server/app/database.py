@@ -4,7 +4,8 @@ import os
 import string
 
 import asyncpg
-import pendulum
+import asyncpg.pgproto.pgproto as pgproto
+import pydantic_core
 
 import app.settings as settings
 
@@ -25,9 +26,15 @@ def prepare():
 queries = prepare()
 
 
-def parametrize(identifier, arguments):
-    """Return the query and translate named arguments into valid PostgreSQL."""
+def parametrize(identifier, arguments, relations=None):
+    """Return the query and translate named arguments into valid PostgreSQL.
+
+    Names of tables or views can't be query arguments. The optional `relations` are
+    thus inserted into the query as they are and must never come from user input.
+    """
     template = string.Template(queries[identifier])
+    if relations is not None:
+        template = string.Template(template.safe_substitute(relations))
     single = isinstance(arguments, dict)
     # Get a list of the query argument names from the template
     keys = template.get_identifiers()
@@ -46,34 +53,57 @@ def parametrize(identifier, arguments):
 
 
 def dictify(elements):
-    """Cast a asyncpg SELECT query result into a list of dictionaries."""
-    # TODO: implement this as a custom asyncpg record_class on pool?
-    # see https://magicstack.github.io/asyncpg/current/api/index.html#connection-pools
+    """Cast a asyncpg SELECT query result into a list of dictionaries.
+
+    Records can't be serialized to JSON directly. A custom `record_class` doesn't help
+    either, as it can't be a dict subclass; Serializing records through a fallback
+    function is slower than copying them into dictionaries first. Queries thus return
+    the columns under the names of the response, so that this is the only copy.
+    """
     return [dict(record) for record in elements]
 
 
+# PostgreSQL counts time in microseconds since 2000-01-01T00:00:00+00:00
+_POSTGRES_EPOCH = 946684800
+
+
+# Codecs of the types that we convert to/from plain Python values, as (encoder,
+# decoder, format) by type name. They're called once per value, so they're kept as
+# cheap as possible:
+# - TIMESTAMPTZ as unix timestamps; The binary tuple format hands us the microseconds
+#   as integer, COPY (see `ingestion.Batcher`) only supports binary anyways
+# - UUID as str; asyncpg's own UUID type parses and formats in C, which is several
+#   times faster than the standard library's
+# - JSONB as Python objects; pydantic's JSON serializer is several times faster than
+#   the standard library's
+CODECS = {
+    "timestamptz": (
+        lambda x: (round((x - _POSTGRES_EPOCH) * 1000000),),
+        lambda x: x[0] / 1000000 + _POSTGRES_EPOCH,
+        "tuple",
+    ),
+    "uuid": (
+        lambda x: pgproto.UUID(x).bytes,
+        lambda x: str(pgproto.UUID(x)),
+        "binary",
+    ),
+    "jsonb": (
+        lambda x: pydantic_core.to_json(x).decode(),
+        json.loads,
+        "text",
+    ),
+}
+
+
 async def initialize(connection):
-    # Automatically encode/decode TIMESTAMPTZ fields to/from unix timestamps
-    await connection.set_type_codec(
-        typename="timestamptz",
-        schema="pg_catalog",
-        encoder=lambda x: pendulum.from_timestamp(x).isoformat(),
-        decoder=lambda x: pendulum.parse(x).float_timestamp,
-    )
-    # Automatically encode/decode JSONB fields to/from str
-    await connection.set_type_codec(
-        typename="jsonb",
-        schema="pg_catalog",
-        encoder=json.dumps,
-        decoder=json.loads,
-    )
-    # Automatically encode/decode UUID fields to/from str
-    await connection.set_type_codec(
-        typename="uuid",
-        schema="pg_catalog",
-        encoder=str,
-        decoder=str,
-    )
+    for typename, (encoder, decoder, format) in CODECS.items():
+        await connection.set_type_codec(
+            typename=typename,
+            schema="pg_catalog",
+            encoder=encoder,
+            decoder=decoder,
+            format=format,
+        )
 
 
 @contextlib.asynccontextmanager
@@ -62,3 +62,8 @@ class NotFoundError(_CustomError):
 class ConflictError(_CustomError):
     STATUS_CODE = 409
     DETAILS = "Conflict"
+
+
+class ServiceUnavailableError(_CustomError):
+    STATUS_CODE = 503
+    DETAILS = "Service Unavailable"
@@ -0,0 +1,285 @@
+import csv
+import io
+import struct
+
+import pydantic_core
+
+import app.database as database
+import app.settings as settings
+
+
+# Columns of the exported measurements, one row per data point
+COLUMNS = ("sensor_identifier", "attribute", "value", "revision", "creation_timestamp")
+
+
+async def stream(dbpool, encoder, sensor_identifiers, start_timestamp, end_timestamp):
+    """Yield the encoded measurements of the sensors, one chunk at a time.
+
+    The measurements are read through a server-side cursor in chunks, so memory stays
+    constant regardless of the size of the export. All sensors are read from the same
+    snapshot, so that the export is consistent even while new measurements arrive.
+    """
+    yield encoder.start()
+    async with dbpool.acquire() as connection:
+        async with connection.transaction(isolation="repeatable_read", readonly=True):
+            statement = None
+            for sensor_identifier in sensor_identifiers:
+                query, arguments = database.parametrize(
+                    identifier="export-measurements",
+                    arguments={
+                        "sensor_identifier": sensor_identifier,
+                        "start_timestamp": start_timestamp,
+                        "end_timestamp": end_timestamp,
+                    },
+                )
+                if statement is None:
+                    statement = await connection.prepare(query)
+                cursor = await statement.cursor(*arguments)
+                while rows := await cursor.fetch(settings.EXPORT_CHUNK_SIZE):
+                    yield encoder.encode(sensor_identifier, rows)
+    yield encoder.stop()
+
+
+########################################################################################
+# Formats
+########################################################################################
+
+
+class NDJSON:
+    """Encode measurements as newline-delimited JSON objects.
+
+    Like our JSON responses, the rows are serialized with pydantic's encoder, which
+    writes non-finite values as null instead of the invalid NaN or Infinity.
+    """
+
+    media_type = "application/x-ndjson"
+
+    def start(self):
+        return b""
+
+    def encode(self, sensor_identifier, rows):
+        return b"".join(
+            pydantic_core.to_json(dict(zip(COLUMNS, (sensor_identifier, *row)))) + b"\n"
+            for row in rows
+        )
+
+    def stop(self):
+        return b""
+
+
+class CSV:
+    """Encode measurements as CSV with a header row; Missing revisions are empty."""
+
+    media_type = "text/csv"
+
+    def _write(self, rows):
+        buffer = io.StringIO()
+        csv.writer(buffer, lineterminator="\n").writerows(rows)
+        return buffer.getvalue().encode()
+
+    def start(self):
+        return self._write([COLUMNS])
+
+    def encode(self, sensor_identifier, rows):
+        return self._write((sensor_identifier, *row) for row in rows)
+
+    def stop(self):
+        return b""
+
+
+class Arrow:
+    """Encode measurements in the Arrow IPC streaming format, one batch per chunk.
+
+    The format is simple enough for our fixed schema that we write it directly instead
+    of depending on pyarrow at runtime; The tests check the output against pyarrow. The
+    stream can be read with e.g. `pyarrow.ipc.open_stream` or `polars.read_ipc_stream`.
+    The timestamps are in microseconds instead of seconds to make them proper Arrow
+    timestamps. See the format specification for details:
+    https://arrow.apache.org/docs/format/Columnar.html
+    """
+
+    media_type = "application/vnd.apache.arrow.stream"
+
+    # Values of the enums and unions in the Arrow flatbuffer definitions
+    _VERSION = 4  # MetadataVersion.V5
+    _SCHEMA = 1  # MessageHeader.Schema
+    _RECORD_BATCH = 3  # MessageHeader.RecordBatch
+    _INT, _FLOATING_POINT, _UTF8, _TIMESTAMP = 2, 3, 5, 10  # Type
+
+    def _field(self, name, nullable, kind, parameters):
+        return _table(name, ("?", nullable), ("B", kind), parameters, None, [])
+
+    def _message(self, kind, header, body=b""):
+        """Frame the message with the continuation marker and the metadata size."""
+        metadata = _flatbuffer(
+            _table(("h", self._VERSION), ("B", kind), header, ("q", len(body)))
+        )
+        metadata += bytes(-len(metadata) % 8)
+        return struct.pack("<Ii", 0xFFFFFFFF, len(metadata)) + metadata + body
+
+    def start(self):
+        fields = [
+            self._field("sensor_identifier", False, self._UTF8, _table()),
+            self._field("attribute", False, self._UTF8, _table()),
+            self._field("value", False, self._FLOATING_POINT, _table(("h", 2))),
+            self._field("revision", True, self._INT, _table(("i", 32), ("?", True))),
+            self._field(
+                "creation_timestamp", False, self._TIMESTAMP, _table(("h", 2), "UTC")
+            ),
+        ]
+        return self._message(self._SCHEMA, _table(None, fields))
+
+    def encode(self, sensor_identifier, rows):
+        length = len(rows)
+        attributes, values, revisions, timestamps = zip(*rows)
+        identifier = sensor_identifier.encode()
+        attributes = [attribute.encode() for attribute in attributes]
+        # Each column consists of a validity bitmap followed by its values; Columns
+        # without nulls can leave out the bitmap
+        validity = sum(1 << i for i, x in enumerate(revisions) if x is not None)
+        nulls = length - validity.bit_count()
+        columns = [
+            (0, [b"", _offsets([len(identifier)] * length), identifier * length]),
+            (0, [b"", _offsets(map(len, attributes)), b"".join(attributes)]),
+            (0, [b"", struct.pack(f"<{length}d", *values)]),
+            (
+                nulls,
+                [
+                    validity.to_bytes((length + 7) // 8, "little") if nulls else b"",
+                    struct.pack(f"<{length}i", *(x or 0 for x in revisions)),
+                ],
+            ),
+            (
+                0,
+                [
+                    b"",
+                    struct.pack(
+                        f"<{length}q", *(round(x * 1000000) for x in timestamps)
+                    ),
+                ],
+            ),
+        ]
+        # Buffers are aligned to 8 bytes within the body
+        body, nodes, buffers = bytearray(), [], []
+        for null_count, column in columns:
+            nodes.append((length, null_count))
+            for buffer in column:
+                buffers.append((len(body), len(buffer)))
+                body += buffer + bytes(-len(buffer) % 8)
+        header = _table(("q", length), _Structs("<qq", nodes), _Structs("<qq", buffers))
+        return self._message(self._RECORD_BATCH, header, bytes(body))
+
+    def stop(self):
+        return struct.pack("<Ii", 0xFFFFFFFF, 0)
+
+
+FORMATS = {"ndjson": NDJSON, "csv": CSV, "arrow": Arrow}
+
+
+def _offsets(lengths):
+    """Encode the lengths of variable-sized values as 32-bit offsets."""
+    offsets = [0]
+    for length in lengths:
+        offsets.append(offsets[-1] + length)
+    return struct.pack(f"<{len(offsets)}i", *offsets)
+
+
+########################################################################################
+# Minimal flatbuffer encoding for the Arrow metadata
+########################################################################################
+
+
+class _Table(tuple):
+    """Fields of a flatbuffer table by their index.
+
+    Fields are either None if absent, (format, value) tuples for scalars, or strings,
+    lists of tables, structs or tables for references.
+    """
+
+
+class _Structs(tuple):
+    """Vector of structs, each given as the tuple of values in the struct's format."""
+
+    def __new__(cls, format, items):
+        instance = super().__new__(cls, items)
+        instance.format = format
+        return instance
+
+
+def _table(*fields):
+    return _Table(fields)
+
+
+def _flatbuffer(root):
+    """Encode the table as flatbuffer, with referenced objects after their referrers.
+
+    Flatbuffers are usually written back to front, but offsets to other objects only
+    need to point forward, which is easier to get right for our few small messages.
+    """
+    buffer = bytearray(4)
+
+    def align(size, shift=0):
+        buffer.extend(bytes(-(len(buffer) + shift) % size))
+
+    def reference(position, value):
+        struct.pack_into("<I", buffer, position, write(value) - position)
+
+    def write(value):
+        """Write the object and return its position."""
+        if isinstance(value, str):
+            align(4)
+            position = len(buffer)
+            data = value.encode()
+            buffer.extend(struct.pack("<I", len(data)) + data + b"\x00")
+            return position
+        if isinstance(value, _Structs):
+            # The structs after the length must be aligned to their largest member
+            align(8, shift=4)
+            position = len(buffer)
+            buffer.extend(struct.pack("<I", len(value)))
+            for item in value:
+                buffer.extend(struct.pack(value.format, *item))
+            return position
+        if isinstance(value, list):
+            align(4)
+            position = len(buffer)
+            buffer.extend(struct.pack("<I", len(value)) + bytes(4 * len(value)))
+            for i, item in enumerate(value):
+                reference(position + 4 + 4 * i, item)
+            return position
+        # Write the vtable first, then the table with its inline fields, then the
+        # objects the table references
+        align(4, shift=4 + 2 * len(value))
+        vtable = len(buffer)
+        buffer.extend(bytes(4 + 2 * len(value)))
+        position = len(buffer)
+        buffer.extend(struct.pack("<i", position - vtable))
+        offsets, references = [], []
+        for field in value:
+            if field is None:
+                offsets.append(0)
+                continue
+            if isinstance(field, tuple) and not isinstance(field, (_Table, _Structs)):
+                format, scalar = field
+                align(struct.calcsize(format))
+                offsets.append(len(buffer) - position)
+                buffer.extend(struct.pack(f"<{format}", scalar))
+            else:
+                align(4)
+                offsets.append(len(buffer) - position)
+                references.append((len(buffer), field))
+                buffer.extend(bytes(4))
+        struct.pack_into(
+            f"<{2 + len(offsets)}H",
+            buffer,
+            vtable,
+            4 + 2 * len(offsets),
+            len(buffer) - position,
+            *offsets,
+        )
+        for slot, field in references:
+            reference(slot, field)
+        return position
+
+    reference(0, root)
+    return bytes(buffer)
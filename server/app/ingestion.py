@@ -0,0 +1,693 @@
+import asyncio
+import bisect
+import collections
+import contextlib
+import hashlib
+import itertools
+import logging
+import operator
+import time
+
+import asyncpg
+
+import app.database as database
+
+
+logger = logging.getLogger(__name__)
+
+
+########################################################################################
+# Micro-batched writes
+########################################################################################
+
+
+class Batcher:
+    """Collect rows across messages and write them to a table in bulk via COPY.
+
+    Rows are buffered until either `capacity` rows are pending or `timeout` seconds
+    have passed since the last flush, whichever comes first. COPY is all-or-nothing,
+    so if a batch fails because a sensor doesn't exist, the rows are retried per
+    sensor to isolate the offending ones. This requires the sensor identifier to be
+    the first column. The identifiers of the offending sensors are passed to the
+    optional `missing` callback. If a batch, or a sensor's rows when retried, fail for
+    any other reason, the rows and the error are passed to the optional `failed`
+    coroutine function instead of raising the error. Rows that were written are
+    passed to the optional `written` callback, e.g. to measure latencies. The
+    optional `prepare` coroutine function maps rows to the records that are written,
+    e.g. to replace values with references, see `Interner`; Callbacks always receive
+    the original rows, except for the optional `committed` coroutine function. It's
+    awaited with the records after they're written, e.g. to maintain tables derived
+    from them, see `Snapshot`. The rows are stored at that point, so its errors are
+    only logged.
+
+    If `idempotent` is set, the table must have a unique index over the rows' key.
+    A batch that conflicts with existing rows is then written with an insert that
+    skips the duplicates instead. That's slower than COPY, but rare if duplicates
+    are mostly filtered out beforehand, see `Deduplicator`.
+    """
+
+    def __init__(
+        self,
+        dbpool,
+        table,
+        columns,
+        capacity,
+        timeout,
+        missing=None,
+        failed=None,
+        idempotent=False,
+        written=None,
+        prepare=None,
+        committed=None,
+    ):
+        self.dbpool = dbpool
+        self.table = table
+        self.columns = columns
+        self.capacity = capacity
+        self.timeout = timeout
+        self.missing = missing
+        self.failed = failed
+        self.idempotent = idempotent
+        self.written = written
+        self.prepare = prepare
+        self.committed = committed
+        self._insert = (
+            f"INSERT INTO {table} ({', '.join(columns)})"
+            f" VALUES ({', '.join(f'${i + 1}' for i in range(len(columns)))})"
+            " ON CONFLICT DO NOTHING;"
+        )
+        self._rows = []
+        self._lock = asyncio.Lock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    async def put(self, rows):
+        """Buffer the given rows; Flush immediately if the buffer is full."""
+        self._rows.extend(rows)
+        if len(self._rows) >= self.capacity:
+            await self.flush()
+
+    async def flush(self):
+        """Write all buffered rows to the database."""
+        async with self._lock:
+            rows, self._rows = self._rows, []
+            if len(rows) == 0:
+                return
+            try:
+                await self._copy(rows)
+            except asyncpg.ForeignKeyViolationError:
+                await self._isolate(rows)
+            except Exception as e:
+                if self.failed is None:
+                    raise
+                logger.error(f"Failed to write to {self.table}: {e!r}")
+                await self.failed(rows, e)
+
+    async def _copy(self, rows):
+        records = rows if self.prepare is None else await self.prepare(rows)
+        try:
+            await self.dbpool.copy_records_to_table(
+                self.table, records=records, columns=self.columns
+            )
+        except asyncpg.UniqueViolationError:
+            if not self.idempotent:
+                raise
+            await self.dbpool.executemany(self._insert, records)
+        if self.written is not None:
+            self.written(rows)
+        if self.committed is not None:
+            try:
+                await self.committed(records)
+            except Exception as e:
+                logger.error(
+                    f"Failed to update what's derived from {self.table}: {e!r}"
+                )
+
+    async def _isolate(self, rows):
+        groups = {}
+        for row in rows:
+            groups.setdefault(row[0], []).append(row)
+        for sensor_identifier, group in groups.items():
+            try:
+                await self._copy(group)
+            except asyncpg.ForeignKeyViolationError:
+                logger.warning(
+                    f"Failed to process; Sensor not found: {sensor_identifier}"
+                )
+                if self.missing is not None:
+                    self.missing(sensor_identifier)
+            except Exception as e:
+                if self.failed is None:
+                    raise
+                logger.error(f"Failed to write to {self.table}: {e!r}")
+                await self.failed(group, e)
+
+    async def run(self):
+        """Periodically flush the buffer so that rows don't wait indefinitely."""
+        while True:
+            await asyncio.sleep(self.timeout)
+            try:
+                await self.flush()
+            except Exception as e:  # pragma: no cover
+                logger.error(e, exc_info=True)
+
+
+@contextlib.asynccontextmanager
+async def batcher(
+    dbpool,
+    table,
+    columns,
+    capacity,
+    timeout,
+    missing=None,
+    failed=None,
+    idempotent=False,
+    written=None,
+    prepare=None,
+    committed=None,
+):
+    """Context manager for a batcher that flushes in the background."""
+    x = Batcher(
+        dbpool,
+        table,
+        columns,
+        capacity,
+        timeout,
+        missing,
+        failed,
+        idempotent,
+        written,
+        prepare,
+        committed,
+    )
+    task = asyncio.create_task(x.run())
+    try:
+        yield x
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+        # Write out whatever is left before the database pool is closed
+        await x.flush()
+
+
+class Interner:
+    """Store repeated values once in a separate table and reference them by id.
+
+    The identifier of a value is derived from its SHA-256 hash, so references can be
+    computed without a database round trip. Only values whose identifier wasn't seen
+    recently are inserted; The last `capacity` identifiers are remembered. Calling
+    the interner with rows returns the rows with the value at `index` replaced by
+    its identifier, which makes it suitable as a batcher's `prepare` function.
+    """
+
+    def __init__(self, dbpool, table, column, index, capacity):
+        self.dbpool = dbpool
+        self.index = index
+        self.capacity = capacity
+        self._known = collections.OrderedDict()
+        self._insert = (
+            f"INSERT INTO {table} (identifier, {column})"
+            " SELECT * FROM unnest($1::BIGINT[], $2::TEXT[])"
+            " ON CONFLICT DO NOTHING;"
+        )
+
+    @staticmethod
+    def identify(value):
+        """Return the identifier of the value, the first 8 bytes of its hash."""
+        digest = hashlib.sha256(value.encode()).digest()
+        return int.from_bytes(digest[:8], byteorder="big", signed=True)
+
+    async def __call__(self, rows):
+        identifiers = [self.identify(row[self.index]) for row in rows]
+        unknown = {
+            identifier: row[self.index]
+            for identifier, row in zip(identifiers, rows)
+            if identifier not in self._known
+        }
+        if len(unknown) > 0:
+            await self.dbpool.execute(
+                self._insert, list(unknown.keys()), list(unknown.values())
+            )
+            for identifier in unknown.keys():
+                self._known[identifier] = None
+                if len(self._known) > self.capacity:
+                    self._known.popitem(last=False)
+        return [
+            row[: self.index] + (identifier,) + row[self.index + 1 :]
+            for identifier, row in zip(identifiers, rows)
+        ]
+
+
+class Dictionary:
+    """Map values to small integer identifiers that are assigned by the database.
+
+    Used for values with few distinct occurrences, e.g. attribute names, so all
+    mappings are cached. Unknown values are passed as list to the given query under
+    the name `argument`; The query inserts them if necessary and returns pairs of
+    value and identifier for all of them.
+    """
+
+    def __init__(self, dbpool, query, argument):
+        self.dbpool = dbpool
+        self.query = query
+        self.argument = argument
+        self._identifiers = {}
+
+    async def encode(self, values):
+        """Return a mapping of the values to their identifiers."""
+        # Values inserted concurrently by another replica can be missing from the
+        # result, in which case we simply ask again
+        while unknown := set(values) - self._identifiers.keys():
+            query, arguments = database.parametrize(
+                identifier=self.query, arguments={self.argument: list(unknown)}
+            )
+            self._identifiers.update(await self.dbpool.fetch(query, *arguments))
+        return {value: self._identifiers[value] for value in values}
+
+
+class Snapshot:
+    """Keep the newest of the written records per key in a separate table.
+
+    Used to answer "what's the current value" with a point read instead of searching
+    the history, e.g. for the latest value of each attribute of a sensor. Calling the
+    snapshot with records reduces them to the newest record per key, which makes it
+    suitable as a batcher's `committed` function. The remaining records are passed as
+    one list per column to the given query, named like the columns. Batches can
+    commit out of order, so the query must replace rows only with newer ones.
+    """
+
+    def __init__(self, dbpool, query, columns, key, order):
+        self.dbpool = dbpool
+        self.query = query
+        self.columns = columns
+        self._key = operator.itemgetter(*[columns.index(column) for column in key])
+        self._order = operator.itemgetter(columns.index(order))
+
+    async def __call__(self, records):
+        latest = {}
+        for record in records:
+            key = self._key(record)
+            if key not in latest or self._order(record) > self._order(latest[key]):
+                latest[key] = record
+        if len(latest) == 0:
+            return
+        query, arguments = database.parametrize(
+            identifier=self.query,
+            arguments={
+                column: list(values)
+                for column, values in zip(self.columns, zip(*latest.values()))
+            },
+        )
+        await self.dbpool.execute(query, *arguments)
+
+
+########################################################################################
+# Deduplication
+########################################################################################
+
+
+class Deduplicator:
+    """Filter out rows whose key was seen recently.
+
+    MQTT's QoS 1 delivers messages at least once, and sensors re-publish messages
+    that weren't acknowledged after a restart. Remembering the keys of the last
+    `capacity` rows catches these redeliveries before they reach the database. The
+    key of a row is given by the names of its key columns.
+    """
+
+    def __init__(self, capacity, columns, key):
+        self.capacity = capacity
+        self._key = operator.itemgetter(*[columns.index(column) for column in key])
+        self._keys = collections.OrderedDict()
+        self._duplicates = 0
+
+    def filter(self, rows):
+        """Return the rows whose key wasn't seen; Remember their keys."""
+        if self.capacity == 0:
+            return rows
+        result = []
+        for row in rows:
+            key = self._key(row)
+            if key in self._keys:
+                self._duplicates += 1
+                continue
+            self._keys[key] = None
+            result.append(row)
+            # Forget the oldest key
+            if len(self._keys) > self.capacity:
+                self._keys.popitem(last=False)
+        return result
+
+    def statistics(self):
+        """Return the number of remembered keys and filtered duplicates."""
+        return {
+            "capacity": self.capacity,
+            "size": len(self._keys),
+            "duplicates": self._duplicates,
+        }
+
+
+########################################################################################
+# Known sensors
+########################################################################################
+
+
+class Registry:
+    """In-process cache of which sensors exist and of their surrogate keys.
+
+    The identifiers and numbers of all sensors are loaded at startup. An identifier
+    that isn't known is looked up in the database once and, if the sensor doesn't
+    exist, is remembered as unknown for `timeout` seconds. Messages from stale or
+    misconfigured sensors are thus dropped without touching the database. At most
+    `capacity` unknown identifiers are remembered; The oldest ones are forgotten
+    first.
+
+    Sensors created through the API are added directly. Deleted sensors are
+    discarded when their rows are rejected by the database.
+    """
+
+    def __init__(self, dbpool, capacity, timeout):
+        self.dbpool = dbpool
+        self.capacity = capacity
+        self.timeout = timeout
+        # Map of known identifiers to the sensors' numbers
+        self._known = {}
+        # Map of unknown identifiers to the time they expire at, oldest first
+        self._unknown = collections.OrderedDict()
+        self._lookups = 0
+        self._rejected = 0
+
+    async def load(self):
+        """Replace the known sensors with all sensors in the database."""
+        query, arguments = database.parametrize(
+            identifier="read-sensor-identifiers", arguments={}
+        )
+        elements = await self.dbpool.fetch(query, *arguments)
+        self._known = {
+            element["sensor_identifier"]: element["sensor_number"]
+            for element in elements
+        }
+        self._unknown.clear()
+
+    def add(self, sensor_identifier, sensor_number):
+        """Mark the sensor as existing."""
+        self._known[sensor_identifier] = sensor_number
+        self._unknown.pop(sensor_identifier, None)
+
+    def discard(self, sensor_identifier):
+        """Forget the sensor; It's looked up again the next time it's seen."""
+        self._known.pop(sensor_identifier, None)
+
+    def number(self, sensor_identifier):
+        """Return the sensor's number, or None if the sensor isn't known to exist."""
+        return self._known.get(sensor_identifier)
+
+    async def contains(self, sensor_identifier):
+        """Return True if the sensor exists, query the database only if unsure."""
+        if sensor_identifier in self._known:
+            return True
+        expiration = self._unknown.get(sensor_identifier)
+        if expiration is not None and expiration > time.monotonic():
+            self._rejected += 1
+            return False
+        self._lookups += 1
+        query, arguments = database.parametrize(
+            identifier="read-sensor-number",
+            arguments={"sensor_identifier": sensor_identifier},
+        )
+        sensor_number = await self.dbpool.fetchval(query, *arguments)
+        if sensor_number is not None:
+            self.add(sensor_identifier, sensor_number)
+            return True
+        logger.warning(f"Dropping messages; Sensor not found: {sensor_identifier}")
+        self._unknown[sensor_identifier] = time.monotonic() + self.timeout
+        self._unknown.move_to_end(sensor_identifier)
+        if len(self._unknown) > self.capacity:
+            self._unknown.popitem(last=False)
+        self._rejected += 1
+        return False
+
+    def statistics(self):
+        """Return the cache sizes, the database lookups and the rejected messages."""
+        return {
+            "known": len(self._known),
+            "unknown": len(self._unknown),
+            "lookups": self._lookups,
+            "rejected": self._rejected,
+        }
+
+
+########################################################################################
+# Prioritised buffering
+########################################################################################
+
+
+class Queue:
+    """Bounded in-memory queue that sheds low-priority elements when it's full.
+
+    Elements are returned in the order they were put, regardless of their priority.
+    When the queue is at capacity, putting an element evicts the oldest element of
+    the lowest priority below the new element's priority. If there's none, the new
+    element is dropped instead. Putting never blocks.
+    """
+
+    def __init__(self, capacity, priorities):
+        self.capacity = capacity
+        # Priorities are given from lowest to highest
+        self._priorities = {priority: i for i, priority in enumerate(priorities)}
+        self._queues = {priority: collections.deque() for priority in priorities}
+        self._counter = itertools.count()
+        self._size = 0
+        self._unfinished = 0
+        self._nonempty = asyncio.Event()
+        self._finished = asyncio.Event()
+        self._finished.set()
+        self._received = dict.fromkeys(priorities, 0)
+        self._dropped = dict.fromkeys(priorities, 0)
+
+    def __len__(self):
+        return self._size
+
+    def put(self, priority, element):
+        """Queue the element; Return False if it was dropped instead."""
+        self._received[priority] += 1
+        if self._size >= self.capacity:
+            for other, queue in self._queues.items():
+                if self._priorities[other] >= self._priorities[priority]:
+                    self._dropped[priority] += 1
+                    return False
+                if len(queue) > 0:
+                    queue.popleft()
+                    self._dropped[other] += 1
+                    self._size -= 1
+                    self._unfinished -= 1
+                    break
+        # Remember the insertion order and time for FIFO and lag calculation
+        self._queues[priority].append((next(self._counter), time.monotonic(), element))
+        self._size += 1
+        self._unfinished += 1
+        self._nonempty.set()
+        self._finished.clear()
+        return True
+
+    async def get(self):
+        """Remove and return the oldest element, wait until one is available."""
+        while self._size == 0:
+            self._nonempty.clear()
+            await self._nonempty.wait()
+        queue = min(
+            (queue for queue in self._queues.values() if len(queue) > 0),
+            key=lambda queue: queue[0][0],
+        )
+        _, _, element = queue.popleft()
+        self._size -= 1
+        return element
+
+    def task_done(self):
+        """Indicate that processing of an element returned by `get` is complete."""
+        self._unfinished -= 1
+        if self._unfinished == 0:
+            self._finished.set()
+
+    async def join(self):
+        """Wait until all elements have been gotten and processed."""
+        await self._finished.wait()
+
+    def statistics(self):
+        """Return the current lag in elements and seconds and the drop counts."""
+        timestamps = [queue[0][1] for queue in self._queues.values() if len(queue) > 0]
+        return {
+            "capacity": self.capacity,
+            "lag_elements": self._size,
+            "lag_seconds": (
+                time.monotonic() - min(timestamps) if len(timestamps) > 0 else 0.0
+            ),
+            "received": dict(self._received),
+            "dropped": dict(self._dropped),
+        }
+
+
+########################################################################################
+# Concurrent processing
+########################################################################################
+
+
+class Dispatcher:
+    """Fan work out to a fixed number of workers while keeping order per key.
+
+    Each key (e.g. the sensor identifier) is always assigned to the same worker, so
+    work items with the same key are processed in the order they were put, while
+    items with different keys can be processed concurrently. Each worker has its own
+    bounded queue; `put` blocks when the respective worker's queue is full.
+    """
+
+    def __init__(self, concurrency, capacity):
+        self._queues = [asyncio.Queue(maxsize=capacity) for _ in range(concurrency)]
+        self._active = [False] * concurrency
+        self._busy = [0.0] * concurrency  # Seconds each worker spent processing
+        self._processed = [0] * concurrency
+        self._start = time.monotonic()
+
+    async def put(self, key, function, *arguments):
+        """Schedule `function(*arguments)` to be awaited by the key's worker."""
+        queue = self._queues[hash(key) % len(self._queues)]
+        await queue.put((function, arguments))
+
+    async def _work(self, index):
+        queue = self._queues[index]
+        while True:
+            function, arguments = await queue.get()
+            self._active[index] = True
+            start = time.monotonic()
+            try:
+                await function(*arguments)
+            # Errors are logged and ignored so that the worker keeps running
+            except Exception as e:  # pragma: no cover
+                logger.error(e, exc_info=True)
+            finally:
+                self._busy[index] += time.monotonic() - start
+                self._processed[index] += 1
+                self._active[index] = False
+                queue.task_done()
+
+    async def join(self):
+        """Wait until all queued work items have been processed."""
+        await asyncio.gather(*[queue.join() for queue in self._queues])
+
+    async def run(self):
+        """Run the workers until cancelled."""
+        await asyncio.gather(*[self._work(i) for i in range(len(self._queues))])
+
+    def statistics(self):
+        """Return queue depths and utilisation of the workers."""
+        elapsed = time.monotonic() - self._start
+        return {
+            "concurrency": len(self._queues),
+            "active": sum(self._active),
+            "depths": [queue.qsize() for queue in self._queues],
+            "capacity": self._queues[0].maxsize,
+            "processed": list(self._processed),
+            "utilisation": [busy / elapsed for busy in self._busy],
+        }
+
+
+@contextlib.asynccontextmanager
+async def dispatcher(concurrency, capacity, timeout=10):
+    """Context manager for a dispatcher with running workers.
+
+    On exit, pending work is given `timeout` seconds to finish before the workers
+    are cancelled.
+    """
+    x = Dispatcher(concurrency, capacity)
+    task = asyncio.create_task(x.run())
+    try:
+        yield x
+    finally:
+        try:
+            await asyncio.wait_for(x.join(), timeout=timeout)
+        except asyncio.TimeoutError:  # pragma: no cover
+            logger.warning("Cancelling dispatcher with unprocessed work")
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
+
+
+########################################################################################
+# Instrumentation
+########################################################################################
+
+
+class Histogram:
+    """Count observations in buckets with fixed upper bounds.
+
+    The last bucket counts the observations above the largest bound.
+    """
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        """Count the value in its bucket."""
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def statistics(self):
+        """Return the number and sum of the observations and the bucket counts."""
+        return {"count": self.count, "sum": self.sum, "counts": list(self.counts)}
+
+
+class Latencies:
+    """Record how long messages spend in each stage, per message kind and sensor.
+
+    The default bounds grow by a factor of 4 from a millisecond to about three days,
+    to tell apart a slow database (seconds) from edge outages (hours). The histograms
+    of at most `capacity` sensors are kept; The oldest ones are forgotten first.
+    """
+
+    BOUNDS = [0.001 * 4**i for i in range(15)]
+
+    def __init__(self, bounds=BOUNDS, capacity=4096):
+        self.bounds = bounds
+        self.capacity = capacity
+        self._kinds = {}
+        self._sensors = collections.OrderedDict()
+
+    def record(self, stage, kind, sensor_identifier, seconds):
+        """Record the time in seconds that a message spent in the given stage."""
+        key = (stage, kind)
+        if key not in self._kinds:
+            self._kinds[key] = Histogram(self.bounds)
+        self._kinds[key].observe(seconds)
+        if sensor_identifier not in self._sensors:
+            self._sensors[sensor_identifier] = {}
+            # Forget the oldest sensor
+            if len(self._sensors) > self.capacity:
+                self._sensors.popitem(last=False)
+        stages = self._sensors[sensor_identifier]
+        if stage not in stages:
+            stages[stage] = Histogram(self.bounds)
+        stages[stage].observe(seconds)
+
+    def statistics(self, sensors=None):
+        """Return the histograms per stage and kind, optionally also per sensor.
+
+        Only the histograms of the given sensor identifiers are included.
+        """
+        result = {"bounds": self.bounds, "kinds": {}}
+        for (stage, kind), histogram in self._kinds.items():
+            result["kinds"].setdefault(stage, {})[kind] = histogram.statistics()
+        if sensors is not None:
+            result["sensors"] = {
+                sensor_identifier: {
+                    stage: histogram.statistics() for stage, histogram in stages.items()
+                }
+                for sensor_identifier, stages in self._sensors.items()
+                if sensor_identifier in sensors
+            }
+        return result
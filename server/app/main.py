@@ -12,15 +12,18 @@ import starlette.routing
 import app.auth as auth
 import app.database as database
 import app.errors as errors
+import app.export as export
+import app.ingestion as ingestion
 import app.logs as logs
 import app.mqtt as mqtt
 import app.settings as settings
+import app.utils as utils
 import app.validation as validation
 
 
 @validation.validate(schema=validation.ReadStatusRequest)
 async def read_status(request, values):
-    return starlette.responses.JSONResponse(
+    return utils.JSONResponse(
         status_code=200,
         content={
             "environment": settings.ENVIRONMENT,
@@ -31,9 +34,42 @@ async def read_status(request, values):
     )
 
 
+@validation.validate(schema=validation.ReadMetricsRequest)
+async def read_metrics(request, values):
+    # The per-sensor latencies are only shown for the requester's own sensors
+    sensors = None
+    if values.query["sensors"]:
+        relationship = await auth.authorize(request, auth.User(request.state.identity))
+        if relationship < auth.Relationship.DEFAULT:
+            raise errors.UnauthorizedError
+        query, arguments = database.parametrize(
+            identifier="read-user-sensor-identifiers",
+            arguments={"user_identifier": request.state.identity},
+        )
+        elements = await request.state.dbpool.fetch(query, *arguments)
+        sensors = {element["sensor_identifier"] for element in elements}
+    content = {
+        "authentication": {
+            "identities": request.state.identities.statistics(),
+            "relationships": request.state.relationships.statistics(),
+        }
+    }
+    if "api" in settings.ROLES:
+        content["authentication"]["hasher"] = request.state.hasher.statistics()
+    if "ingestion" in settings.ROLES:
+        content |= {
+            "queue": request.state.queue.statistics(),
+            "dispatcher": request.state.dispatcher.statistics(),
+            "registry": request.state.registry.statistics(),
+            "deduplicator": request.state.deduplicator.statistics(),
+            "latencies": request.state.latencies.statistics(sensors=sensors),
+        }
+    return utils.JSONResponse(status_code=200, content=content)
+
+
 @validation.validate(schema=validation.CreateUserRequest)
 async def create_user(request, values):
-    password_hash = auth.hash_password(values.body["password"])
+    password_hash = await request.state.hasher.hash(values.body["password"])
     access_token = auth.generate_token()
     access_token_hash = auth.hash_token(access_token)
     async with request.state.dbpool.acquire() as connection:
@@ -64,7 +100,7 @@ async def create_user(request, values):
             )
             await connection.execute(query, *arguments)
     # Return successful response
-    return starlette.responses.JSONResponse(
+    return utils.JSONResponse(
         status_code=201,
         content={"user_identifier": user_identifier, "access_token": access_token},
     )
@@ -84,7 +120,7 @@ async def create_session(request, values):
     user_identifier = elements[0]["user_identifier"]
     password_hash = elements[0]["password_hash"]
     # Check if password hashes match
-    if not auth.verify_password(values.body["password"], password_hash):
+    if not await request.state.hasher.verify(values.body["password"], password_hash):
         logger.warning(f"{request.method} {request.url.path} -- Invalid password")
         raise errors.UnauthorizedError
     access_token = auth.generate_token()
@@ -98,7 +134,7 @@ async def create_session(request, values):
     )
     await request.state.dbpool.execute(query, *arguments)
     # Return successful response
-    return starlette.responses.JSONResponse(
+    return utils.JSONResponse(
         status_code=201,
         content={"user_identifier": user_identifier, "access_token": access_token},
     )
@@ -139,8 +175,9 @@ async def create_network(request, values):
                 # This can happen if the user is deleted after the permissions check
                 logger.warning(f"{request.method} {request.url.path} -- User not found")
                 raise errors.UnauthorizedError
+    auth.invalidate(request, network_identifier)
     # Return successful response
-    return starlette.responses.JSONResponse(
+    return utils.JSONResponse(
         status_code=201,
         content={"network_identifier": network_identifier},
     )
@@ -158,9 +195,84 @@ async def read_networks(request, values):
         arguments={"user_identifier": request.state.identity},
     )
     elements = await request.state.dbpool.fetch(query, *arguments)
-    return starlette.responses.JSONResponse(
-        status_code=200, content=database.dictify(elements)
+    return utils.JSONResponse(status_code=200, content=database.dictify(elements))
+
+
+# Time range of the hourly averages in the network overview in seconds
+OVERVIEW_RANGE = 24 * 60 * 60
+
+
+@validation.validate(schema=validation.ReadNetworkOverviewRequest)
+async def read_network_overview(request, values):
+    relationship = await auth.authorize(
+        request, auth.Network(values.path["network_identifier"])
     )
+    if relationship < auth.Relationship.DEFAULT:
+        raise errors.UnauthorizedError
+    if relationship < auth.Relationship.OWNER:
+        raise errors.ForbiddenError
+    arguments = {"network_identifier": values.path["network_identifier"]}
+    async with request.state.dbpool.acquire() as connection:
+        # Read everything from the same snapshot, so that the results match up
+        async with connection.transaction(isolation="repeatable_read", readonly=True):
+            sensors = await connection.fetch(
+                *database.parametrize("read-sensors", arguments)
+            )
+            measurements = await connection.fetch(
+                *database.parametrize("read-network-measurements-latest", arguments)
+            )
+            aggregation = await connection.fetch(
+                *database.parametrize(
+                    "aggregate-network-measurements",
+                    {
+                        **arguments,
+                        "start_timestamp": utils.timestamp() - OVERVIEW_RANGE,
+                    },
+                )
+            )
+            logs = await connection.fetch(
+                *database.parametrize("aggregate-network-logs", arguments)
+            )
+    # Assemble the results per sensor
+    overview = {
+        element["sensor_identifier"]: {
+            "sensor_identifier": element["sensor_identifier"],
+            "sensor_name": element["sensor_name"],
+            "latest": {},
+            "aggregation": {},
+            "logs": [],
+        }
+        for element in sensors
+    }
+    for element in measurements:
+        overview[element["sensor_identifier"]]["latest"][element["attribute"]] = {
+            "value": element["value"],
+            "revision": element["revision"],
+            "creation_timestamp": element["creation_timestamp"],
+        }
+    for element in aggregation:
+        overview[element["sensor_identifier"]]["aggregation"].setdefault(
+            element["attribute"], []
+        ).append(
+            {
+                "bucket_timestamp": element["bucket_timestamp"],
+                "average": element["average"],
+            }
+        )
+    for element in logs:
+        overview[element["sensor_identifier"]]["logs"].append(
+            {
+                "severity": element["severity"],
+                "min_revision": element["min_revision"],
+                "max_revision": element["max_revision"],
+                "min_creation_timestamp": element["min_creation_timestamp"],
+                "max_creation_timestamp": element["max_creation_timestamp"],
+                "subject": element["message"],
+                "count": element["count"],
+            }
+        )
+    # Return successful response
+    return utils.JSONResponse(status_code=200, content=list(overview.values()))
 
 
 @validation.validate(schema=validation.CreateSensorRequest)
@@ -194,9 +306,15 @@ async def create_sensor(request, values):
     except asyncpg.exceptions.UniqueViolationError:
         logger.warning(f"{request.method} {request.url.path} -- Uniqueness violation")
         raise errors.ConflictError
-    sensor_identifier = database.dictify(elements)[0]["sensor_identifier"]
+    element = database.dictify(elements)[0]
+    sensor_identifier = element["sensor_identifier"]
+    # Accept messages from the new sensor right away; Other ingestion replicas look
+    # it up in the database when they receive its first message
+    if "ingestion" in settings.ROLES:
+        request.state.registry.add(sensor_identifier, element["sensor_number"])
+    auth.invalidate(request, values.path["network_identifier"])
     # Return successful response
-    return starlette.responses.JSONResponse(
+    return utils.JSONResponse(
         status_code=201,
         content={"sensor_identifier": sensor_identifier},
     )
@@ -216,9 +334,7 @@ async def read_sensors(request, values):
         arguments={"network_identifier": values.path["network_identifier"]},
     )
     elements = await request.state.dbpool.fetch(query, *arguments)
-    return starlette.responses.JSONResponse(
-        status_code=200, content=database.dictify(elements)
-    )
+    return utils.JSONResponse(status_code=200, content=database.dictify(elements))
 
 
 @validation.validate(schema=validation.UpdateSensorRequest)
@@ -258,7 +374,7 @@ async def update_sensor(request, values):
         logger.warning(f"{request.method} {request.url.path} -- Sensor not found")
         raise errors.NotFoundError
     # Return successful response
-    return starlette.responses.JSONResponse(status_code=200, content={})
+    return utils.JSONResponse(status_code=200, content={})
 
 
 @validation.validate(schema=validation.CreateConfigurationRequest)
@@ -289,16 +405,10 @@ async def create_configuration(request, values):
         logger.warning(f"{request.method} {request.url.path} -- Sensor not found")
         raise errors.NotFoundError
     revision = database.dictify(elements)[0]["revision"]
-    # Send MQTT message with configuration
-    await mqtt.publish_configuration(
-        sensor_identifier=values.path["sensor_identifier"],
-        revision=revision,
-        configuration=values.body,
-        mqttc=request.state.mqttc,
-        dbpool=request.state.dbpool,
-    )
+    # Have the configuration sent to the sensor via MQTT in the background
+    request.state.publisher.notify()
     # Return successful response
-    return starlette.responses.JSONResponse(
+    return utils.JSONResponse(
         status_code=201,
         content={"revision": revision},
     )
@@ -329,7 +439,7 @@ async def read_configurations(request, values):
     )
     elements = await request.state.dbpool.fetch(query, *arguments)
     # Return successful response
-    return starlette.responses.JSONResponse(
+    return utils.JSONResponse(
         status_code=200,
         content=database.dictify(
             elements if values.query["direction"] == "next" else reversed(elements)
@@ -337,35 +447,106 @@ async def read_configurations(request, values):
     )
 
 
+# Widths of the buckets of the measurement aggregates in seconds, coarsest first
+RESOLUTIONS = {"1-day": 86400, "1-hour": 3600, "1-minute": 60}
+# Continuous aggregates of the measurements per resolution, see `schema.sql`
+ROLLUPS = {
+    "1-day": "measurement_aggregation_1_day",
+    "1-hour": "measurement_aggregation_1_hour",
+    "1-minute": "measurement_aggregation_1_minute",
+}
+# Maximum number of buckets per attribute that can be requested at once
+MAXIMUM_BUCKETS = 16384
+# Statistics that can be combined from the aggregates' minimum, maximum, sum and count
+COMBINABLE = {"average", "minimum", "maximum", "count"}
+
+
+def _resolution(start_timestamp, end_timestamp, points):
+    """Return the coarsest resolution that yields the number of points in the range."""
+    for resolution, width in RESOLUTIONS.items():
+        if (end_timestamp - start_timestamp) / width >= points:
+            return resolution
+    # Fall back to the finest resolution for short ranges
+    return resolution
+
+
+def _rollup(width, statistics, percentiles):
+    """Return the coarsest resolution whose buckets can be combined to the width.
+
+    Returns None if the statistics can only be computed from the raw measurements.
+    """
+    if statistics <= COMBINABLE and percentiles is None:
+        for resolution, rollup_width in RESOLUTIONS.items():
+            if width % rollup_width == 0:
+                return resolution
+    return None
+
+
 @validation.validate(schema=validation.ReadMeasurementsRequest)
 async def read_measurements(request, values):
-    # Aggregate measurements
+    # Aggregate measurements, by default over the last 4 weeks
     if values.query["aggregate"]:
-        query, arguments = database.parametrize(
-            identifier="aggregate-measurements",
-            arguments={"sensor_identifier": values.path["sensor_identifier"]},
-        )
+        end_timestamp = values.query["end_timestamp"]
+        if end_timestamp is None:
+            end_timestamp = utils.timestamp()
+        start_timestamp = values.query["start_timestamp"]
+        if start_timestamp is None:
+            start_timestamp = end_timestamp - 4 * 7 * 24 * 60 * 60
+        # Without explicit width, pick the width from the number of points
+        width = values.query["width"]
+        if width is None:
+            width = RESOLUTIONS[
+                _resolution(start_timestamp, end_timestamp, values.query["points"])
+            ]
+        if (end_timestamp - start_timestamp) / width > MAXIMUM_BUCKETS:
+            logger.warning(
+                f"{request.method} {request.url.path} -- Too many buckets requested"
+            )
+            raise errors.BadRequestError
+        statistics = values.query["statistics"]
+        percentiles = values.query["percentiles"]
+        resolution = _rollup(width, statistics, percentiles)
+        arguments = {
+            "sensor_identifier": values.path["sensor_identifier"],
+            "start_timestamp": start_timestamp,
+            "end_timestamp": end_timestamp,
+            "width": width,
+            "attribute_names": values.query["attributes"],
+        }
+        if resolution is None:
+            arguments["percentiles"] = percentiles and [x / 100 for x in percentiles]
+            query, arguments = database.parametrize(
+                identifier="aggregate-measurements-raw", arguments=arguments
+            )
+        else:
+            query, arguments = database.parametrize(
+                identifier="aggregate-measurements-rollup",
+                arguments=arguments,
+                relations={"rollup": ROLLUPS[resolution]},
+            )
         elements = await request.state.dbpool.fetch(query, *arguments)
+        # Group the buckets by attribute, with only the requested statistics
+        content = {}
+        for element in elements:
+            bucket = {"bucket_timestamp": element["bucket_timestamp"]}
+            bucket.update({statistic: element[statistic] for statistic in statistics})
+            if percentiles is not None:
+                bucket["percentiles"] = element["percentiles"]
+            content.setdefault(element["attribute"], []).append(bucket)
         # Return successful response
-        return starlette.responses.JSONResponse(
-            status_code=200,
-            content={
-                element["attribute"]: element["values"]
-                for element in database.dictify(elements)
-            },
-        )
+        return utils.JSONResponse(status_code=200, content=content)
     # Page through measurements
     query, arguments = database.parametrize(
-        identifier="read-measurements",
+        identifier=f"read-measurements-{values.query['direction']}",
         arguments={
             "sensor_identifier": values.path["sensor_identifier"],
             "creation_timestamp": values.query["creation_timestamp"],
-            "direction": values.query["direction"],
+            "limit": values.query["limit"],
         },
     )
     elements = await request.state.dbpool.fetch(query, *arguments)
     # Return successful response
-    return starlette.responses.JSONResponse(
+    return utils.JSONResponse(
         status_code=200,
         content=database.dictify(
             elements if values.query["direction"] == "next" else reversed(elements)
@@ -373,34 +554,76 @@ async def read_measurements(request, values):
     )
 
 
+@validation.validate(schema=validation.ReadMeasurementsLatestRequest)
+async def read_measurements_latest(request, values):
+    query, arguments = database.parametrize(
+        identifier="read-measurements-latest",
+        arguments={"sensor_identifier": values.path["sensor_identifier"]},
+    )
+    elements = await request.state.dbpool.fetch(query, *arguments)
+    # Return successful response
+    return utils.JSONResponse(
+        status_code=200,
+        content={
+            element["attribute"]: {
+                "value": element["value"],
+                "revision": element["revision"],
+                "creation_timestamp": element["creation_timestamp"],
+            }
+            for element in elements
+        },
+    )
+
+
+@validation.validate(schema=validation.ExportMeasurementsRequest)
+async def export_measurements(request, values):
+    # Export a single sensor or all sensors of the network
+    if values.path["sensor_identifier"] is not None:
+        sensor_identifiers = [values.path["sensor_identifier"]]
+    else:
+        query, arguments = database.parametrize(
+            identifier="read-sensors",
+            arguments={"network_identifier": values.path["network_identifier"]},
+        )
+        elements = await request.state.dbpool.fetch(query, *arguments)
+        sensor_identifiers = [element["sensor_identifier"] for element in elements]
+    encoder = export.FORMATS[values.query["format"]]()
+    # Stream the response; Errors after this point can't change the status code
+    return starlette.responses.StreamingResponse(
+        content=export.stream(
+            dbpool=request.state.dbpool,
+            encoder=encoder,
+            sensor_identifiers=sensor_identifiers,
+            start_timestamp=values.query["start_timestamp"],
+            end_timestamp=values.query["end_timestamp"],
+        ),
+        media_type=encoder.media_type,
+        headers={
+            "Content-Disposition": (
+                f"attachment; filename=measurements.{values.query['format']}"
+            )
+        },
+    )
+
+
 @validation.validate(schema=validation.ReadLogsRequest)
 async def read_logs(request, values):
     query, arguments = database.parametrize(
-        identifier="read-logs",
+        identifier=f"read-logs-{values.query['direction']}",
         arguments={
             "sensor_identifier": values.path["sensor_identifier"],
             "creation_timestamp": values.query["creation_timestamp"],
-            "direction": values.query["direction"],
+            "log_identifier": values.query["log_identifier"],
+            "limit": values.query["limit"],
         },
     )
     elements = await request.state.dbpool.fetch(query, *arguments)
-    elements = database.dictify(
-        elements if values.query["direction"] == "next" else reversed(elements)
-    )
-    elements = [
-        {
-            "severity": element["severity"],
-            "revision": element["revision"],
-            "creation_timestamp": element["creation_timestamp"],
-            "subject": element["message"],
-            "details": "",
-        }
-        for element in elements
-    ]
     # Return successful response
-    return starlette.responses.JSONResponse(
+    return utils.JSONResponse(
         status_code=200,
-        content=elements,
+        content=database.dictify(
+            elements if values.query["direction"] == "next" else reversed(elements)
+        ),
     )
 
 
@@ -411,24 +634,8 @@ async def read_logs_aggregates(request, values):
         arguments={"sensor_identifier": values.path["sensor_identifier"]},
     )
     elements = await request.state.dbpool.fetch(query, *arguments)
-    elements = database.dictify(elements)
-    elements = [
-        {
-            "severity": element["severity"],
-            "min_revision": element["min_revision"],
-            "max_revision": element["max_revision"],
-            "min_creation_timestamp": element["min_creation_timestamp"],
-            "max_creation_timestamp": element["max_creation_timestamp"],
-            "subject": element["message"],
-            "count": element["count"],
-        }
-        for element in elements
-    ]
     # Return successful response
-    return starlette.responses.JSONResponse(
-        status_code=200,
-        content=elements,
-    )
+    return utils.JSONResponse(status_code=200, content=database.dictify(elements))
 
 
 ROUTES = [
@@ -438,6 +645,11 @@ ROUTES = [
         endpoint=read_status,
         methods=["GET"],
     ),
+    starlette.routing.Route(
+        path="/metrics",
+        endpoint=read_metrics,
+        methods=["GET"],
+    ),
     starlette.routing.Route(
         path="/users",
         endpoint=create_user,
@@ -458,6 +670,11 @@ ROUTES = [
         endpoint=read_networks,
         methods=["GET"],
     ),
+    starlette.routing.Route(
+        path="/networks/{network_identifier}/overview",
+        endpoint=read_network_overview,
+        methods=["GET"],
+    ),
     starlette.routing.Route(
         path="/networks/{network_identifier}/sensors",
         endpoint=create_sensor,
@@ -488,6 +705,21 @@ ROUTES = [
         endpoint=read_measurements,
         methods=["GET"],
     ),
+    starlette.routing.Route(
+        path="/networks/{network_identifier}/sensors/{sensor_identifier}/measurements/latest",
+        endpoint=read_measurements_latest,
+        methods=["GET"],
+    ),
+    starlette.routing.Route(
+        path="/networks/{network_identifier}/sensors/{sensor_identifier}/measurements/export",
+        endpoint=export_measurements,
+        methods=["GET"],
+    ),
+    starlette.routing.Route(
+        path="/networks/{network_identifier}/measurements/export",
+        endpoint=export_measurements,
+        methods=["GET"],
+    ),
     starlette.routing.Route(
         path="/networks/{network_identifier}/sensors/{sensor_identifier}/logs",
         endpoint=read_logs,
@@ -502,26 +734,95 @@ ROUTES = [
 ]
 
 
+async def _cancel(task):
+    """Cancel the task and wait for it to finish."""
+    task.cancel()
+    try:
+        await task
+    except asyncio.CancelledError:
+        pass
+
+
 @contextlib.asynccontextmanager
-async def lifespan(app):
-    """Manage the lifetime of the database client and the MQTT client."""
-    async with database.pool() as dbpool, mqtt.client() as mqttc:
-        # Start MQTT listener in (unawaited) asyncio task
+async def pipeline(dbpool, mqttc, written=None):
+    """Run the stages that process incoming MQTT messages; Yield their state.
+
+    Written rows of all kinds are passed to the optional `written` callback
+    together with their kind.
+    """
+    registry = ingestion.Registry(
+        dbpool=dbpool,
+        capacity=settings.INGESTION_REGISTRY_SIZE,
+        timeout=settings.INGESTION_REGISTRY_TIMEOUT,
+    )
+    await registry.load()
+    deduplicator = ingestion.Deduplicator(
+        capacity=settings.INGESTION_DEDUPLICATION_SIZE,
+        columns=mqtt.MEASUREMENT_COLUMNS,
+        key=mqtt.MEASUREMENT_KEY,
+    )
+    latencies = ingestion.Latencies(capacity=settings.INGESTION_LATENCIES_SIZE)
+    async with mqtt.graveyard(dbpool, registry) as deadletters, mqtt.sinks(
+        dbpool, registry, deadletters, deduplicator, latencies, written
+    ) as sinks, ingestion.dispatcher(
+        concurrency=settings.INGESTION_CONCURRENCY,
+        capacity=settings.INGESTION_WORKER_QUEUE_SIZE,
+    ) as dispatcher:
+        queue = ingestion.Queue(
+            capacity=settings.INGESTION_QUEUE_SIZE, priorities=mqtt.PRIORITIES
+        )
+        # Start MQTT listener and dispatcher in (unawaited) asyncio tasks
         loop = asyncio.get_event_loop()
-        task = loop.create_task(mqtt.listen(mqttc, dbpool))
-        # Yield clients to application state
-        yield {"dbpool": dbpool, "mqttc": mqttc}
-        # Wait for the MQTT listener task to be cancelled when the app exits
-        task.cancel()
+        listener = loop.create_task(mqtt.listen(mqttc, queue))
+        consumer = loop.create_task(
+            mqtt.dispatch(queue, registry, dispatcher, sinks, deadletters, latencies)
+        )
+        yield {
+            "queue": queue,
+            "registry": registry,
+            "deduplicator": deduplicator,
+            "dispatcher": dispatcher,
+            "latencies": latencies,
+        }
+        # Stop listening, then give the queued messages some time to be processed
+        await _cancel(listener)
         try:
-            await task
-        except asyncio.CancelledError:
-            pass
+            await asyncio.wait_for(queue.join(), timeout=10)
+        except asyncio.TimeoutError:  # pragma: no cover
+            logger.warning("Shutting down with unprocessed messages in the queue")
+        await _cancel(consumer)
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    """Manage the lifetime of the database pool, MQTT client and background stages."""
+    async with database.pool() as dbpool, mqtt.client() as mqttc:
+        # Yield clients and the stages of the configured roles to application state
+        state = {"dbpool": dbpool, "mqttc": mqttc, **auth.caches()}
+        async with contextlib.AsyncExitStack() as stack:
+            if "api" in settings.ROLES:
+                state["hasher"] = stack.enter_context(
+                    auth.hasher(
+                        concurrency=settings.PASSWORD_HASHING_CONCURRENCY,
+                        capacity=settings.PASSWORD_HASHING_QUEUE_SIZE,
+                    )
+                )
+                state["publisher"] = await stack.enter_async_context(
+                    mqtt.publisher(dbpool, mqttc)
+                )
+            if "ingestion" in settings.ROLES:
+                state.update(await stack.enter_async_context(pipeline(dbpool, mqttc)))
+            yield state
 
 
 logger = logging.getLogger(__name__)
 logs.configure()
 
+# Replicas that only process incoming messages serve just the status routes, replicas
+# that only serve the API report only the authentication metrics
+if "api" not in settings.ROLES:
+    ROUTES = [route for route in ROUTES if route.path in ("/status", "/metrics")]
+
 app = starlette.applications.Starlette(
     routes=ROUTES,
     lifespan=lifespan,
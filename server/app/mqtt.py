@@ -1,16 +1,23 @@
 import asyncio
 import contextlib
+import functools
 import json
 import logging
+import os
+import re
+import socket
 import ssl
+import time
 
 import aiomqtt
 import asyncpg
-import pydantic
 
 import app.database as database
+import app.ingestion as ingestion
 import app.settings as settings
+import app.utils as utils
 import app.validation as validation
+import app.validation.constants as constants
 
 
 def _encode_payload(payload):
@@ -19,7 +26,6 @@ def _encode_payload(payload):
 
 
 logger = logging.getLogger(__name__)
-task_references = set()
 
 
 @contextlib.asynccontextmanager
@@ -41,169 +47,609 @@ async def client():
             else None
         ),
         # Make the MQTT connection persistent. The broker will retain messages on
-        # topics we subscribed to in case we disconnect.
-        clean_start=False,
-        client_id="server",
+        # topics we subscribed to in case we disconnect. With multiple replicas, the
+        # other members of the shared subscription group take over instead.
+        clean_start=not _persistent(),
+        client_id=_client_identifier(),
     ) as x:
         yield x
 
 
-async def publish_configuration(
-    sensor_identifier, revision, configuration, mqttc, dbpool
-):
-    """Publish a configuration to the specified sensor."""
+def _persistent():
+    """Return True if this is the only server process that subscribes to topics."""
+    return settings.MQTT_SHARE_GROUP is None and "ingestion" in settings.ROLES
+
+
+def _client_identifier():
+    """Return the MQTT client identifier of this server process.
+
+    A single server uses a fixed identifier so that its session persists across
+    restarts. When there are multiple processes, each needs its own identifier, as
+    the broker disconnects clients whose identifier is taken over.
+    """
+    if _persistent():
+        return "server"
+    return f"server-{socket.gethostname()}-{os.getpid()}"
+
+
+class Publisher:
+    """Publish new configurations to their sensors.
+
+    Configurations without publication timestamp form an outbox in the database, so
+    pending configurations are not lost when the server restarts. Only the newest
+    pending revision per sensor is published; Sensors would ignore the older ones
+    anyways. The outbox is drained every `interval` seconds or when `notify` is
+    called, in batches that are published together and then marked in bulk. The
+    skipped revisions are marked together with the revision that superseded them.
+    """
 
-    async def helper(sensor_identifier, revision, configuration):
+    def __init__(self, dbpool, mqttc, batch_size, interval):
+        self.dbpool = dbpool
+        self.mqttc = mqttc
+        self.batch_size = batch_size
+        self.interval = interval
+        self._event = asyncio.Event()
+
+    def notify(self):
+        """Wake the publisher up, e.g. after a new configuration was created."""
+        self._event.set()
+
+    async def drain(self):
+        """Publish pending configurations until the outbox is empty."""
+        while True:
+            query, arguments = database.parametrize(
+                identifier="read-configurations-unpublished",
+                arguments={"batch_size": self.batch_size},
+            )
+            elements = await self.dbpool.fetch(query, *arguments)
+            if len(elements) == 0:
+                return
+            # Duplicate messages are not a problem, the sensor can ignore them based
+            # on the revision number. The revision number only increases.
+            await asyncio.gather(
+                *[
+                    self.mqttc.publish(
+                        topic=(
+                            f"{settings.MQTT_BASE_TOPIC}configurations/"
+                            f"{element['sensor_identifier']}"
+                        ),
+                        payload=_encode_payload(
+                            {
+                                "revision": element["revision"],
+                                "configuration": element["value"],
+                            }
+                        ),
+                        qos=1,
+                        retain=True,
+                    )
+                    for element in elements
+                ]
+            )
+            query, arguments = database.parametrize(
+                identifier="update-configurations-on-publication",
+                arguments={
+                    "sensor_identifiers": [
+                        element["sensor_identifier"] for element in elements
+                    ],
+                    "revisions": [element["revision"] for element in elements],
+                },
+            )
+            await self.dbpool.execute(query, *arguments)
+            logger.info(f"Published {len(elements)} configuration(s)")
+
+    async def run(self):
+        """Drain the outbox whenever notified or periodically, until cancelled."""
         backoff = 1
-        query, arguments = database.parametrize(
-            identifier="update-configuration-on-publication",
-            arguments={
-                "sensor_identifier": sensor_identifier,
-                "revision": revision,
-            },
-        )
         while True:
+            with contextlib.suppress(asyncio.TimeoutError):
+                await asyncio.wait_for(self._event.wait(), timeout=self.interval)
+            self._event.clear()
             try:
-                # Try to publish the configuration
-                await mqttc.publish(
-                    topic=f"{settings.MQTT_BASE_TOPIC}configurations/{sensor_identifier}",
-                    payload=_encode_payload(
-                        {"revision": revision, "configuration": configuration}
-                    ),
-                    qos=1,
-                    retain=True,
-                )
-                # Try to set the publication timestamp in the database
-                await dbpool.execute(query, *arguments)
-                logger.info(f"Published configuration {sensor_identifier}#{revision}")
-                break
+                await self.drain()
+                backoff = 1
             except Exception as e:  # pragma: no cover
-                # Retry if something fails. Duplicate messages are not a problem,
-                # the sensor can ignore them based on the revision number.
-                # The revision number only increases, never decreases.
                 logger.warning(
-                    f"Failed to publish configuration {sensor_identifier}#{revision},"
-                    f" retrying in {backoff} seconds: {repr(e)}"
+                    f"Failed to publish configurations, retrying in {backoff}"
+                    f" seconds: {repr(e)}"
                 )
                 # Backoff exponentially, up until about 5 minutes
+                await asyncio.sleep(backoff)
                 if backoff < 256:
                     backoff *= 2
-                await asyncio.sleep(backoff)
+                self.notify()
+
 
-    # Fire-and-forget the retry task, save the reference, and return immediately
-    task = asyncio.create_task(helper(sensor_identifier, revision, configuration))
-    task_references.add(task)
-    task.add_done_callback(task_references.remove)
+@contextlib.asynccontextmanager
+async def publisher(dbpool, mqttc):
+    """Context manager for a publisher that drains the outbox in the background."""
+    x = Publisher(
+        dbpool=dbpool,
+        mqttc=mqttc,
+        batch_size=settings.PUBLICATION_BATCH_SIZE,
+        interval=settings.PUBLICATION_INTERVAL,
+    )
+    # Resume publishing the configurations that were pending before a restart
+    x.notify()
+    task = asyncio.create_task(x.run())
+    try:
+        yield x
+    finally:
+        task.cancel()
+        with contextlib.suppress(asyncio.CancelledError):
+            await task
 
 
-async def _process_acknowledgments(sensor_identifier, payload, dbpool):
+async def _process_acknowledgments(rows, dbpool, registry, deadletters, written):
+    logger.info(f"Received {len(rows)} acknowledgment(s) from sensor {rows[0][0]}")
     query, arguments = database.parametrize(
         identifier="update-configuration-on-acknowledgment",
         arguments=[
             {
                 "sensor_identifier": sensor_identifier,
-                "revision": element.revision,
-                "acknowledgment_timestamp": element.timestamp,
-                "success": element.success,
+                "revision": revision,
+                "acknowledgment_timestamp": timestamp,
+                "success": success,
             }
-            for element in payload
+            for sensor_identifier, revision, timestamp, success, _ in rows
         ],
     )
     try:
         await dbpool.executemany(query, arguments)
     except asyncpg.ForeignKeyViolationError:
-        logger.warning(f"Failed to process; Sensor not found: {sensor_identifier}")
+        logger.warning(f"Failed to process; Sensor not found: {rows[0][0]}")
+        registry.discard(rows[0][0])
+    except Exception as e:
+        logger.error(f"Failed to write acknowledgments: {e!r}")
+        await _bury("acknowledgments", _encode_acknowledgments, deadletters)(rows, e)
+    else:
+        if written is not None:
+            written("acknowledgments", rows)
 
 
-async def _process_measurements(sensor_identifier, payload, dbpool):
-    query, arguments = database.parametrize(
-        identifier="create-measurement",
-        arguments=[
+# Column order of the rows returned by the decoders, see `app/validation/mqtt.py`;
+# Sensor identifiers and attribute names are replaced by their surrogate keys when
+# the measurements are written, see `sinks`
+MEASUREMENT_COLUMNS = (
+    "sensor_number",
+    "attribute_identifier",
+    "value",
+    "revision",
+    "creation_timestamp",
+    "receipt_timestamp",
+)
+# Measurements are unique by sensor, attribute and creation timestamp
+MEASUREMENT_KEY = ("sensor_number", "attribute_identifier", "creation_timestamp")
+# Log messages are written as references to the interned message, see `sinks`
+LOG_COLUMNS = (
+    "sensor_identifier",
+    "severity",
+    "message_identifier",
+    "revision",
+    "creation_timestamp",
+    "receipt_timestamp",
+)
+
+
+async def _process_measurements(rows, deduplicator, batcher):
+    await batcher.put(deduplicator.filter(rows))
+
+
+def _compact(registry, attributes):
+    """Return a function that replaces the sensor identifiers and attribute names of
+    measurement rows with their surrogate keys."""
+
+    async def helper(rows):
+        attribute_identifiers = await attributes.encode({row[1] for row in rows})
+        records = []
+        missing = set()
+        for row in rows:
+            sensor_number = registry.number(row[0])
+            # The sensor was deleted since its message was received
+            if sensor_number is None:
+                missing.add(row[0])
+                continue
+            records.append((sensor_number, attribute_identifiers[row[1]], *row[2:]))
+        for sensor_identifier in missing:
+            logger.warning(f"Failed to process; Sensor not found: {sensor_identifier}")
+        return records
+
+    return helper
+
+
+def _committed(kind, latencies, written):
+    """Return a callback that records the commit latency of written rows."""
+
+    def helper(rows):
+        timestamp = utils.timestamp()
+        # Rows of one message share the sensor and the receipt timestamp
+        for sensor_identifier, receipt_timestamp in {(row[0], row[-1]) for row in rows}:
+            latencies.record(
+                "commit", kind, sensor_identifier, timestamp - receipt_timestamp
+            )
+        if written is not None:
+            written(kind, rows)
+
+    return helper
+
+
+@contextlib.asynccontextmanager
+async def sinks(dbpool, registry, deadletters, deduplicator, latencies, written=None):
+    """Context manager for the stages that write decoded rows to the database.
+
+    Measurements and logs are written in bulk, acknowledgments immediately. Sensors
+    that turn out to not exist anymore are discarded from the registry. Rows that
+    fail to be written for any other reason are kept as dead letters. Duplicate
+    measurements are filtered out by the deduplicator or skipped by the database.
+    Measurements reference sensors and attributes by compact surrogate keys. The
+    latest value of each attribute of each sensor is kept in a separate table. Log
+    messages repeat a lot and are stored once, the logs only reference them.
+
+    The time from receipt until measurements and logs are committed is recorded in
+    `latencies`. Written rows of all kinds are also passed to the optional `written`
+    callback together with their kind.
+    """
+    async with ingestion.batcher(
+        dbpool=dbpool,
+        table="measurement",
+        columns=MEASUREMENT_COLUMNS,
+        capacity=settings.INGESTION_BATCH_SIZE,
+        timeout=settings.INGESTION_BATCH_TIMEOUT,
+        missing=registry.discard,
+        failed=_bury("measurements", _encode_measurements, deadletters),
+        idempotent=True,
+        written=_committed("measurements", latencies, written),
+        prepare=_compact(
+            registry=registry,
+            attributes=ingestion.Dictionary(
+                dbpool=dbpool, query="create-attributes", argument="attribute_names"
+            ),
+        ),
+        committed=ingestion.Snapshot(
+            dbpool=dbpool,
+            query="upsert-measurements-latest",
+            columns=MEASUREMENT_COLUMNS,
+            key=("sensor_number", "attribute_identifier"),
+            order="creation_timestamp",
+        ),
+    ) as measurements, ingestion.batcher(
+        dbpool=dbpool,
+        table="log",
+        columns=LOG_COLUMNS,
+        capacity=settings.INGESTION_BATCH_SIZE,
+        timeout=settings.INGESTION_BATCH_TIMEOUT,
+        missing=registry.discard,
+        failed=_bury("logs", _encode_logs, deadletters),
+        written=_committed("logs", latencies, written),
+        prepare=ingestion.Interner(
+            dbpool=dbpool,
+            table="log_message",
+            column="message",
+            index=LOG_COLUMNS.index("message_identifier"),
+            capacity=settings.INGESTION_INTERNING_SIZE,
+        ),
+    ) as logs:
+        yield {
+            "acknowledgments": functools.partial(
+                _process_acknowledgments,
+                dbpool=dbpool,
+                registry=registry,
+                deadletters=deadletters,
+                written=written,
+            ),
+            "measurements": functools.partial(
+                _process_measurements, deduplicator=deduplicator, batcher=measurements
+            ),
+            "logs": logs.put,
+        }
+
+
+########################################################################################
+# Dead letters
+########################################################################################
+
+
+DEAD_LETTER_COLUMNS = (
+    "sensor_identifier",
+    "kind",
+    "payload",
+    "error",
+    "receipt_timestamp",
+)
+
+
+@contextlib.asynccontextmanager
+async def graveyard(dbpool, registry, written=None):
+    """Context manager for the stage that keeps messages that couldn't be processed.
+
+    Dead letters are stored with their original payload, so that they can be
+    replayed once the cause is fixed, see `replay`. They're written in bulk, so that
+    a burst of malformed messages doesn't cause a burst of inserts. Written dead
+    letters are passed to the optional `written` callback.
+    """
+    async with ingestion.batcher(
+        dbpool=dbpool,
+        table="dead_letter",
+        columns=DEAD_LETTER_COLUMNS,
+        capacity=settings.INGESTION_BATCH_SIZE,
+        timeout=settings.INGESTION_BATCH_TIMEOUT,
+        missing=registry.discard,
+        written=written,
+    ) as x:
+        yield x
+
+
+def _encode_measurements(rows):
+    """Encode the rows of a single message back into its measurements payload."""
+    elements = {}
+    for _, attribute, value, revision, creation_timestamp, _ in rows:
+        elements.setdefault((revision, creation_timestamp), {})[attribute] = value
+    return _encode_payload(
+        [
+            {"revision": revision, "timestamp": creation_timestamp, "value": value}
+            for (revision, creation_timestamp), value in elements.items()
+        ]
+    )
+
+
+def _encode_logs(rows):
+    """Encode the rows of a single message back into its logs payload."""
+    return _encode_payload(
+        [
             {
-                "sensor_identifier": sensor_identifier,
-                "attribute": attribute,
-                "value": value,
-                "revision": element.revision,
-                "creation_timestamp": element.timestamp,
+                "severity": severity,
+                "message": message,
+                "revision": revision,
+                "timestamp": creation_timestamp,
             }
-            for element in payload
-            for attribute, value in element.value.items()
-        ],
+            for _, severity, message, revision, creation_timestamp, _ in rows
+        ]
     )
+
+
+def _encode_acknowledgments(rows):
+    """Encode the rows of a single message back into its acknowledgments payload."""
+    return _encode_payload(
+        [
+            {"revision": revision, "timestamp": acknowledgment_timestamp, "success": x}
+            for _, revision, acknowledgment_timestamp, x, _ in rows
+        ]
+    )
+
+
+def _bury(kind, encode, deadletters):
+    """Return a callback that keeps rows that failed to be written as dead letters.
+
+    The rows are regrouped into their original messages by sensor identifier and
+    receipt timestamp, which are the first and last column.
+    """
+
+    async def helper(rows, error):
+        messages = {}
+        for row in rows:
+            messages.setdefault((row[0], row[-1]), []).append(row)
+        await deadletters.put(
+            [
+                (sensor_identifier, kind, encode(group), repr(error), receipt_timestamp)
+                for (sensor_identifier, receipt_timestamp), group in messages.items()
+            ]
+        )
+
+    return helper
+
+
+async def _decode(
+    kind, decode, sensor_identifier, payload, receipt_timestamp, deadletters
+):
+    """Decode the payload into rows; Keep it as dead letter if that fails."""
     try:
-        await dbpool.executemany(query, arguments)
-    except asyncpg.ForeignKeyViolationError:
-        logger.warning(f"Failed to process; Sensor not found: {sensor_identifier}")
+        return decode(payload, sensor_identifier, receipt_timestamp)
+    # Errors are logged and ignored as we can't give feedback
+    except ValueError as e:
+        logger.warning(f"Malformed message: {payload!r}")
+        await deadletters.put(
+            [(sensor_identifier, kind, payload, repr(e), receipt_timestamp)]
+        )
+        return None
+
+
+async def replay(dbpool, kinds, batch_size):
+    """Run the dead letters of the given kinds through the ingestion again.
+
+    Dead letters are read in batches of `batch_size` and their rows are written in
+    bulk with the same sinks as live messages. Dead letters that fail again are kept
+    as new dead letters. After all rows have been written, the replayed dead letters
+    whose rows were written or kept again are deleted; The others, e.g. of sensors
+    that weren't found, remain. Return the number of deleted dead letters.
+    """
+    registry = ingestion.Registry(
+        dbpool=dbpool,
+        capacity=settings.INGESTION_REGISTRY_SIZE,
+        timeout=settings.INGESTION_REGISTRY_TIMEOUT,
+    )
+    await registry.load()
+    deduplicator = ingestion.Deduplicator(
+        capacity=settings.INGESTION_DEDUPLICATION_SIZE,
+        columns=MEASUREMENT_COLUMNS,
+        key=MEASUREMENT_KEY,
+    )
+    replayed = []
+    # Messages are identified by their kind, sensor and receipt timestamp
+    messages = {}
+    processed = set()
+
+    def buried(rows):
+        processed.update((row[1], row[0], row[-1]) for row in rows)
 
+    def written(kind, rows):
+        processed.update((kind, row[0], row[-1]) for row in rows)
 
-async def _process_logs(sensor_identifier, payload, dbpool):
+    async with graveyard(dbpool, registry, buried) as deadletters, sinks(
+        dbpool, registry, deadletters, deduplicator, ingestion.Latencies(), written
+    ) as x:
+        # Don't pick up the dead letters that we create ourselves while replaying
+        query, arguments = database.parametrize(
+            identifier="read-dead-letters-maximum", arguments={}
+        )
+        maximum = await dbpool.fetchval(query, *arguments)
+        while True:
+            query, arguments = database.parametrize(
+                identifier="read-dead-letters",
+                arguments={
+                    "dead_letter_identifier": replayed[-1] if replayed else 0,
+                    "maximum_dead_letter_identifier": maximum,
+                    "kinds": kinds,
+                    "batch_size": batch_size,
+                },
+            )
+            elements = await dbpool.fetch(query, *arguments)
+            if len(elements) == 0:
+                break
+            for element in elements:
+                replayed.append(element["dead_letter_identifier"])
+                key = (
+                    element["kind"],
+                    element["sensor_identifier"],
+                    element["receipt_timestamp"],
+                )
+                messages.setdefault(key, []).append(element["dead_letter_identifier"])
+                rows = await _decode(
+                    kind=element["kind"],
+                    decode=SUBSCRIPTIONS[element["kind"]],
+                    sensor_identifier=element["sensor_identifier"],
+                    payload=element["payload"],
+                    receipt_timestamp=element["receipt_timestamp"],
+                    deadletters=deadletters,
+                )
+                if rows is not None:
+                    await x[element["kind"]](rows)
+    identifiers = [
+        identifier
+        for key in messages.keys() & processed
+        for identifier in messages[key]
+    ]
     query, arguments = database.parametrize(
-        identifier="create-log",
-        arguments=[
-            {
-                "sensor_identifier": sensor_identifier,
-                "message": element.message,
-                "revision": element.revision,
-                "creation_timestamp": element.timestamp,
-                "severity": element.severity,
-            }
-            for element in payload
-        ],
+        identifier="delete-dead-letters",
+        arguments={"dead_letter_identifiers": identifiers},
     )
-    try:
-        await dbpool.executemany(query, arguments)
-    except asyncpg.ForeignKeyViolationError:
-        logger.warning(f"Failed to process; Sensor not found: {sensor_identifier}")
+    await dbpool.execute(query, *arguments)
+    return len(identifiers)
 
 
+# Index of the creation timestamp in the decoded rows of each message kind
+_CREATION_TIMESTAMP = {"acknowledgments": 2, "measurements": 4, "logs": 4}
+# Incoming message kinds with their decoder; The MQTT topic of each kind is
+# `<base-topic><kind>/<sensor-identifier>`
 SUBSCRIPTIONS = {
-    "acknowledgments/+": (
-        _process_acknowledgments,
-        validation.AcknowledgmentsValidator,
-    ),
-    "measurements/+": (
-        _process_measurements,
-        validation.MeasurementsValidator,
-    ),
-    "logs/+": (
-        _process_logs,
-        validation.LogsValidator,
-    ),
+    "acknowledgments": validation.decode_acknowledgments,
+    "measurements": validation.decode_measurements,
+    "logs": validation.decode_logs,
 }
+# Message kinds from lowest to highest priority; When the ingestion queue is full,
+# messages with lower priority are dropped first
+PRIORITIES = ("logs", "measurements", "acknowledgments")
+
+
+class Router:
+    """Resolve the topics of incoming messages to kind, decoder and sensor.
+
+    The topic pattern is compiled once from the base topic and the subscribed kinds,
+    so that each message is resolved in a single match. Topics whose last level is
+    not a valid sensor identifier (a version 4 UUID) don't match. If `share` is
+    given, the wildcards subscribe via the shared subscription group of that name.
+    """
+
+    def __init__(self, base, subscriptions, share=None):
+        self.subscriptions = subscriptions
+        # Shared subscriptions are only prefixed when subscribing, the broker sends
+        # messages with their regular topic
+        prefix = "" if share is None else f"$share/{share}/"
+        self.wildcards = [f"{prefix}{base}{kind}/+" for kind in subscriptions]
+        kinds = "|".join(re.escape(kind) for kind in subscriptions)
+        # Strip the anchors, we match the whole topic anyways
+        identifier = constants.Pattern.IDENTIFIER.value[1:-1]
+        self._pattern = re.compile(f"{re.escape(base)}({kinds})/({identifier})")
+
+    def resolve(self, topic):
+        """Return the kind, decoder and sensor identifier; None if there's no match."""
+        match = self._pattern.fullmatch(topic)
+        if match is None:
+            return None
+        kind, sensor_identifier = match.groups()
+        return kind, self.subscriptions[kind], sensor_identifier
+
 
+async def listen(mqttc, queue):
+    """Listen to incoming MQTT messages from sensors and queue them for processing.
 
-async def listen(mqttc, dbpool):
-    """Listen to and handle incoming MQTT messages from sensors."""
+    Putting messages in the queue never blocks, so that we keep up with the broker
+    even when the database is slow; Excess messages are dropped by priority instead.
+    """
     async with mqttc.messages() as messages:
         # ensure base topic ends with a trailing slash
         if len(settings.MQTT_BASE_TOPIC) > 0 and settings.MQTT_BASE_TOPIC[-1] != "/":
             settings.MQTT_BASE_TOPIC += "/"
-
+        router = Router(
+            settings.MQTT_BASE_TOPIC, SUBSCRIPTIONS, share=settings.MQTT_SHARE_GROUP
+        )
         # Subscribe to all topics
-        for wildcard in SUBSCRIPTIONS.keys():
-            await mqttc.subscribe(settings.MQTT_BASE_TOPIC + wildcard, qos=1, timeout=10)
-            logger.info(f"Subscribed to: {settings.MQTT_BASE_TOPIC + wildcard}")
+        for wildcard in router.wildcards:
+            await mqttc.subscribe(wildcard, qos=1, timeout=10)
+            logger.info(f"Subscribed to: {wildcard}")
         # Loop through incoming messages
         async for message in messages:
-            # TODO: Remove condition when there's no more logs limit
-            if not message.topic.matches(list(SUBSCRIPTIONS.keys())[1]):
-                logger.info(
-                    f"Received message: {message.payload!r} on topic: {message.topic}"
-                )
-            # Get sensor identifier from the topic
-            # TODO validate that identifier is a valid UUID format
-            sensor_identifier = str(message.topic).split("/")[-1]
-            # Call the appropriate processor; First match wins
-            for wildcard, (process, validator) in SUBSCRIPTIONS.items():
-                if message.topic.matches(settings.MQTT_BASE_TOPIC + wildcard):
-                    try:
-                        payload = validator.validate_json(message.payload)
-                        await process(sensor_identifier, payload, dbpool)
-                    # Errors are logged and ignored as we can't give feedback
-                    except pydantic.ValidationError:
-                        logger.warning(f"Malformed message: {message.payload!r}")
-                    except Exception as e:  # pragma: no cover
-                        logger.error(e, exc_info=True)
-                    break
-            else:  # Executed if no break is called
+            route = router.resolve(message.topic.value)
+            if route is None:
                 logger.warning(f"Failed to match topic: {message.topic}")
+                continue
+            kind, decode, sensor_identifier = route
+            timestamp = utils.timestamp()
+            element = (kind, decode, sensor_identifier, message.payload, timestamp)
+            # Queue the message for the appropriate processor
+            if not queue.put(kind, element):
+                logger.warning(f"Dropped message; Queue is full: {kind}")
+
+
+async def dispatch(queue, registry, dispatcher, sinks, deadletters, latencies):
+    """Decode queued messages and hand them to the dispatcher.
+
+    Messages from sensors that don't exist are dropped before they're decoded.
+    Messages that fail to decode are kept as dead letters. The time messages of
+    existing sensors spend in transit from the sensor, in the queue and in
+    validation is recorded in `latencies`.
+    """
+    while True:
+        kind, decode, sensor_identifier, payload, receipt_timestamp = await queue.get()
+        timestamp = utils.timestamp()
+        try:
+            # Don't record latencies of unknown sensors, anyone can publish to any
+            # sensor identifier
+            if not await registry.contains(sensor_identifier):
+                continue
+            latencies.record(
+                "queueing", kind, sensor_identifier, timestamp - receipt_timestamp
+            )
+            start = time.perf_counter()
+            rows = await _decode(
+                kind, decode, sensor_identifier, payload, receipt_timestamp, deadletters
+            )
+            latencies.record(
+                "validation", kind, sensor_identifier, time.perf_counter() - start
+            )
+            if rows is not None:
+                # Messages can contain multiple elements that were created separately
+                index = _CREATION_TIMESTAMP[kind]
+                for creation_timestamp in {row[index] for row in rows}:
+                    latencies.record(
+                        "transit",
+                        kind,
+                        sensor_identifier,
+                        receipt_timestamp - creation_timestamp,
+                    )
+                # Process concurrently across sensors, but in order per sensor
+                await dispatcher.put(sensor_identifier, sinks[kind], rows)
+        # Errors are logged and ignored so that the consumer keeps running, e.g. when
+        # the registry's database lookup fails
+        except Exception as e:
+            logger.error(e, exc_info=True)
+        finally:
+            queue.task_done()
@@ -1,32 +1,155 @@
--- name: aggregate-measurements
+-- name: aggregate-measurements-rollup
+-- Read the aggregates of a sensor's measurements within a time range from one of the
+-- rollups, see `main._rollup`, and combine them into buckets of the given width in
+-- seconds, which is a multiple of the rollup's. The rollup's view is inserted by name,
+-- see `main.ROLLUPS`. Buckets that overlap the start are included; Without attribute
+-- names, all attributes are included
 SELECT
-    attribute,
-    array_agg(
-        jsonb_build_object('bucket_timestamp', bucket_timestamp, 'average', average)
-        ORDER BY bucket_timestamp ASC
-    ) AS values
-FROM measurement_aggregation_1_hour
+    attribute.name AS attribute,
+    time_bucket(
+        make_interval(secs => ${width}), aggregation.bucket_timestamp
+    ) AS bucket_timestamp,
+    sum(aggregation.total) / sum(aggregation.count) AS average,
+    min(aggregation.minimum) AS minimum,
+    max(aggregation.maximum) AS maximum,
+    sum(aggregation.count)::BIGINT AS count
+FROM ${rollup} AS aggregation
+INNER JOIN attribute ON aggregation.attribute_identifier = attribute.identifier
 WHERE
-    sensor_identifier = ${sensor_identifier}
-    AND bucket_timestamp > now() - INTERVAL '4 weeks'
-GROUP BY attribute;
+    aggregation.sensor_number = (
+        SELECT number
+        FROM sensor
+        WHERE identifier = ${sensor_identifier}
+    )
+    AND aggregation.bucket_timestamp >= time_bucket(
+        make_interval(secs => ${width}), ${start_timestamp}::TIMESTAMPTZ
+    )
+    AND aggregation.bucket_timestamp < ${end_timestamp}
+    AND (
+        ${attribute_names}::TEXT[] IS NULL
+        OR attribute.name = any(${attribute_names}::TEXT[])
+    )
+GROUP BY
+    attribute.name,
+    time_bucket(make_interval(secs => ${width}), aggregation.bucket_timestamp)
+ORDER BY attribute.name ASC, bucket_timestamp ASC;
+
+
+-- name: aggregate-measurements-raw
+-- Aggregate a sensor's raw measurements like the rollups, for statistics that can't
+-- be combined from the rollups and for widths that aren't a multiple of theirs. The
+-- percentiles are given as fractions between 0 and 1
+SELECT
+    attribute.name AS attribute,
+    time_bucket(
+        make_interval(secs => ${width}), measurement.creation_timestamp
+    ) AS bucket_timestamp,
+    avg(measurement.value) AS average,
+    min(measurement.value) AS minimum,
+    max(measurement.value) AS maximum,
+    count(*) AS count,
+    stddev_samp(measurement.value) AS deviation,
+    percentile_cont(${percentiles}::DOUBLE PRECISION[])
+        WITHIN GROUP (ORDER BY measurement.value) AS percentiles
+FROM measurement
+INNER JOIN attribute ON measurement.attribute_identifier = attribute.identifier
+WHERE
+    measurement.sensor_number = (
+        SELECT number
+        FROM sensor
+        WHERE identifier = ${sensor_identifier}
+    )
+    AND measurement.creation_timestamp >= time_bucket(
+        make_interval(secs => ${width}), ${start_timestamp}::TIMESTAMPTZ
+    )
+    AND measurement.creation_timestamp < ${end_timestamp}
+    AND (
+        ${attribute_names}::TEXT[] IS NULL
+        OR attribute.name = any(${attribute_names}::TEXT[])
+    )
+GROUP BY
+    attribute.name,
+    time_bucket(make_interval(secs => ${width}), measurement.creation_timestamp)
+ORDER BY attribute.name ASC, bucket_timestamp ASC;
 
 
 -- name: aggregate-logs
 SELECT
-    severity,
-    message,
-    first(revision, creation_timestamp) AS min_revision,
-    last(revision, creation_timestamp) AS max_revision,
-    min(creation_timestamp) AS min_creation_timestamp,
-    max(creation_timestamp) AS max_creation_timestamp,
-    count(*) AS count
-FROM log
+    aggregation.severity,
+    aggregation.min_revision,
+    aggregation.max_revision,
+    aggregation.min_creation_timestamp,
+    aggregation.max_creation_timestamp,
+    log_message.message AS subject,
+    aggregation.count
+FROM (
+    SELECT
+        severity,
+        message_identifier,
+        first(revision, creation_timestamp) AS min_revision,
+        last(revision, creation_timestamp) AS max_revision,
+        min(creation_timestamp) AS min_creation_timestamp,
+        max(creation_timestamp) AS max_creation_timestamp,
+        count(*) AS count
+    FROM log
+    WHERE
+        sensor_identifier = ${sensor_identifier}
+        AND severity = any(ARRAY['warning', 'error'])
+    GROUP BY severity, message_identifier
+) AS aggregation
+INNER JOIN log_message ON aggregation.message_identifier = log_message.identifier
+ORDER BY aggregation.max_creation_timestamp ASC;
+
+
+-- name: aggregate-network-logs
+-- Like `aggregate-logs`, but for all sensors of the network in a single query
+SELECT
+    aggregation.sensor_identifier,
+    aggregation.severity,
+    log_message.message,
+    aggregation.min_revision,
+    aggregation.max_revision,
+    aggregation.min_creation_timestamp,
+    aggregation.max_creation_timestamp,
+    aggregation.count
+FROM (
+    SELECT
+        sensor_identifier,
+        severity,
+        message_identifier,
+        first(revision, creation_timestamp) AS min_revision,
+        last(revision, creation_timestamp) AS max_revision,
+        min(creation_timestamp) AS min_creation_timestamp,
+        max(creation_timestamp) AS max_creation_timestamp,
+        count(*) AS count
+    FROM log
+    WHERE
+        sensor_identifier IN (
+            SELECT identifier
+            FROM sensor
+            WHERE network_identifier = ${network_identifier}
+        )
+        AND severity = any(ARRAY['warning', 'error'])
+    GROUP BY sensor_identifier, severity, message_identifier
+) AS aggregation
+INNER JOIN log_message ON aggregation.message_identifier = log_message.identifier
+ORDER BY aggregation.max_creation_timestamp ASC;
+
+
+-- name: aggregate-network-measurements
+-- Read the hourly averages of all sensors of the network since the given timestamp
+SELECT
+    sensor.identifier AS sensor_identifier,
+    attribute.name AS attribute,
+    aggregation.bucket_timestamp,
+    aggregation.total / aggregation.count AS average
+FROM measurement_aggregation_1_hour AS aggregation
+INNER JOIN sensor ON aggregation.sensor_number = sensor.number
+INNER JOIN attribute ON aggregation.attribute_identifier = attribute.identifier
 WHERE
-    sensor_identifier = ${sensor_identifier}
-    AND severity = any(ARRAY['warning', 'error'])
-GROUP BY sensor_identifier, severity, message
-ORDER BY max_creation_timestamp ASC;
+    sensor.network_identifier = ${network_identifier}
+    AND aggregation.bucket_timestamp >= ${start_timestamp}
+ORDER BY attribute.name ASC, aggregation.bucket_timestamp ASC;
 
 
 -- name: read-sensors
@@ -37,6 +160,47 @@ FROM sensor
 WHERE sensor.network_identifier = ${network_identifier};
 
 
+-- name: read-user-sensor-identifiers
+SELECT sensor.identifier AS sensor_identifier
+FROM permission
+INNER JOIN sensor ON permission.network_identifier = sensor.network_identifier
+WHERE permission.user_identifier = ${user_identifier};
+
+
+-- name: read-sensor-identifiers
+SELECT
+    identifier AS sensor_identifier,
+    number AS sensor_number
+FROM sensor;
+
+
+-- name: read-sensor-number
+SELECT number AS sensor_number
+FROM sensor
+WHERE identifier = ${sensor_identifier};
+
+
+-- name: create-attributes
+-- Insert the attributes that don't exist yet and return the identifiers of all of
+-- them; The SELECT doesn't see the rows inserted by the same statement
+WITH inserted AS (
+    INSERT INTO attribute (name)
+    SELECT unnest(${attribute_names}::TEXT[])
+    ON CONFLICT DO NOTHING
+    RETURNING identifier, name
+)
+SELECT
+    name AS attribute_name,
+    identifier AS attribute_identifier
+FROM inserted
+UNION ALL
+SELECT
+    name AS attribute_name,
+    identifier AS attribute_identifier
+FROM attribute
+WHERE name = any(${attribute_names}::TEXT[]);
+
+
 -- name: create-network
 INSERT INTO network (
     identifier,
@@ -73,37 +237,18 @@ VALUES (
 );
 
 
--- name: create-log
-INSERT INTO log (
-    sensor_identifier,
-    severity,
-    message,
-    revision,
-    creation_timestamp,
-    receipt_timestamp
-)
-VALUES (
-    ${sensor_identifier},
-    ${severity},
-    ${message},
-    ${revision},
-    ${creation_timestamp},
-    now()
-);
-
-
 -- name: create-measurement
 INSERT INTO measurement (
-    sensor_identifier,
-    attribute,
+    sensor_number,
+    attribute_identifier,
     value,
     revision,
     creation_timestamp,
     receipt_timestamp
 )
 VALUES (
-    ${sensor_identifier},
-    ${attribute},
+    (SELECT number FROM sensor WHERE identifier = ${sensor_identifier}),
+    (SELECT identifier FROM attribute WHERE name = ${attribute}),
     ${value},
     ${revision},
     ${creation_timestamp},
@@ -124,7 +269,7 @@ VALUES (
     ${network_identifier},
     now()
 )
-RETURNING identifier AS sensor_identifier;
+RETURNING identifier AS sensor_identifier, number AS sensor_number;
 
 
 -- name: create-session
@@ -187,62 +332,213 @@ ORDER BY
 LIMIT 64;
 
 
--- name: read-measurements
--- Assemble data points that have the same timestamp and revision
--- back into measurements, then sort and paginate
+-- name: read-configurations-unpublished
+-- Select the oldest pending configurations, but only the newest revision per sensor;
+-- Older pending revisions are superseded and skipped
 SELECT
+    sensor_identifier,
+    value,
+    revision
+FROM configuration
+WHERE
+    publication_timestamp IS NULL
+    AND revision = (
+        SELECT max(revision)
+        FROM configuration AS latest
+        WHERE latest.sensor_identifier = configuration.sensor_identifier
+    )
+ORDER BY creation_timestamp ASC
+LIMIT ${batch_size};
+
+
+-- name: upsert-measurements-latest
+-- Keep the latest value of each attribute of each sensor, see `ingestion.Snapshot`
+INSERT INTO measurement_latest (
+    sensor_number,
+    attribute_identifier,
+    value,
     revision,
     creation_timestamp,
-    jsonb_object_agg(attribute, value) AS value
-FROM measurement
+    receipt_timestamp
+)
+SELECT * FROM unnest(
+    ${sensor_number}::INT[],
+    ${attribute_identifier}::SMALLINT[],
+    ${value}::DOUBLE PRECISION[],
+    ${revision}::INT[],
+    ${creation_timestamp}::TIMESTAMPTZ[],
+    ${receipt_timestamp}::TIMESTAMPTZ[]
+)
+ON CONFLICT (sensor_number, attribute_identifier) DO UPDATE
+SET
+    value = excluded.value,
+    revision = excluded.revision,
+    creation_timestamp = excluded.creation_timestamp,
+    receipt_timestamp = excluded.receipt_timestamp
+WHERE excluded.creation_timestamp > measurement_latest.creation_timestamp;
+
+
+-- name: read-measurements-latest
+SELECT
+    attribute.name AS attribute,
+    measurement_latest.value,
+    measurement_latest.revision,
+    measurement_latest.creation_timestamp
+FROM measurement_latest
+INNER JOIN attribute
+    ON measurement_latest.attribute_identifier = attribute.identifier
 WHERE
-    sensor_identifier = ${sensor_identifier}
-    AND CASE
-        WHEN ${creation_timestamp}::TIMESTAMPTZ IS NOT NULL
-            THEN (
-                CASE
-                    WHEN ${direction} = 'next'
-                        THEN creation_timestamp > ${creation_timestamp}
-                    WHEN ${direction} = 'previous'
-                        THEN creation_timestamp < ${creation_timestamp}
-                    ELSE TRUE
-                END
-            )
-        ELSE TRUE
-    END
-GROUP BY revision, creation_timestamp
-ORDER BY
-    CASE WHEN ${direction} = 'next' THEN creation_timestamp END ASC,
-    CASE WHEN ${direction} = 'previous' THEN creation_timestamp END DESC
-LIMIT 64;
+    measurement_latest.sensor_number = (
+        SELECT number
+        FROM sensor
+        WHERE identifier = ${sensor_identifier}
+    );
+
+
+-- name: read-network-measurements-latest
+SELECT
+    sensor.identifier AS sensor_identifier,
+    attribute.name AS attribute,
+    measurement_latest.value,
+    measurement_latest.revision,
+    measurement_latest.creation_timestamp
+FROM measurement_latest
+INNER JOIN sensor ON measurement_latest.sensor_number = sensor.number
+INNER JOIN attribute
+    ON measurement_latest.attribute_identifier = attribute.identifier
+WHERE sensor.network_identifier = ${network_identifier};
 
 
--- name: read-logs
+-- name: read-measurements-next
+-- Assemble data points that have the same timestamp back into measurements, then
+-- sort and paginate. Data points are unique by timestamp and attribute, so each
+-- measurement is unique by timestamp, which makes the timestamp a unique cursor.
+-- There is one query per direction, so that the planner can serve the range and the
+-- order with a single scan over the (sensor_number, creation_timestamp) index. The
+-- attribute names are looked up per row to not break the scan's order with a join
+SELECT
+    max(revision) AS revision,
+    creation_timestamp,
+    jsonb_object_agg(
+        (SELECT name FROM attribute WHERE identifier = attribute_identifier),
+        value
+    ) AS value
+FROM measurement
+WHERE
+    sensor_number = (
+        SELECT number
+        FROM sensor
+        WHERE identifier = ${sensor_identifier}
+    )
+    AND creation_timestamp
+        > coalesce(${creation_timestamp}::TIMESTAMPTZ, '-infinity')
+GROUP BY creation_timestamp
+ORDER BY creation_timestamp ASC
+LIMIT ${limit};
+
+
+-- name: read-measurements-previous
 SELECT
-    severity,
-    message,
+    max(revision) AS revision,
+    creation_timestamp,
+    jsonb_object_agg(
+        (SELECT name FROM attribute WHERE identifier = attribute_identifier),
+        value
+    ) AS value
+FROM measurement
+WHERE
+    sensor_number = (
+        SELECT number
+        FROM sensor
+        WHERE identifier = ${sensor_identifier}
+    )
+    AND creation_timestamp
+        < coalesce(${creation_timestamp}::TIMESTAMPTZ, 'infinity')
+GROUP BY creation_timestamp
+ORDER BY creation_timestamp DESC
+LIMIT ${limit};
+
+
+-- name: export-measurements
+-- Read a sensor's data points in the order of the unique index without grouping them
+-- into measurements, so that a server-side cursor can stream them without sorting
+SELECT
+    (SELECT name FROM attribute WHERE identifier = attribute_identifier) AS attribute,
+    value,
     revision,
     creation_timestamp
-FROM log
+FROM measurement
 WHERE
-    sensor_identifier = ${sensor_identifier}
-    AND CASE
-        WHEN ${creation_timestamp}::TIMESTAMPTZ IS NOT NULL
-            THEN (
-                CASE
-                    WHEN ${direction} = 'next'
-                        THEN creation_timestamp > ${creation_timestamp}
-                    WHEN ${direction} = 'previous'
-                        THEN creation_timestamp < ${creation_timestamp}
-                    ELSE TRUE
-                END
-            )
-        ELSE TRUE
-    END
-ORDER BY
-    CASE WHEN ${direction} = 'next' THEN creation_timestamp END ASC,
-    CASE WHEN ${direction} = 'previous' THEN creation_timestamp END DESC
-LIMIT 64;
+    sensor_number = (
+        SELECT number
+        FROM sensor
+        WHERE identifier = ${sensor_identifier}
+    )
+    AND creation_timestamp
+        >= coalesce(${start_timestamp}::TIMESTAMPTZ, '-infinity')
+    AND creation_timestamp < coalesce(${end_timestamp}::TIMESTAMPTZ, 'infinity')
+ORDER BY creation_timestamp ASC, attribute_identifier ASC;
+
+
+-- name: read-logs-next
+-- Page through the logs by (creation_timestamp, identifier), one query per direction
+-- like `read-measurements-next`. Without an identifier, all logs with the cursor's
+-- timestamp are skipped. The messages are joined only to the page
+SELECT
+    page.identifier AS log_identifier,
+    page.severity,
+    page.revision,
+    page.creation_timestamp,
+    log_message.message AS subject,
+    '' AS details
+FROM (
+    SELECT
+        identifier,
+        severity,
+        message_identifier,
+        revision,
+        creation_timestamp
+    FROM log
+    WHERE
+        sensor_identifier = ${sensor_identifier}
+        AND (creation_timestamp, identifier) > (
+            coalesce(${creation_timestamp}::TIMESTAMPTZ, '-infinity'),
+            coalesce(${log_identifier}::BIGINT, 9223372036854775807)
+        )
+    ORDER BY creation_timestamp ASC, identifier ASC
+    LIMIT ${limit}
+) AS page
+INNER JOIN log_message ON page.message_identifier = log_message.identifier
+ORDER BY page.creation_timestamp ASC, page.identifier ASC;
+
+
+-- name: read-logs-previous
+SELECT
+    page.identifier AS log_identifier,
+    page.severity,
+    page.revision,
+    page.creation_timestamp,
+    log_message.message AS subject,
+    '' AS details
+FROM (
+    SELECT
+        identifier,
+        severity,
+        message_identifier,
+        revision,
+        creation_timestamp
+    FROM log
+    WHERE
+        sensor_identifier = ${sensor_identifier}
+        AND (creation_timestamp, identifier) < (
+            coalesce(${creation_timestamp}::TIMESTAMPTZ, 'infinity'),
+            coalesce(${log_identifier}::BIGINT, -9223372036854775808)
+        )
+    ORDER BY creation_timestamp DESC, identifier DESC
+    LIMIT ${limit}
+) AS page
+INNER JOIN log_message ON page.message_identifier = log_message.identifier
+ORDER BY page.creation_timestamp DESC, page.identifier DESC;
 
 
 -- name: read-user
@@ -315,13 +611,17 @@ VALUES (
 RETURNING revision;
 
 
--- name: update-configuration-on-publication
+-- name: update-configurations-on-publication
+-- Mark the published revisions together with the pending revisions that they
+-- superseded, so that the skipped revisions leave the outbox as well
 UPDATE configuration
 SET publication_timestamp = now()
+FROM unnest(${sensor_identifiers}::UUID[], ${revisions}::INT[])
+    AS published (sensor_identifier, revision)
 WHERE
-    sensor_identifier = ${sensor_identifier}
-    AND revision = ${revision}
-    AND publication_timestamp IS NULL;
+    configuration.sensor_identifier = published.sensor_identifier
+    AND configuration.revision <= published.revision
+    AND configuration.publication_timestamp IS NULL;
 
 
 -- name: update-configuration-on-acknowledgment
@@ -340,3 +640,29 @@ WHERE
 UPDATE sensor
 SET name = ${sensor_name}
 WHERE identifier = ${sensor_identifier};
+
+
+-- name: read-dead-letters-maximum
+SELECT coalesce(max(identifier), 0) AS dead_letter_identifier
+FROM dead_letter;
+
+
+-- name: read-dead-letters
+SELECT
+    identifier AS dead_letter_identifier,
+    sensor_identifier,
+    kind,
+    payload,
+    receipt_timestamp
+FROM dead_letter
+WHERE
+    identifier > ${dead_letter_identifier}
+    AND identifier <= ${maximum_dead_letter_identifier}
+    AND kind = ANY(${kinds})
+ORDER BY identifier ASC
+LIMIT ${batch_size};
+
+
+-- name: delete-dead-letters
+DELETE FROM dead_letter
+WHERE identifier = ANY(${dead_letter_identifiers});
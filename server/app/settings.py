@@ -27,3 +27,78 @@ MQTT_USERNAME = os.environ["HERMES_MQTT_USERNAME"]
 MQTT_PASSWORD = os.environ["HERMES_MQTT_PASSWORD"]
 MQTT_BASE_TOPIC = os.environ.get("HERMES_MQTT_BASE_TOPIC") or ""
 MQTT_CERT_REQUIREMENTS = os.environ.get("HERMES_MQTT_CERT_REQUIREMENTS") or "none"  # none [default], verify
+# MQTT v5 shared subscription group; When set, incoming messages are distributed over
+# all server replicas that subscribe with the same group instead of being copied
+MQTT_SHARE_GROUP = os.environ.get("HERMES_MQTT_SHARE_GROUP") or None
+
+# Roles of this server process: "api" serves the REST API, "ingestion" processes
+# incoming MQTT messages; Separate them to scale both independently
+ROLES = set((os.environ.get("HERMES_ROLES") or "api,ingestion").split(","))
+assert ROLES and ROLES <= {"api", "ingestion"}, f"Invalid roles: {ROLES}"
+
+# Storage: Measurements are compressed after the given age (ISO 8601 duration); Raw
+# measurements are dropped after the retention age, if set, while their aggregates
+# are kept; Apply changes to an existing database with `./scripts/initialize --policies`
+MEASUREMENT_COMPRESSION_AGE = (
+    os.environ.get("HERMES_MEASUREMENT_COMPRESSION_AGE") or "P7D"
+)
+MEASUREMENT_RETENTION_AGE = os.environ.get("HERMES_MEASUREMENT_RETENTION_AGE") or None
+
+# Publication: Pending configurations are published in batches of the given size;
+# The outbox is checked at the given interval (in seconds) and on every new revision
+PUBLICATION_BATCH_SIZE = int(os.environ.get("HERMES_PUBLICATION_BATCH_SIZE") or 256)
+PUBLICATION_INTERVAL = float(os.environ.get("HERMES_PUBLICATION_INTERVAL") or 10)
+# Authentication: Access tokens and the requesters' relationships with networks and
+# sensors are cached for the given timeout (in seconds); Changes made on other replicas
+# take at most that long to take effect
+AUTHENTICATION_CACHE_SIZE = int(
+    os.environ.get("HERMES_AUTHENTICATION_CACHE_SIZE") or 16384
+)
+AUTHENTICATION_CACHE_TIMEOUT = float(
+    os.environ.get("HERMES_AUTHENTICATION_CACHE_TIMEOUT") or 60
+)
+# Authentication: Passwords are hashed by a number of threads besides the event loop;
+# At most the given number of further requests wait for a thread, others are rejected
+PASSWORD_HASHING_CONCURRENCY = int(
+    os.environ.get("HERMES_PASSWORD_HASHING_CONCURRENCY") or 2
+)
+PASSWORD_HASHING_QUEUE_SIZE = int(
+    os.environ.get("HERMES_PASSWORD_HASHING_QUEUE_SIZE") or 64
+)
+# Export: Measurements are read from the database and streamed in chunks of the given
+# number of data points
+EXPORT_CHUNK_SIZE = int(os.environ.get("HERMES_EXPORT_CHUNK_SIZE") or 4096)
+# Ingestion: Measurements are buffered and written in bulk when either the batch size
+# is reached or the timeout (in seconds) has passed
+INGESTION_BATCH_SIZE = int(os.environ.get("HERMES_INGESTION_BATCH_SIZE") or 4096)
+INGESTION_BATCH_TIMEOUT = float(os.environ.get("HERMES_INGESTION_BATCH_TIMEOUT") or 1)
+# Ingestion: Messages are processed by a number of concurrent workers, each with a
+# bounded queue; Messages of the same sensor are always processed by the same worker
+INGESTION_CONCURRENCY = int(os.environ.get("HERMES_INGESTION_CONCURRENCY") or 4)
+INGESTION_WORKER_QUEUE_SIZE = int(
+    os.environ.get("HERMES_INGESTION_WORKER_QUEUE_SIZE") or 256
+)
+# Ingestion: Maximum number of messages that are buffered between the MQTT client and
+# the workers; When full, logs are dropped first, then measurements
+INGESTION_QUEUE_SIZE = int(os.environ.get("HERMES_INGESTION_QUEUE_SIZE") or 16384)
+# Ingestion: Messages from sensors that don't exist are dropped; Unknown sensors are
+# remembered for the given timeout (in seconds) before they're looked up again
+INGESTION_REGISTRY_SIZE = int(os.environ.get("HERMES_INGESTION_REGISTRY_SIZE") or 4096)
+INGESTION_REGISTRY_TIMEOUT = float(
+    os.environ.get("HERMES_INGESTION_REGISTRY_TIMEOUT") or 60
+)
+# Ingestion: Number of recent measurement keys that are remembered to filter out
+# duplicates before writing; Duplicates that slip through are skipped by the database
+INGESTION_DEDUPLICATION_SIZE = int(
+    os.environ.get("HERMES_INGESTION_DEDUPLICATION_SIZE") or 65536
+)
+# Ingestion: Number of sensors whose latencies are recorded individually next to the
+# latencies per message kind; The sensors that were recorded first are forgotten first
+INGESTION_LATENCIES_SIZE = int(
+    os.environ.get("HERMES_INGESTION_LATENCIES_SIZE") or 4096
+)
+# Ingestion: Number of recent log message identifiers that are remembered to skip
+# inserting messages that are already stored
+INGESTION_INTERNING_SIZE = int(
+    os.environ.get("HERMES_INGESTION_INTERNING_SIZE") or 16384
+)
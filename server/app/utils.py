@@ -1,6 +1,20 @@
 import time
 
+import pydantic_core
+import starlette.responses
+
 
 def timestamp():
     """Return current UTC time as unixtime float."""
     return time.time()
+
+
+class JSONResponse(starlette.responses.JSONResponse):
+    """JSON response that's serialized with pydantic's encoder instead of `json`.
+
+    It's several times faster on large pages and writes bytes directly. Non-finite
+    floats are serialized as null by pydantic instead of failing the request.
+    """
+
+    def render(self, content):
+        return pydantic_core.to_json(content)
@@ -1,14 +1,25 @@
-from .mqtt import AcknowledgmentsValidator, LogsValidator, MeasurementsValidator
+from .mqtt import (
+    AcknowledgmentsValidator,
+    LogsValidator,
+    MeasurementsValidator,
+    decode_acknowledgments,
+    decode_logs,
+    decode_measurements,
+)
 from .routes import (
     CreateConfigurationRequest,
     CreateNetworkRequest,
     CreateSensorRequest,
     CreateSessionRequest,
     CreateUserRequest,
+    ExportMeasurementsRequest,
     ReadConfigurationsRequest,
     ReadLogsAggregatesRequest,
     ReadLogsRequest,
+    ReadMeasurementsLatestRequest,
     ReadMeasurementsRequest,
+    ReadMetricsRequest,
+    ReadNetworkOverviewRequest,
     ReadNetworksRequest,
     ReadSensorsRequest,
     ReadStatusRequest,
@@ -21,6 +32,9 @@ __all__ = [
     "AcknowledgmentsValidator",
     "MeasurementsValidator",
     "LogsValidator",
+    "decode_acknowledgments",
+    "decode_measurements",
+    "decode_logs",
     "CreateSensorRequest",
     "CreateUserRequest",
     "CreateSessionRequest",
@@ -30,9 +44,13 @@ __all__ = [
     "ReadConfigurationsRequest",
     "CreateNetworkRequest",
     "ReadMeasurementsRequest",
+    "ReadMeasurementsLatestRequest",
+    "ExportMeasurementsRequest",
+    "ReadMetricsRequest",
     "ReadStatusRequest",
     "ReadSensorsRequest",
     "ReadNetworksRequest",
+    "ReadNetworkOverviewRequest",
     "UpdateSensorRequest",
     "validate",
 ]
@@ -1,6 +1,7 @@
 import typing
 
 import pydantic
+import typing_extensions
 
 import app.validation.constants as constants
 import app.validation.types as types
@@ -47,3 +48,124 @@ MeasurementsValidator = pydantic.TypeAdapter(
 LogsValidator = pydantic.TypeAdapter(
     pydantic.conlist(item_type=Log, min_length=1),
 )
+
+
+########################################################################################
+# Fast-path decoders
+#
+# These enforce the same constraints as the validators above, but validate into plain
+# dictionaries instead of model instances and return the rows in the layout that the
+# ingestion stages write to the database. They raise a ValueError on invalid payloads.
+########################################################################################
+
+
+class _Acknowledgment(typing_extensions.TypedDict):
+    __pydantic_config__ = types.StrictModel.model_config
+
+    timestamp: types.Timestamp
+    revision: types.Revision
+    success: bool
+
+
+class _Measurement(typing_extensions.TypedDict):
+    __pydantic_config__ = types.StrictModel.model_config
+
+    timestamp: types.Timestamp
+    revision: typing_extensions.NotRequired[types.Revision | None]
+    # The attribute names are checked separately, see `_attributes`
+    value: dict[str, float]
+
+
+class _Log(typing_extensions.TypedDict):
+    __pydantic_config__ = types.StrictModel.model_config
+
+    timestamp: types.Timestamp
+    revision: typing_extensions.NotRequired[types.Revision | None]
+    severity: typing.Literal["info", "warning", "error"]
+    message: str
+
+
+_AcknowledgmentsDecoder = pydantic.TypeAdapter(
+    pydantic.conlist(item_type=_Acknowledgment, min_length=1),
+)
+_MeasurementsDecoder = pydantic.TypeAdapter(
+    pydantic.conlist(item_type=_Measurement, min_length=1),
+)
+_LogsDecoder = pydantic.TypeAdapter(
+    pydantic.conlist(item_type=_Log, min_length=1),
+)
+
+# Sensors send the same few attribute names over and over. Remembering the ones that
+# passed validation lets us check most measurements with a single subset test
+_ATTRIBUTES = set()
+_ATTRIBUTES_LIMIT = 1024
+_KEY = pydantic.TypeAdapter(types.Key)
+
+
+def _attributes(value):
+    if value.keys() <= _ATTRIBUTES:
+        return
+    for attribute in value.keys():
+        _KEY.validate_python(attribute)
+        if len(_ATTRIBUTES) < _ATTRIBUTES_LIMIT:
+            _ATTRIBUTES.add(attribute)
+
+
+def decode_acknowledgments(payload, sensor_identifier, receipt_timestamp):
+    """Decode an acknowledgments payload into rows.
+
+    Rows have the layout (sensor_identifier, revision, acknowledgment_timestamp,
+    success, receipt_timestamp).
+    """
+    return [
+        (
+            sensor_identifier,
+            element["revision"],
+            element["timestamp"],
+            element["success"],
+            receipt_timestamp,
+        )
+        for element in _AcknowledgmentsDecoder.validate_json(payload)
+    ]
+
+
+def decode_measurements(payload, sensor_identifier, receipt_timestamp):
+    """Decode a measurements payload into rows, one per data point.
+
+    Rows have the layout (sensor_identifier, attribute, value, revision,
+    creation_timestamp, receipt_timestamp).
+    """
+    elements = _MeasurementsDecoder.validate_json(payload)
+    for element in elements:
+        _attributes(element["value"])
+    return [
+        (
+            sensor_identifier,
+            attribute,
+            value,
+            element.get("revision"),
+            element["timestamp"],
+            receipt_timestamp,
+        )
+        for element in elements
+        for attribute, value in element["value"].items()
+    ]
+
+
+def decode_logs(payload, sensor_identifier, receipt_timestamp):
+    """Decode a logs payload into rows.
+
+    Rows have the layout (sensor_identifier, severity, message, revision,
+    creation_timestamp, receipt_timestamp).
+    """
+    return [
+        (
+            sensor_identifier,
+            element["severity"],
+            element["message"][: constants.Limit.LARGE],
+            element.get("revision"),
+            element["timestamp"],
+            receipt_timestamp,
+        )
+        for element in _LogsDecoder.validate_json(payload)
+    ]
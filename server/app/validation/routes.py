@@ -55,6 +55,10 @@ class _ReadStatusRequestPath(types.StrictModel):
     pass
 
 
+class _ReadMetricsRequestPath(types.StrictModel):
+    pass
+
+
 class _CreateUserRequestPath(types.StrictModel):
     pass
 
@@ -71,6 +75,10 @@ class _ReadNetworksRequestPath(types.StrictModel):
     pass
 
 
+class _ReadNetworkOverviewRequestPath(types.StrictModel):
+    network_identifier: types.Identifier
+
+
 class _CreateSensorRequestPath(types.StrictModel):
     network_identifier: types.Identifier
 
@@ -99,6 +107,16 @@ class _ReadMeasurementsRequestPath(types.StrictModel):
     sensor_identifier: types.Identifier
 
 
+class _ReadMeasurementsLatestRequestPath(types.StrictModel):
+    network_identifier: types.Identifier
+    sensor_identifier: types.Identifier
+
+
+class _ExportMeasurementsRequestPath(types.StrictModel):
+    network_identifier: types.Identifier
+    sensor_identifier: types.Identifier = None
+
+
 class _ReadLogsRequestPath(types.StrictModel):
     network_identifier: types.Identifier
     sensor_identifier: types.Identifier
@@ -118,6 +136,10 @@ class _ReadStatusRequestQuery(types.LooseModel):
     pass
 
 
+class _ReadMetricsRequestQuery(types.LooseModel):
+    sensors: bool = False
+
+
 class _CreateUserRequestQuery(types.LooseModel):
     pass
 
@@ -134,6 +156,10 @@ class _ReadNetworksRequestQuery(types.LooseModel):
     pass
 
 
+class _ReadNetworkOverviewRequestQuery(types.LooseModel):
+    pass
+
+
 class _CreateSensorRequestQuery(types.LooseModel):
     pass
 
@@ -158,12 +184,32 @@ class _ReadConfigurationsRequestQuery(types.LooseModel):
 class _ReadMeasurementsRequestQuery(types.LooseModel):
     creation_timestamp: types.Timestamp = None
     direction: typing.Literal["next", "previous"] = "next"
+    limit: types.PageSize = 64
     aggregate: bool = False
+    start_timestamp: types.Timestamp = None
+    end_timestamp: types.Timestamp = None
+    points: types.Points = 512
+    width: types.Width = None
+    attributes: types.Names = None
+    statistics: types.Statistics = {"average", "minimum", "maximum", "count"}
+    percentiles: types.Percentiles = None
+
+
+class _ReadMeasurementsLatestRequestQuery(types.LooseModel):
+    pass
+
+
+class _ExportMeasurementsRequestQuery(types.LooseModel):
+    format: typing.Literal["ndjson", "csv", "arrow"] = "ndjson"
+    start_timestamp: types.Timestamp = None
+    end_timestamp: types.Timestamp = None
 
 
 class _ReadLogsRequestQuery(types.LooseModel):
     creation_timestamp: types.Timestamp = None
+    log_identifier: types.LogIdentifier = None
     direction: typing.Literal["next", "previous"] = "next"
+    limit: types.PageSize = 64
 
 
 class _ReadLogsAggregatesRequestQuery(types.LooseModel):
@@ -179,6 +225,10 @@ class _ReadStatusRequestBody(types.StrictModel):
     pass
 
 
+class _ReadMetricsRequestBody(types.StrictModel):
+    pass
+
+
 class _CreateUserRequestBody(types.StrictModel):
     user_name: types.Name
     password: types.Password
@@ -197,6 +247,10 @@ class _ReadNetworksRequestBody(types.StrictModel):
     pass
 
 
+class _ReadNetworkOverviewRequestBody(types.StrictModel):
+    pass
+
+
 class _CreateSensorRequestBody(types.StrictModel):
     sensor_name: types.Name
 
@@ -221,6 +275,14 @@ class _ReadMeasurementsRequestBody(types.StrictModel):
     pass
 
 
+class _ReadMeasurementsLatestRequestBody(types.StrictModel):
+    pass
+
+
+class _ExportMeasurementsRequestBody(types.StrictModel):
+    pass
+
+
 class _ReadLogsRequestBody(types.StrictModel):
     pass
 
@@ -241,6 +303,12 @@ class ReadStatusRequest(types.StrictModel):
     body: _ReadStatusRequestBody
 
 
+class ReadMetricsRequest(types.StrictModel):
+    path: _ReadMetricsRequestPath
+    query: _ReadMetricsRequestQuery
+    body: _ReadMetricsRequestBody
+
+
 class CreateUserRequest(types.StrictModel):
     path: _CreateUserRequestPath
     query: _CreateUserRequestQuery
@@ -265,6 +333,12 @@ class ReadNetworksRequest(types.StrictModel):
     body: _ReadNetworksRequestBody
 
 
+class ReadNetworkOverviewRequest(types.StrictModel):
+    path: _ReadNetworkOverviewRequestPath
+    query: _ReadNetworkOverviewRequestQuery
+    body: _ReadNetworkOverviewRequestBody
+
+
 class CreateSensorRequest(types.StrictModel):
     path: _CreateSensorRequestPath
     query: _CreateSensorRequestQuery
@@ -301,6 +375,18 @@ class ReadMeasurementsRequest(types.StrictModel):
     body: _ReadMeasurementsRequestBody
 
 
+class ReadMeasurementsLatestRequest(types.StrictModel):
+    path: _ReadMeasurementsLatestRequestPath
+    query: _ReadMeasurementsLatestRequestQuery
+    body: _ReadMeasurementsLatestRequestBody
+
+
+class ExportMeasurementsRequest(types.StrictModel):
+    path: _ExportMeasurementsRequestPath
+    query: _ExportMeasurementsRequestQuery
+    body: _ExportMeasurementsRequestBody
+
+
 class ReadLogsRequest(types.StrictModel):
     path: _ReadLogsRequestPath
     query: _ReadLogsRequestQuery
@@ -1,3 +1,5 @@
+import typing
+
 import pydantic
 
 import app.validation.constants as constants
@@ -37,4 +39,35 @@ Key = pydantic.constr(max_length=64, pattern=constants.Pattern.KEY.value)
 # During validation somehow, or by handling the database error?
 Revision = pydantic.conint(ge=0, lt=constants.Limit.MAXINT4)
 Timestamp = pydantic.confloat(ge=0, lt=constants.Limit.MAXINT4)
+# Number of elements per page, see the keyset pagination in `app/queries.sql`
+PageSize = pydantic.conint(ge=1, le=constants.Limit.MEDIUM)
+LogIdentifier = pydantic.conint(ge=1, lt=2**63)
+# Number of points of a time series the client would like to display
+Points = pydantic.conint(ge=1, le=constants.Limit.LARGE)
+# Width of the buckets of aggregated measurements in seconds
+Width = pydantic.conint(ge=1, lt=constants.Limit.MAXINT4)
 Measurement = dict[Key, float]
+
+
+def _split(value):
+    """Split comma-separated lists in query strings."""
+    return value.split(",") if isinstance(value, str) else value
+
+
+Names = typing.Annotated[
+    pydantic.conlist(Key, min_length=1, max_length=constants.Limit.SMALL),
+    pydantic.BeforeValidator(_split),
+]
+Statistics = typing.Annotated[
+    pydantic.conset(
+        typing.Literal["average", "minimum", "maximum", "count", "deviation"],
+        min_length=1,
+    ),
+    pydantic.BeforeValidator(_split),
+]
+Percentiles = typing.Annotated[
+    pydantic.conlist(
+        pydantic.confloat(gt=0, lt=100), min_length=1, max_length=constants.Limit.SMALL
+    ),
+    pydantic.BeforeValidator(_split),
+]
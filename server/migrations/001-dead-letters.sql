@@ -0,0 +1,12 @@
+-- Add the table that keeps messages that couldn't be decoded or written (see
+-- `schema.sql`), so that they can be replayed with `./scripts/replay`. Run the
+-- statements with e.g. `psql --file migrations/001-dead-letters.sql`.
+
+CREATE TABLE dead_letter (
+    identifier BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    sensor_identifier UUID NOT NULL REFERENCES sensor (identifier) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    payload BYTEA NOT NULL,
+    error TEXT NOT NULL,
+    receipt_timestamp TIMESTAMPTZ NOT NULL
+);
@@ -0,0 +1,29 @@
+-- Make measurements unique over their sensor, creation timestamp and attribute (see
+-- `schema.sql`). Duplicates that are already stored are deleted first, keeping the
+-- value that was received first, like the ingestion does. Stop the server first, then
+-- run the statements in order with e.g.
+-- `psql --file migrations/002-unique-measurements.sql`. The hourly averages are
+-- refreshed afterwards to not count the duplicates, which can't happen inside a
+-- transaction block, so don't use `--single-transaction`.
+
+DELETE FROM measurement
+WHERE (tableoid, ctid) IN (
+    SELECT
+        tableoid,
+        ctid
+    FROM (
+        SELECT
+            tableoid,
+            ctid,
+            row_number() OVER (
+                PARTITION BY sensor_identifier, creation_timestamp, attribute
+                ORDER BY receipt_timestamp ASC
+            ) AS position
+        FROM measurement
+    ) AS duplicates
+    WHERE position > 1
+);
+
+CREATE UNIQUE INDEX ON measurement (sensor_identifier ASC, creation_timestamp ASC, attribute ASC);
+
+CALL refresh_continuous_aggregate('measurement_aggregation_1_hour', NULL, NULL);
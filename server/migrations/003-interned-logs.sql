@@ -0,0 +1,28 @@
+-- Store each distinct log message once in `log_message` and reference it from the
+-- logs (see `schema.sql`). The identifiers are computed like the ingestion does, from
+-- the first 8 bytes of the message's SHA-256 hash. Stop the server first, then run the
+-- statements with e.g. `psql --single-transaction --file migrations/003-interned-logs.sql`.
+-- Referencing the messages rewrites all logs, which can take a while on large
+-- databases.
+
+CREATE TABLE log_message (
+    identifier BIGINT PRIMARY KEY,
+    message TEXT NOT NULL
+);
+
+INSERT INTO log_message (identifier, message)
+SELECT
+    ('x' || left(encode(sha256(convert_to(message, 'UTF8')), 'hex'), 16))::BIT(64)::BIGINT,
+    message
+FROM (SELECT DISTINCT message FROM log) AS messages;
+
+ALTER TABLE log ADD COLUMN message_identifier BIGINT REFERENCES log_message (identifier);
+
+UPDATE log
+SET message_identifier = log_message.identifier
+FROM log_message
+WHERE log.message = log_message.message;
+
+ALTER TABLE log ALTER COLUMN message_identifier SET NOT NULL;
+
+ALTER TABLE log DROP COLUMN message;
@@ -0,0 +1,6 @@
+-- Index the configurations that have not been published yet, which the server drains
+-- as outbox in the background (see `schema.sql`). Run the statements with e.g.
+-- `psql --file migrations/004-configuration-outbox.sql`. After the next start, the
+-- server publishes the newest unpublished revision of each sensor.
+
+CREATE INDEX ON configuration (creation_timestamp ASC) WHERE publication_timestamp IS NULL;
@@ -0,0 +1,83 @@
+-- Move the measurements to the compact layout, where sensors and attributes are
+-- referenced by integer surrogate keys instead of the UUID and the name (see
+-- `schema.sql`). Stop the server first, then run the statements in order with e.g.
+-- `psql --file migrations/005-compact-measurements.sql`. The continuous aggregate
+-- can't be created inside a transaction block, so don't use `--single-transaction`.
+-- Compare the size and speed of both layouts with `./scripts/benchmark storage`.
+
+ALTER TABLE sensor ADD COLUMN number INT GENERATED BY DEFAULT AS IDENTITY UNIQUE;
+
+CREATE TABLE attribute (
+    identifier SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+INSERT INTO attribute (name)
+SELECT DISTINCT attribute
+FROM measurement
+ORDER BY attribute ASC;
+
+-- The aggregate depends on the old table and is recreated from scratch below
+DROP MATERIALIZED VIEW measurement_aggregation_1_hour;
+
+ALTER TABLE measurement RENAME TO measurement_legacy;
+
+CREATE TABLE measurement (
+    value DOUBLE PRECISION NOT NULL,
+    creation_timestamp TIMESTAMPTZ NOT NULL,
+    receipt_timestamp TIMESTAMPTZ NOT NULL,
+    sensor_number INT NOT NULL REFERENCES sensor (number) ON DELETE CASCADE,
+    revision INT,
+    attribute_identifier SMALLINT NOT NULL REFERENCES attribute (identifier)
+);
+
+SELECT create_hypertable('measurement', 'creation_timestamp');
+
+CREATE UNIQUE INDEX ON measurement (sensor_number ASC, creation_timestamp ASC, attribute_identifier ASC);
+
+INSERT INTO measurement (
+    value,
+    creation_timestamp,
+    receipt_timestamp,
+    sensor_number,
+    revision,
+    attribute_identifier
+)
+SELECT DISTINCT ON (sensor.number, measurement_legacy.creation_timestamp, attribute.identifier)
+    measurement_legacy.value,
+    measurement_legacy.creation_timestamp,
+    measurement_legacy.receipt_timestamp,
+    sensor.number,
+    measurement_legacy.revision,
+    attribute.identifier
+FROM measurement_legacy
+INNER JOIN sensor ON measurement_legacy.sensor_identifier = sensor.identifier
+INNER JOIN attribute ON measurement_legacy.attribute = attribute.name
+-- Skip duplicates that are left, keeping the value that was received first like the
+-- ingestion does
+ORDER BY
+    sensor.number ASC,
+    measurement_legacy.creation_timestamp ASC,
+    attribute.identifier ASC,
+    measurement_legacy.receipt_timestamp ASC;
+
+CREATE MATERIALIZED VIEW measurement_aggregation_1_hour
+WITH (timescaledb.continuous, timescaledb.materialized_only = true, timescaledb.create_group_indexes = false) AS
+    SELECT
+        sensor_number,
+        attribute_identifier,
+        avg(value)::DOUBLE PRECISION AS average,
+        time_bucket('1 hour', creation_timestamp) AS bucket_timestamp
+    FROM measurement
+    GROUP BY sensor_number, attribute_identifier, bucket_timestamp
+WITH DATA;
+
+CREATE INDEX ON measurement_aggregation_1_hour (sensor_number ASC, bucket_timestamp ASC, attribute_identifier ASC);
+
+SELECT add_continuous_aggregate_policy(
+    continuous_aggregate => 'measurement_aggregation_1_hour',
+    start_offset => '10 days',
+    end_offset => '1 hour',
+    schedule_interval => '1 hour');
+
+DROP TABLE measurement_legacy;
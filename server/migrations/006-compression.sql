@@ -0,0 +1,10 @@
+-- Enable compression of the measurement chunks, segmented by sensor and attribute
+-- (see `schema.sql`). Run the statements with e.g.
+-- `psql --file migrations/006-compression.sql`, then add the compression and
+-- retention policies with `./scripts/initialize --policies`.
+
+ALTER TABLE measurement SET (
+    timescaledb.compress,
+    timescaledb.compress_segmentby = 'sensor_number, attribute_identifier',
+    timescaledb.compress_orderby = 'creation_timestamp ASC'
+);
@@ -0,0 +1,79 @@
+-- Replace the hourly averages with a cascade of continuous aggregates per 1 minute,
+-- 1 hour and 1 day that carry the minimum, maximum, sum and count (see `schema.sql`).
+-- Stop the server first, then run the statements in order with e.g.
+-- `psql --file migrations/007-hierarchical-aggregates.sql`. Continuous aggregates
+-- can't be created inside a transaction block, so don't use `--single-transaction`.
+-- Creating the aggregates with data computes them over all existing measurements,
+-- which can take a while on large databases. Hourly averages of measurements that a
+-- retention policy already dropped are lost.
+
+DROP MATERIALIZED VIEW measurement_aggregation_1_hour;
+
+
+CREATE MATERIALIZED VIEW measurement_aggregation_1_minute
+WITH (timescaledb.continuous, timescaledb.materialized_only = true, timescaledb.create_group_indexes = false) AS
+    SELECT
+        sensor_number,
+        attribute_identifier,
+        time_bucket('1 minute', creation_timestamp) AS bucket_timestamp,
+        min(value) AS minimum,
+        max(value) AS maximum,
+        sum(value) AS total,
+        count(*) AS count
+    FROM measurement
+    GROUP BY sensor_number, attribute_identifier, time_bucket('1 minute', creation_timestamp)
+WITH DATA;
+
+CREATE INDEX ON measurement_aggregation_1_minute (sensor_number ASC, bucket_timestamp ASC, attribute_identifier ASC);
+
+SELECT add_continuous_aggregate_policy(
+    continuous_aggregate => 'measurement_aggregation_1_minute',
+    start_offset => '10 days',
+    end_offset => '1 minute',
+    schedule_interval => '1 minute');
+
+
+CREATE MATERIALIZED VIEW measurement_aggregation_1_hour
+WITH (timescaledb.continuous, timescaledb.materialized_only = true, timescaledb.create_group_indexes = false) AS
+    SELECT
+        sensor_number,
+        attribute_identifier,
+        time_bucket('1 hour', bucket_timestamp) AS bucket_timestamp,
+        min(minimum) AS minimum,
+        max(maximum) AS maximum,
+        sum(total) AS total,
+        sum(count)::BIGINT AS count
+    FROM measurement_aggregation_1_minute
+    GROUP BY sensor_number, attribute_identifier, time_bucket('1 hour', bucket_timestamp)
+WITH DATA;
+
+CREATE INDEX ON measurement_aggregation_1_hour (sensor_number ASC, bucket_timestamp ASC, attribute_identifier ASC);
+
+SELECT add_continuous_aggregate_policy(
+    continuous_aggregate => 'measurement_aggregation_1_hour',
+    start_offset => '10 days',
+    end_offset => '1 hour',
+    schedule_interval => '1 hour');
+
+
+CREATE MATERIALIZED VIEW measurement_aggregation_1_day
+WITH (timescaledb.continuous, timescaledb.materialized_only = true, timescaledb.create_group_indexes = false) AS
+    SELECT
+        sensor_number,
+        attribute_identifier,
+        time_bucket('1 day', bucket_timestamp) AS bucket_timestamp,
+        min(minimum) AS minimum,
+        max(maximum) AS maximum,
+        sum(total) AS total,
+        sum(count)::BIGINT AS count
+    FROM measurement_aggregation_1_hour
+    GROUP BY sensor_number, attribute_identifier, time_bucket('1 day', bucket_timestamp)
+WITH DATA;
+
+CREATE INDEX ON measurement_aggregation_1_day (sensor_number ASC, bucket_timestamp ASC, attribute_identifier ASC);
+
+SELECT add_continuous_aggregate_policy(
+    continuous_aggregate => 'measurement_aggregation_1_day',
+    start_offset => '10 days',
+    end_offset => '1 day',
+    schedule_interval => '1 hour');
@@ -0,0 +1,8 @@
+-- Give logs a generated identifier that breaks ties between logs with the same
+-- timestamp and index the keyset pagination's cursor (see `schema.sql`). Existing logs
+-- are numbered in no particular order, which only matters for logs with identical
+-- timestamps. Run the statements with e.g. `psql --file migrations/008-log-cursor.sql`.
+
+ALTER TABLE log ADD COLUMN identifier BIGINT GENERATED ALWAYS AS IDENTITY;
+
+CREATE INDEX ON log (sensor_identifier ASC, creation_timestamp ASC, identifier ASC);
@@ -0,0 +1,33 @@
+-- Add the table with the latest value of each attribute of each sensor that the
+-- ingestion keeps up to date (see `schema.sql`) and fill it from the existing
+-- measurements. Stop the server first, then run the statements with e.g.
+-- `psql --single-transaction --file migrations/009-latest-measurements.sql`. Filling
+-- the table reads all measurements, which can take a while on large databases.
+
+CREATE TABLE measurement_latest (
+    sensor_number INT NOT NULL REFERENCES sensor (number) ON DELETE CASCADE,
+    attribute_identifier SMALLINT NOT NULL REFERENCES attribute (identifier),
+    value DOUBLE PRECISION NOT NULL,
+    revision INT,
+    creation_timestamp TIMESTAMPTZ NOT NULL,
+    receipt_timestamp TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (sensor_number, attribute_identifier)
+);
+
+INSERT INTO measurement_latest (
+    sensor_number,
+    attribute_identifier,
+    value,
+    revision,
+    creation_timestamp,
+    receipt_timestamp
+)
+SELECT DISTINCT ON (sensor_number, attribute_identifier)
+    sensor_number,
+    attribute_identifier,
+    value,
+    revision,
+    creation_timestamp,
+    receipt_timestamp
+FROM measurement
+ORDER BY sensor_number ASC, attribute_identifier ASC, creation_timestamp DESC;
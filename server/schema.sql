@@ -23,6 +23,8 @@ CREATE TABLE sensor (
     name TEXT NOT NULL,
     network_identifier UUID NOT NULL REFERENCES network (identifier) ON DELETE CASCADE,
     creation_timestamp TIMESTAMPTZ NOT NULL,
+    -- Compact surrogate key that replaces the identifier in the measurements
+    number INT GENERATED BY DEFAULT AS IDENTITY UNIQUE,
 
     -- Add more parameters here? e.g. description (that do not get relayed to the sensor)
 
@@ -61,38 +63,108 @@ CREATE TABLE configuration (
 -- revision faster
 CREATE UNIQUE INDEX ON configuration (sensor_identifier ASC, revision DESC);
 
+-- The configurations that have not been published yet form the outbox that the server
+-- drains in the background (see `mqtt.Publisher`). The partial index keeps it small
+CREATE INDEX ON configuration (creation_timestamp ASC) WHERE publication_timestamp IS NULL;
 
--- Measurements don't have a unique primary key. Enforcing that the combination of
--- (sensor_identifier, creation_timestamp, attribute) is unique filters out duplicates
--- but having these duplicates usually means that something is wrong on the sensor.
--- In this case, the server should store everything it receives and duplicates should be
--- filtered out during processing with manual oversight. The keyset pagination over the
--- measurements chooses arbitrarily between duplicates.
+
+-- Attribute names (e.g. `bme280_temperature`) are dictionary-encoded. There are only
+-- a few distinct ones, that would otherwise be repeated for every single value.
+CREATE TABLE attribute (
+    identifier SMALLINT GENERATED BY DEFAULT AS IDENTITY PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+
+
+-- Measurements are unique over their sensor, creation timestamp and attribute.
+-- Duplicates mostly stem from MQTT redeliveries (QoS 1 is at-least-once) and from
+-- sensors re-publishing unacknowledged messages after a restart. The server skips
+-- them on ingestion, keeping the first value it received. The index also serves the
+-- keyset pagination over a sensor's measurements.
+-- Sensors and attributes are referenced by their compact surrogate keys instead of the
+-- UUID and the name. The columns are ordered from wide to narrow to avoid alignment
+-- padding. Together, this cuts the row size about in half.
 CREATE TABLE measurement (
-    sensor_identifier UUID NOT NULL REFERENCES sensor (identifier) ON DELETE CASCADE,
-    attribute TEXT NOT NULL,
     value DOUBLE PRECISION NOT NULL,
-    revision INT,
     creation_timestamp TIMESTAMPTZ NOT NULL,
-    receipt_timestamp TIMESTAMPTZ NOT NULL
+    receipt_timestamp TIMESTAMPTZ NOT NULL,
+    sensor_number INT NOT NULL REFERENCES sensor (number) ON DELETE CASCADE,
+    revision INT,
+    attribute_identifier SMALLINT NOT NULL REFERENCES attribute (identifier)
 );
 
 SELECT create_hypertable('measurement', 'creation_timestamp');
 
+CREATE UNIQUE INDEX ON measurement (sensor_number ASC, creation_timestamp ASC, attribute_identifier ASC);
 
-CREATE MATERIALIZED VIEW measurement_aggregation_1_hour
+-- Chunks are compressed once they're older than a configurable age, raw measurements
+-- can be dropped after another one; The aggregates are kept (see `./scripts/initialize`).
+-- Segmenting by sensor and attribute stores each time series as arrays ordered by
+-- time, which compress well and keep reading a single sensor's measurements fast.
+ALTER TABLE measurement SET (
+    timescaledb.compress,
+    timescaledb.compress_segmentby = 'sensor_number, attribute_identifier',
+    timescaledb.compress_orderby = 'creation_timestamp ASC'
+);
+
+
+-- The latest value of each attribute of each sensor, upserted by the ingestion after
+-- each batch of measurements is written (see `ingestion.Snapshot`). Reading the current
+-- state of a sensor or a network is thus a point read instead of a search through the
+-- history. Values are only replaced by newer ones, as batches can commit out of order.
+CREATE TABLE measurement_latest (
+    sensor_number INT NOT NULL REFERENCES sensor (number) ON DELETE CASCADE,
+    attribute_identifier SMALLINT NOT NULL REFERENCES attribute (identifier),
+    value DOUBLE PRECISION NOT NULL,
+    revision INT,
+    creation_timestamp TIMESTAMPTZ NOT NULL,
+    receipt_timestamp TIMESTAMPTZ NOT NULL,
+    PRIMARY KEY (sensor_number, attribute_identifier)
+);
+
+
+-- Measurements are rolled up into a cascade of continuous aggregates per 1 minute,
+-- 1 hour and 1 day, each computed from the one below. They carry the minimum, maximum,
+-- sum and count of the values, so that averages stay exact across levels. Reads pick
+-- the coarsest resolution that still yields the requested number of points.
+CREATE MATERIALIZED VIEW measurement_aggregation_1_minute
 WITH (timescaledb.continuous, timescaledb.materialized_only = true, timescaledb.create_group_indexes = false) AS
     SELECT
-        sensor_identifier,
-        attribute,
-        avg(value)::DOUBLE PRECISION AS average,
-        time_bucket('1 hour', creation_timestamp) AS bucket_timestamp
+        sensor_number,
+        attribute_identifier,
+        time_bucket('1 minute', creation_timestamp) AS bucket_timestamp,
+        min(value) AS minimum,
+        max(value) AS maximum,
+        sum(value) AS total,
+        count(*) AS count
     FROM measurement
-    GROUP BY sensor_identifier, attribute, bucket_timestamp
+    GROUP BY sensor_number, attribute_identifier, time_bucket('1 minute', creation_timestamp)
 WITH DATA;
 
+CREATE INDEX ON measurement_aggregation_1_minute (sensor_number ASC, bucket_timestamp ASC, attribute_identifier ASC);
+
+SELECT add_continuous_aggregate_policy(
+    continuous_aggregate => 'measurement_aggregation_1_minute',
+    start_offset => '10 days',
+    end_offset => '1 minute',
+    schedule_interval => '1 minute');
 
-CREATE INDEX ON measurement_aggregation_1_hour (sensor_identifier ASC, bucket_timestamp ASC, attribute ASC);
+
+CREATE MATERIALIZED VIEW measurement_aggregation_1_hour
+WITH (timescaledb.continuous, timescaledb.materialized_only = true, timescaledb.create_group_indexes = false) AS
+    SELECT
+        sensor_number,
+        attribute_identifier,
+        time_bucket('1 hour', bucket_timestamp) AS bucket_timestamp,
+        min(minimum) AS minimum,
+        max(maximum) AS maximum,
+        sum(total) AS total,
+        sum(count)::BIGINT AS count
+    FROM measurement_aggregation_1_minute
+    GROUP BY sensor_number, attribute_identifier, time_bucket('1 hour', bucket_timestamp)
+WITH DATA;
+
+CREATE INDEX ON measurement_aggregation_1_hour (sensor_number ASC, bucket_timestamp ASC, attribute_identifier ASC);
 
 SELECT add_continuous_aggregate_policy(
     continuous_aggregate => 'measurement_aggregation_1_hour',
@@ -101,24 +173,71 @@ SELECT add_continuous_aggregate_policy(
     schedule_interval => '1 hour');
 
 
--- Logs don't have a unique primary key. Enforcing uniqueness over the combination
--- of (sensor_identifier, creation_timestamp) could filter out duplicates, but also
--- incorrectly reject valid logs with the same timestamp. The keyset pagination's cursor
--- is thus not unique. This means that elements can potentially be skipped when they
--- are at the edges of a page. We accept this trade-off in favor of performance.
--- If this ever becomes a problem, we can generate a column that reliably makes the
--- combination unique and use that for the keyset pagination.
+CREATE MATERIALIZED VIEW measurement_aggregation_1_day
+WITH (timescaledb.continuous, timescaledb.materialized_only = true, timescaledb.create_group_indexes = false) AS
+    SELECT
+        sensor_number,
+        attribute_identifier,
+        time_bucket('1 day', bucket_timestamp) AS bucket_timestamp,
+        min(minimum) AS minimum,
+        max(maximum) AS maximum,
+        sum(total) AS total,
+        sum(count)::BIGINT AS count
+    FROM measurement_aggregation_1_hour
+    GROUP BY sensor_number, attribute_identifier, time_bucket('1 day', bucket_timestamp)
+WITH DATA;
+
+CREATE INDEX ON measurement_aggregation_1_day (sensor_number ASC, bucket_timestamp ASC, attribute_identifier ASC);
+
+SELECT add_continuous_aggregate_policy(
+    continuous_aggregate => 'measurement_aggregation_1_day',
+    start_offset => '10 days',
+    end_offset => '1 day',
+    schedule_interval => '1 hour');
+
+
+-- Sensors send the same few log messages over and over. Each distinct message is
+-- stored only once and referenced by the logs. The identifier is the first 8 bytes of
+-- the message's SHA-256 hash (as signed integer), so the server can compute it without
+-- a round trip. Collisions are astronomically unlikely at the number of distinct
+-- messages we expect. Messages are not deleted when the logs referencing them expire.
+CREATE TABLE log_message (
+    identifier BIGINT PRIMARY KEY,
+    message TEXT NOT NULL
+);
+
+
+-- Logs don't have a natural key. Enforcing uniqueness over the combination of
+-- (sensor_identifier, creation_timestamp) could filter out duplicates, but also
+-- incorrectly reject valid logs with the same timestamp. Instead, a generated
+-- identifier breaks ties, which makes (creation_timestamp, identifier) a unique cursor
+-- for the keyset pagination, served by the composite index.
 CREATE TABLE log (
     sensor_identifier UUID NOT NULL REFERENCES sensor (identifier) ON DELETE CASCADE,
     severity TEXT NOT NULL,
-    message TEXT NOT NULL,
+    message_identifier BIGINT NOT NULL REFERENCES log_message (identifier),
     revision INT,
     creation_timestamp TIMESTAMPTZ NOT NULL,
-    receipt_timestamp TIMESTAMPTZ NOT NULL
+    receipt_timestamp TIMESTAMPTZ NOT NULL,
+    identifier BIGINT GENERATED ALWAYS AS IDENTITY
 );
 
 SELECT create_hypertable('log', 'creation_timestamp');
 
+CREATE INDEX ON log (sensor_identifier ASC, creation_timestamp ASC, identifier ASC);
+
 SELECT add_retention_policy(
     relation => 'log',
     drop_after => INTERVAL '8 weeks');
+
+
+-- Messages that couldn't be decoded or written, with their original payload. They can
+-- be run through the ingestion again with `./scripts/replay` once the cause is fixed.
+CREATE TABLE dead_letter (
+    identifier BIGINT GENERATED ALWAYS AS IDENTITY PRIMARY KEY,
+    sensor_identifier UUID NOT NULL REFERENCES sensor (identifier) ON DELETE CASCADE,
+    kind TEXT NOT NULL,
+    payload BYTEA NOT NULL,
+    error TEXT NOT NULL,
+    receipt_timestamp TIMESTAMPTZ NOT NULL
+);
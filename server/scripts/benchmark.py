@@ -0,0 +1,661 @@
+import argparse
+import asyncio
+import datetime
+import json
+import random
+import statistics
+import sys
+import time
+import uuid
+
+import aiomqtt
+
+import app.database as database
+import app.ingestion as ingestion
+import app.main as main
+import app.mqtt as mqtt
+import app.settings as settings
+import app.validation as validation
+
+
+# Attributes of the edge node's `MQTTMeasurementData` message
+ATTRIBUTES = [
+    "gmp343_raw",
+    "gmp343_compensated",
+    "gmp343_filtered",
+    "gmp343_temperature",
+    "bme280_temperature",
+    "bme280_humidity",
+    "bme280_pressure",
+    "sht45_temperature",
+    "sht45_humidity",
+]
+
+
+def _report(name, count, seconds, unit="rows"):
+    rate = count / seconds
+    print(f"{name:<32} {count:>10} {unit} {seconds:>8.3f} s {rate:>10.0f} {unit}/s")
+
+
+async def _sensors(dbpool, count):
+    """Create a network with the given number of sensors and return their ids."""
+    network_name = f"benchmark-{uuid.uuid4().hex[:8]}"
+    query, arguments = database.parametrize(
+        identifier="create-network", arguments={"network_name": network_name}
+    )
+    network_identifier = await dbpool.fetchval(query, *arguments)
+    query, arguments = database.parametrize(
+        identifier="create-sensor",
+        arguments=[
+            {"network_identifier": network_identifier, "sensor_name": f"s{i}"}
+            for i in range(count)
+        ],
+    )
+    return network_identifier, [
+        await dbpool.fetchval(query, *argument) for argument in arguments
+    ]
+
+
+def _messages(sensor_identifiers, count, timestamp):
+    """Generate measurement messages as rows, one list of rows per message."""
+    return [
+        [
+            (
+                sensor_identifier,
+                attribute,
+                random.random(),
+                0,
+                timestamp + i * 10,
+                timestamp + i * 10,
+            )
+            for attribute in ATTRIBUTES
+        ]
+        for i in range(count)
+        for sensor_identifier in sensor_identifiers
+    ]
+
+
+async def _read(connection, query, sensor_identifiers, reads):
+    """Read a page of measurements per sensor in turn and return the duration."""
+    start = time.perf_counter()
+    for i in range(reads):
+        await connection.fetch(query, sensor_identifiers[i % len(sensor_identifiers)])
+    return time.perf_counter() - start
+
+
+########################################################################################
+# Benchmark: Measurement ingestion
+########################################################################################
+
+
+async def benchmark_ingestion(sensors, messages, capacity):
+    """Compare per-message executemany inserts with micro-batched COPY."""
+    async with database.pool() as dbpool:
+        network_identifier, sensor_identifiers = await _sensors(dbpool, sensors)
+        # Measurements are unique, so each run writes its own timestamps
+        timestamp = time.time()
+        batches = _messages(sensor_identifiers, messages, timestamp)
+        count = sum(len(rows) for rows in batches)
+        registry = ingestion.Registry(dbpool=dbpool, capacity=0, timeout=0)
+        await registry.load()
+        attributes = ingestion.Dictionary(
+            dbpool=dbpool, query="create-attributes", argument="attribute_names"
+        )
+        await attributes.encode(ATTRIBUTES)
+        try:
+            # Baseline: One executemany per message, as before
+            query, _ = database.parametrize(
+                identifier="create-measurement",
+                arguments={"sensor_identifier": None},
+            )
+            start = time.perf_counter()
+            for rows in batches:
+                await dbpool.executemany(query, [row[:5] for row in rows])
+            _report("executemany", count, time.perf_counter() - start)
+            # Micro-batched COPY
+            batches = _messages(sensor_identifiers, messages, timestamp + 5)
+            batcher = ingestion.Batcher(
+                dbpool=dbpool,
+                table="measurement",
+                columns=mqtt.MEASUREMENT_COLUMNS,
+                capacity=capacity,
+                timeout=None,
+                prepare=mqtt._compact(registry, attributes),
+            )
+            start = time.perf_counter()
+            for rows in batches:
+                await batcher.put(rows)
+            await batcher.flush()
+            _report(f"copy (capacity={capacity})", count, time.perf_counter() - start)
+        finally:
+            await dbpool.execute(
+                "DELETE FROM network WHERE identifier = $1;", network_identifier
+            )
+
+
+########################################################################################
+# Benchmark: Measurement storage layout
+########################################################################################
+
+
+# The measurement table before sensors and attributes were replaced by surrogate keys
+LEGACY_LAYOUT = """
+CREATE TEMPORARY TABLE measurement_legacy (
+    sensor_identifier UUID NOT NULL,
+    attribute TEXT NOT NULL,
+    value DOUBLE PRECISION NOT NULL,
+    revision INT,
+    creation_timestamp TIMESTAMPTZ NOT NULL,
+    receipt_timestamp TIMESTAMPTZ NOT NULL
+);
+CREATE UNIQUE INDEX ON measurement_legacy (
+    sensor_identifier ASC, creation_timestamp ASC, attribute ASC
+);
+"""
+LEGACY_COLUMNS = (
+    "sensor_identifier",
+    "attribute",
+    "value",
+    "revision",
+    "creation_timestamp",
+    "receipt_timestamp",
+)
+# The current measurement table, without the foreign keys
+COMPACT_LAYOUT = """
+CREATE TEMPORARY TABLE measurement_compact (
+    value DOUBLE PRECISION NOT NULL,
+    creation_timestamp TIMESTAMPTZ NOT NULL,
+    receipt_timestamp TIMESTAMPTZ NOT NULL,
+    sensor_number INT NOT NULL,
+    revision INT,
+    attribute_identifier SMALLINT NOT NULL
+);
+CREATE UNIQUE INDEX ON measurement_compact (
+    sensor_number ASC, creation_timestamp ASC, attribute_identifier ASC
+);
+"""
+# Read the latest page of a sensor's measurements, like `read-measurements-previous`
+LEGACY_QUERY = """
+SELECT creation_timestamp, jsonb_object_agg(attribute, value) AS value
+FROM measurement_legacy
+WHERE sensor_identifier = $1
+GROUP BY creation_timestamp
+ORDER BY creation_timestamp DESC
+LIMIT 64;
+"""
+COMPACT_QUERY = """
+SELECT
+    measurement.creation_timestamp,
+    jsonb_object_agg(attribute.name, measurement.value) AS value
+FROM {table} AS measurement
+INNER JOIN attribute ON measurement.attribute_identifier = attribute.identifier
+WHERE
+    measurement.sensor_number = (SELECT number FROM sensor WHERE identifier = $1)
+GROUP BY measurement.creation_timestamp
+ORDER BY measurement.creation_timestamp DESC
+LIMIT 64;
+"""
+
+
+async def benchmark_storage(sensors, messages, reads):
+    """Compare the size and read speed of the legacy and compact measurement layout."""
+    async with database.pool() as dbpool, dbpool.acquire() as connection:
+        network_identifier, sensor_identifiers = await _sensors(connection, sensors)
+        registry = ingestion.Registry(dbpool=connection, capacity=0, timeout=0)
+        await registry.load()
+        attributes = ingestion.Dictionary(
+            dbpool=connection, query="create-attributes", argument="attribute_names"
+        )
+        compact = mqtt._compact(registry, attributes)
+        rows = [
+            row
+            for rows in _messages(sensor_identifiers, messages, time.time())
+            for row in rows
+        ]
+        try:
+            await connection.execute(LEGACY_LAYOUT)
+            await connection.execute(COMPACT_LAYOUT)
+            for table, columns, records, query in [
+                ("measurement_legacy", LEGACY_COLUMNS, rows, LEGACY_QUERY),
+                (
+                    "measurement_compact",
+                    mqtt.MEASUREMENT_COLUMNS,
+                    await compact(rows),
+                    COMPACT_QUERY.format(table="measurement_compact"),
+                ),
+            ]:
+                start = time.perf_counter()
+                await connection.copy_records_to_table(
+                    table, records=records, columns=columns
+                )
+                _report(f"{table} (copy)", len(rows), time.perf_counter() - start)
+                await connection.execute(f"VACUUM ANALYZE {table};")
+                size = await connection.fetchval(
+                    "SELECT pg_total_relation_size($1);", table
+                )
+                print(
+                    f"{table + ' (size)':<32} {size / 2**20:>10.1f} MiB"
+                    f" {size / len(rows):>10.1f} bytes/row"
+                )
+                seconds = await _read(connection, query, sensor_identifiers, reads)
+                _report(f"{table} (read)", reads, seconds, "pages")
+        finally:
+            await connection.execute(
+                "DROP TABLE IF EXISTS measurement_legacy, measurement_compact;"
+            )
+            await connection.execute(
+                "DELETE FROM network WHERE identifier = $1;", network_identifier
+            )
+
+
+########################################################################################
+# Benchmark: Measurement compression
+########################################################################################
+
+
+# The measurement table with its compression settings, without the foreign keys
+COMPRESSIBLE_LAYOUT = """
+CREATE TABLE measurement_benchmark (
+    value DOUBLE PRECISION NOT NULL,
+    creation_timestamp TIMESTAMPTZ NOT NULL,
+    receipt_timestamp TIMESTAMPTZ NOT NULL,
+    sensor_number INT NOT NULL,
+    revision INT,
+    attribute_identifier SMALLINT NOT NULL
+);
+SELECT create_hypertable('measurement_benchmark', 'creation_timestamp');
+CREATE UNIQUE INDEX ON measurement_benchmark (
+    sensor_number ASC, creation_timestamp ASC, attribute_identifier ASC
+);
+ALTER TABLE measurement_benchmark SET (
+    timescaledb.compress,
+    timescaledb.compress_segmentby = 'sensor_number, attribute_identifier',
+    timescaledb.compress_orderby = 'creation_timestamp ASC'
+);
+"""
+
+
+async def benchmark_compression(sensors, messages, reads):
+    """Compare size and read speed of measurements before and after compression."""
+    async with database.pool() as dbpool, dbpool.acquire() as connection:
+        network_identifier, sensor_identifiers = await _sensors(connection, sensors)
+        registry = ingestion.Registry(dbpool=connection, capacity=0, timeout=0)
+        await registry.load()
+        attributes = ingestion.Dictionary(
+            dbpool=connection, query="create-attributes", argument="attribute_names"
+        )
+        rows = [
+            row
+            for rows in _messages(sensor_identifiers, messages, time.time())
+            for row in rows
+        ]
+        records = await mqtt._compact(registry, attributes)(rows)
+        query = COMPACT_QUERY.format(table="measurement_benchmark")
+        try:
+            await connection.execute(COMPRESSIBLE_LAYOUT)
+            await connection.copy_records_to_table(
+                "measurement_benchmark",
+                records=records,
+                columns=mqtt.MEASUREMENT_COLUMNS,
+            )
+            for state in ["uncompressed", "compressed"]:
+                if state == "compressed":
+                    start = time.perf_counter()
+                    await connection.execute(
+                        "SELECT compress_chunk(chunk)"
+                        " FROM show_chunks('measurement_benchmark') AS chunk;"
+                    )
+                    _report("compression", len(rows), time.perf_counter() - start)
+                await connection.execute("ANALYZE measurement_benchmark;")
+                size = await connection.fetchval(
+                    "SELECT hypertable_size('measurement_benchmark');"
+                )
+                print(
+                    f"{state + ' (size)':<32} {size / 2**20:>10.1f} MiB"
+                    f" {size / len(rows):>10.1f} bytes/row"
+                )
+                seconds = await _read(connection, query, sensor_identifiers, reads)
+                _report(f"{state} (read)", reads, seconds, "pages")
+        finally:
+            await connection.execute("DROP TABLE IF EXISTS measurement_benchmark;")
+            await connection.execute(
+                "DELETE FROM network WHERE identifier = $1;", network_identifier
+            )
+
+
+########################################################################################
+# Benchmark: Payload decoding
+########################################################################################
+
+
+def _payloads(count, elements):
+    """Generate realistic measurements, logs and acknowledgments payloads."""
+    timestamp = time.time()
+    measurements = [
+        {
+            "revision": 3,
+            "timestamp": timestamp + i,
+            "value": {attribute: random.random() * 1000 for attribute in ATTRIBUTES},
+        }
+        for i in range(elements)
+    ]
+    logs = [
+        {
+            "severity": random.choice(["info", "warning", "error"]),
+            "revision": 3,
+            "timestamp": timestamp + i,
+            "message": "Calibration procedure is not due." * random.randint(1, 64),
+        }
+        for i in range(elements)
+    ]
+    acknowledgments = [
+        {"revision": i, "timestamp": timestamp + i, "success": True}
+        for i in range(elements)
+    ]
+    return {
+        "measurements": [json.dumps(measurements).encode()] * count,
+        "logs": [json.dumps(logs).encode()] * count,
+        "acknowledgments": [json.dumps(acknowledgments).encode()] * count,
+    }
+
+
+def _validate_measurements(payload):
+    return [
+        ("s", attribute, value, element.revision, element.timestamp, 0.0)
+        for element in validation.MeasurementsValidator.validate_json(payload)
+        for attribute, value in element.value.items()
+    ]
+
+
+def _validate_logs(payload):
+    return [
+        ("s", element.severity, element.message, element.revision, element.timestamp)
+        for element in validation.LogsValidator.validate_json(payload)
+    ]
+
+
+def _validate_acks(payload):
+    return [
+        ("s", element.revision, element.timestamp, element.success)
+        for element in validation.AcknowledgmentsValidator.validate_json(payload)
+    ]
+
+
+def benchmark_decoding(messages, elements):
+    """Compare the pydantic validators with the fast-path decoders."""
+    payloads = _payloads(messages, elements)
+    for kind, validate, decode in [
+        ("measurements", _validate_measurements, validation.decode_measurements),
+        ("logs", _validate_logs, validation.decode_logs),
+        ("acknowledgments", _validate_acks, validation.decode_acknowledgments),
+    ]:
+        start = time.perf_counter()
+        for payload in payloads[kind]:
+            validate(payload)
+        _report(f"{kind} (pydantic)", messages, time.perf_counter() - start, "msgs")
+        start = time.perf_counter()
+        for payload in payloads[kind]:
+            decode(payload, "s", 0.0)
+        _report(f"{kind} (decoder)", messages, time.perf_counter() - start, "msgs")
+
+
+########################################################################################
+# Benchmark: Database codecs
+########################################################################################
+
+
+# Codecs based on the standard library, for comparison with `database.CODECS`
+_STANDARD_CODECS = {
+    "timestamptz": (
+        lambda x: datetime.datetime.fromtimestamp(x, datetime.timezone.utc).isoformat(),
+        lambda x: datetime.datetime.fromisoformat(x).timestamp(),
+    ),
+    "uuid": (lambda x: uuid.UUID(x).bytes, lambda x: str(uuid.UUID(bytes=x))),
+    "jsonb": (json.dumps, json.loads),
+}
+
+
+def _values(count):
+    """Generate the values of a measurement export and of sensor configurations."""
+    timestamp = time.time()
+    sensor_identifiers = [str(uuid.uuid4()) for _ in range(20)]
+    configuration = {
+        "measurement_interval": 8.5,
+        "calibration_gases": [
+            {"bottle_id": i, "concentration": 400.0} for i in range(4)
+        ],
+        "strategy": "default",
+    }
+    return {
+        "timestamptz": [timestamp + i * 0.123456 for i in range(count)],
+        "uuid": [sensor_identifiers[i % 20] for i in range(count)],
+        "jsonb": [configuration] * count,
+    }
+
+
+def benchmark_codecs(values):
+    """Compare the database codecs with ones based on the standard library."""
+    for typename, elements in _values(values).items():
+        for name, (encoder, decoder) in [
+            ("standard", _STANDARD_CODECS[typename]),
+            ("codec", database.CODECS[typename][:2]),
+        ]:
+            start = time.perf_counter()
+            wire = [encoder(element) for element in elements]
+            seconds = time.perf_counter() - start
+            _report(f"{typename} encode ({name})", values, seconds, "values")
+            start = time.perf_counter()
+            for element in wire:
+                decoder(element)
+            seconds = time.perf_counter() - start
+            _report(f"{typename} decode ({name})", values, seconds, "values")
+
+
+########################################################################################
+# Benchmark: End-to-end ingestion of a simulated fleet
+########################################################################################
+
+
+# Attributes of the edge node's `MQTTCalibrationData` and `MQTTSystemData` messages
+CALIBRATION_ATTRIBUTES = ["cal_bottle_id"] + [f"cal_{x}" for x in ATTRIBUTES]
+SYSTEM_ATTRIBUTES = [
+    "enclosure_bme280_temperature",
+    "enclosure_bme280_humidity",
+    "enclosure_bme280_pressure",
+    "raspi_cpu_temperature",
+    "raspi_disk_usage",
+    "raspi_cpu_usage",
+    "raspi_memory_usage",
+    "ups_powered_by_grid",
+    "ups_battery_is_fully_charged",
+    "ups_battery_error_detected",
+    "ups_battery_above_voltage_threshold",
+]
+
+
+def _message():
+    """Generate the topic kind and payload of a message like an edge node sends."""
+    timestamp = time.time()
+    x = random.random()
+    if x < 0.01:
+        payload = [{"revision": 0, "timestamp": timestamp, "success": True}]
+        return "acknowledgments", payload
+    if x < 0.1:
+        payload = [
+            {
+                "severity": random.choice(["info", "warning", "error"]),
+                "revision": 0,
+                "timestamp": timestamp,
+                "message": "Calibration procedure is not due." * random.randint(1, 8),
+            }
+        ]
+        return "logs", payload
+    attributes = (
+        CALIBRATION_ATTRIBUTES
+        if x < 0.15
+        else SYSTEM_ATTRIBUTES if x < 0.25 else ATTRIBUTES
+    )
+    payload = [
+        {
+            "revision": 0,
+            "timestamp": timestamp,
+            "value": {attribute: random.random() * 1000 for attribute in attributes},
+        }
+    ]
+    return "measurements", payload
+
+
+async def _simulate(sensor_identifiers, rate, duration):
+    """Publish messages of the given sensors at `rate` messages/s per sensor."""
+    count = 0
+    async with aiomqtt.Client(
+        hostname=settings.MQTT_URL,
+        port=settings.MQTT_PORT,
+        protocol=aiomqtt.ProtocolVersion.V5,
+        username=settings.MQTT_USERNAME,
+        password=settings.MQTT_PASSWORD,
+    ) as client:
+        interval = 1 / (rate * len(sensor_identifiers))
+        start = time.monotonic()
+        while (elapsed := time.monotonic() - start) < duration:
+            # Catch up if we're behind schedule, otherwise wait for the next message
+            if count * interval > elapsed:
+                await asyncio.sleep(count * interval - elapsed)
+            kind, payload = _message()
+            sensor_identifier = sensor_identifiers[count % len(sensor_identifiers)]
+            await client.publish(
+                topic=f"{settings.MQTT_BASE_TOPIC}{kind}/{sensor_identifier}",
+                payload=mqtt._encode_payload(payload),
+                qos=1,
+            )
+            count += 1
+    return count
+
+
+class _Recorder:
+    """Record the creation to commit latency of each written message."""
+
+    def __init__(self):
+        self.messages = set()
+        self.latencies = []
+        self.rows = 0
+        self.last = None
+
+    def __call__(self, kind, rows):
+        now = time.time()
+        self.rows += len(rows)
+        self.last = time.monotonic()
+        # Rows of one message share the sensor and the creation timestamp
+        index = mqtt._CREATION_TIMESTAMP[kind]
+        for key in {(kind, row[0], row[index]) for row in rows}:
+            if key not in self.messages:
+                self.messages.add(key)
+                self.latencies.append(now - key[2])
+
+
+async def benchmark_fleet(sensors, rate, duration, connections, thresholds):
+    """Simulate a fleet of edge nodes and measure the end-to-end ingestion."""
+    recorder = _Recorder()
+    async with database.pool() as dbpool, mqtt.client() as mqttc:
+        network_identifier, sensor_identifiers = await _sensors(dbpool, sensors)
+        try:
+            async with main.pipeline(dbpool, mqttc, written=recorder) as state:
+                # Give the listener some time to subscribe
+                await asyncio.sleep(1)
+                start = time.monotonic()
+                counts = await asyncio.gather(
+                    *[
+                        _simulate(sensor_identifiers[i::connections], rate, duration)
+                        for i in range(connections)
+                        if len(sensor_identifiers[i::connections]) > 0
+                    ]
+                )
+                published = sum(counts)
+                _report("published", published, time.monotonic() - start, "msgs")
+                # Wait until the backlog is processed
+                while state["queue"].statistics()["lag_elements"] > 0:
+                    await asyncio.sleep(0.1)
+                await state["dispatcher"].join()
+            # The pipeline's exit flushes the remaining rows
+            seconds = (recorder.last or time.monotonic()) - start
+        finally:
+            await dbpool.execute(
+                "DELETE FROM network WHERE identifier = $1;", network_identifier
+            )
+    received = state["queue"].statistics()["received"]
+    _report("committed", len(recorder.messages), seconds, "msgs")
+    _report("committed", recorder.rows, seconds, "rows")
+    if len(recorder.latencies) < 2:
+        print("Not enough messages were committed", file=sys.stderr)
+        return False
+    latencies = statistics.quantiles(recorder.latencies, n=100)
+    p50, p99 = latencies[49], latencies[98]
+    print(f"{'creation to commit latency':<32} p50 {p50:.3f} s p99 {p99:.3f} s")
+    print(f"{'received messages by kind':<32} {received}")
+    # Fail if one of the thresholds is crossed, e.g. to catch regressions in CI
+    failures = []
+    if (throughput := len(recorder.messages) / seconds) < thresholds["throughput"]:
+        failures.append(f"throughput {throughput:.0f} msgs/s")
+    if p99 > thresholds["latency"]:
+        failures.append(f"p99 latency {p99:.3f} s")
+    for failure in failures:
+        print(f"Threshold crossed: {failure}", file=sys.stderr)
+    return len(failures) == 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+    subparser = subparsers.add_parser("ingestion", help=benchmark_ingestion.__doc__)
+    subparser.add_argument("--sensors", type=int, default=20)
+    subparser.add_argument("--messages", type=int, default=100)
+    subparser.add_argument("--capacity", type=int, default=4096)
+    subparser = subparsers.add_parser("storage", help=benchmark_storage.__doc__)
+    subparser.add_argument("--sensors", type=int, default=100)
+    subparser.add_argument("--messages", type=int, default=1000)
+    subparser.add_argument("--reads", type=int, default=1000)
+    subparser = subparsers.add_parser("compression", help=benchmark_compression.__doc__)
+    subparser.add_argument("--sensors", type=int, default=100)
+    subparser.add_argument("--messages", type=int, default=1000)
+    subparser.add_argument("--reads", type=int, default=1000)
+    subparser = subparsers.add_parser("decoding", help=benchmark_decoding.__doc__)
+    subparser.add_argument("--messages", type=int, default=10000)
+    subparser.add_argument("--elements", type=int, default=4)
+    subparser = subparsers.add_parser("codecs", help=benchmark_codecs.__doc__)
+    subparser.add_argument("--values", type=int, default=100000)
+    subparser = subparsers.add_parser("fleet", help=benchmark_fleet.__doc__)
+    subparser.add_argument("--sensors", type=int, default=500)
+    subparser.add_argument("--rate", type=float, default=1, help="msgs/s per sensor")
+    subparser.add_argument("--duration", type=float, default=30, help="seconds")
+    subparser.add_argument("--connections", type=int, default=8)
+    subparser.add_argument(
+        "--min-throughput", type=float, default=0, help="fail below this msgs/s"
+    )
+    subparser.add_argument(
+        "--max-latency", type=float, default=float("inf"), help="fail above this p99"
+    )
+    args = parser.parse_args()
+    if args.benchmark == "ingestion":
+        asyncio.run(benchmark_ingestion(args.sensors, args.messages, args.capacity))
+    if args.benchmark == "storage":
+        asyncio.run(benchmark_storage(args.sensors, args.messages, args.reads))
+    if args.benchmark == "compression":
+        asyncio.run(benchmark_compression(args.sensors, args.messages, args.reads))
+    if args.benchmark == "decoding":
+        benchmark_decoding(args.messages, args.elements)
+    if args.benchmark == "codecs":
+        benchmark_codecs(args.values)
+    if args.benchmark == "fleet":
+        success = asyncio.run(
+            benchmark_fleet(
+                sensors=args.sensors,
+                rate=args.rate,
+                duration=args.duration,
+                connections=args.connections,
+                thresholds={
+                    "throughput": args.min_throughput,
+                    "latency": args.max_latency,
+                },
+            )
+        )
+        sys.exit(0 if success else 1)
@@ -1,22 +1,71 @@
 import argparse
 import asyncio
 
+import app.settings as settings
 import tests.conftest
 
 
+async def policies(connection):
+    """Apply the configured compression and retention policies to the measurements."""
+    await connection.execute(
+        "SELECT remove_compression_policy('measurement', if_exists => TRUE);"
+    )
+    await connection.execute(
+        "SELECT add_compression_policy('measurement', $1::TEXT::INTERVAL);",
+        settings.MEASUREMENT_COMPRESSION_AGE,
+    )
+    await connection.execute(
+        "SELECT remove_retention_policy('measurement', if_exists => TRUE);"
+    )
+    if settings.MEASUREMENT_RETENTION_AGE is None:
+        return
+    # Refreshing an aggregate over a range without raw data would empty it, so raw
+    # data has to outlive the windows that the aggregates are refreshed over
+    retainable = await connection.fetchval(
+        (
+            "SELECT $1::TEXT::INTERVAL > max((config->>'start_offset')::INTERVAL)"
+            " FROM timescaledb_information.jobs"
+            " WHERE proc_name = 'policy_refresh_continuous_aggregate';"
+        ),
+        settings.MEASUREMENT_RETENTION_AGE,
+    )
+    if not retainable:
+        raise ValueError("Retention must be longer than the aggregates' refresh window")
+    await connection.execute(
+        "SELECT add_retention_policy('measurement', $1::TEXT::INTERVAL);",
+        settings.MEASUREMENT_RETENTION_AGE,
+    )
+
+
 async def initialize(populate=False):
     """Initialize the database schema, optionally populate with example data."""
     async with tests.conftest._connection() as connection:
         with open("schema.sql") as file:
             for statement in file.read().split("\n\n\n"):
                 await connection.execute(statement)
+        await policies(connection)
         if populate:
             await tests.conftest._populate(connection)
-            await connection.execute("CALL refresh_continuous_aggregate('measurement_aggregation_1_hour', NULL, NULL);")  # fmt: skip
+            for resolution in ["1_minute", "1_hour", "1_day"]:
+                await connection.execute(f"CALL refresh_continuous_aggregate('measurement_aggregation_{resolution}', NULL, NULL);")  # fmt: skip
+
+
+async def update():
+    """Apply the configured policies to an existing database."""
+    async with tests.conftest._connection() as connection:
+        await policies(connection)
 
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--populate", action="store_true")
+    parser.add_argument(
+        "--policies",
+        action="store_true",
+        help="only apply the storage policies to an existing database",
+    )
     args = parser.parse_args()
-    asyncio.run(initialize(populate=args.populate))
+    if args.policies:
+        asyncio.run(update())
+    else:
+        asyncio.run(initialize(populate=args.populate))
@@ -0,0 +1,26 @@
+import argparse
+import asyncio
+
+import app.database as database
+import app.mqtt as mqtt
+
+
+async def replay(kinds, batch_size):
+    """Run dead letters through the ingestion again, e.g. after fixing a bug."""
+    async with database.pool() as dbpool:
+        count = await mqtt.replay(dbpool, kinds=kinds, batch_size=batch_size)
+    print(f"Replayed and deleted {count} dead letter(s)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=replay.__doc__)
+    parser.add_argument(
+        "--kind",
+        action="append",
+        choices=list(mqtt.SUBSCRIPTIONS.keys()),
+        help="replay only dead letters of this kind, can be given multiple times",
+    )
+    parser.add_argument("--batch-size", type=int, default=1024)
+    args = parser.parse_args()
+    kinds = args.kind or list(mqtt.SUBSCRIPTIONS.keys())
+    asyncio.run(replay(kinds, args.batch_size))
@@ -46,6 +46,12 @@ async def _populate(connection):
                 f'INSERT INTO "{table_name}" VALUES ({identifiers});',
                 [tuple(record.values()) for record in records],
             )
+    # Continue the surrogate keys after the ones in the example data
+    for table, column in [("sensor", "number"), ("attribute", "identifier")]:
+        await connection.execute(
+            f"SELECT setval(pg_get_serial_sequence('{table}', '{column}'),"
+            f" max({column})) FROM {table};"
+        )
 
 
 @pytest.fixture(scope="function")
@@ -56,5 +62,7 @@ async def setup(connection):
         await connection.execute('DELETE FROM "user";')
         await connection.execute("DELETE FROM network;")
         await connection.execute("DELETE FROM sensor;")
+        await connection.execute("DELETE FROM log_message;")
+        await connection.execute("DELETE FROM attribute;")
         # Populate with the initial test data again
         await _populate(connection)
@@ -0,0 +1,81 @@
+import asyncio
+import time
+
+import pytest
+
+import app.auth as auth
+import app.errors as errors
+
+
+def test_cache_expires_values(monkeypatch):
+    """Test that values are forgotten after the timeout."""
+    cache = auth.Cache(capacity=2, timeout=60)
+    cache.set("a", 1)
+    assert cache.get("a") == 1
+    now = time.monotonic()
+    monkeypatch.setattr(time, "monotonic", lambda: now + 60)
+    assert cache.get("a") is None
+    assert cache.statistics() == {"size": 0, "hits": 1, "misses": 1, "hit_rate": 0.5}
+
+
+def test_cache_forgets_least_recently_used_values():
+    """Test that the least recently used value is forgotten when the cache is full."""
+    cache = auth.Cache(capacity=2, timeout=60)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+    assert cache.get("b") is None
+    assert cache.get("a") == 1 and cache.get("c") == 3
+
+
+def test_cache_discards_matching_values():
+    """Test that all relationships within a network are discarded at once."""
+    cache = auth.Cache(capacity=4, timeout=60)
+    cache.set(("network-a", "user", None), auth.Relationship.OWNER)
+    cache.set(("network-a", "user", "sensor"), auth.Relationship.OWNER)
+    cache.set(("network-b", "user", None), auth.Relationship.DEFAULT)
+    cache.discard(lambda key: key[0] == "network-a")
+    assert cache.get(("network-a", "user", None)) is None
+    assert cache.get(("network-a", "user", "sensor")) is None
+    assert cache.get(("network-b", "user", None)) == auth.Relationship.DEFAULT
+    assert cache.statistics()["hit_rate"] == 1 / 3
+
+
+@pytest.mark.anyio
+async def test_hasher_hashes_and_verifies_passwords():
+    """Test hashing and verifying passwords in the executor."""
+    with auth.hasher(concurrency=1, capacity=1) as hasher:
+        password_hash = await hasher.hash("12345678")
+        assert await hasher.verify("12345678", password_hash)
+        assert not await hasher.verify("87654321", password_hash)
+        statistics = hasher.statistics()
+    assert statistics["processed"] == 3
+    assert statistics["active"] == 0 and statistics["waiting"] == 0
+
+
+@pytest.mark.anyio
+async def test_hasher_rejects_calls_when_full():
+    """Test that calls beyond the capacity are rejected instead of queued."""
+    with auth.hasher(concurrency=1, capacity=1) as hasher:
+        results = await asyncio.gather(
+            *[hasher.hash("12345678") for _ in range(3)], return_exceptions=True
+        )
+        statistics = hasher.statistics()
+    assert isinstance(results[2], errors.ServiceUnavailableError)
+    assert statistics["processed"] == 2 and statistics["rejected"] == 1
+
+
+@pytest.mark.anyio
+async def test_hasher_closes_without_waiting_for_running_calls():
+    """Test that closing cancels waiting calls instead of blocking the event loop."""
+    with auth.hasher(concurrency=1, capacity=1) as hasher:
+        running = asyncio.create_task(hasher._run(time.sleep, 0.5))
+        waiting = asyncio.create_task(hasher._run(time.sleep, 0.5))
+        await asyncio.sleep(0.1)
+        start = time.monotonic()
+    assert time.monotonic() - start < 0.1
+    with pytest.raises(asyncio.CancelledError):
+        await waiting
+    assert not running.done()
+    await running
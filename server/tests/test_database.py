@@ -0,0 +1,117 @@
+import json
+
+import pytest
+
+import app.database as database
+
+
+def _nodes(plan):
+    """Yield the nodes of a JSON query plan, depth first."""
+    yield plan
+    for child in plan.get("Plans", []):
+        yield from _nodes(child)
+
+
+async def _explain(connection, identifier, arguments):
+    """Return the nodes of the query plan, with sequential scans disabled.
+
+    The test data is so small that the planner would otherwise prefer sequential scans
+    and sorts, which says nothing about the plans on real amounts of data.
+    """
+    query, arguments = database.parametrize(identifier, arguments)
+    async with connection.transaction():
+        await connection.execute("SET LOCAL enable_seqscan = off;")
+        plan = await connection.fetchval(f"EXPLAIN (FORMAT JSON) {query}", *arguments)
+    return list(_nodes(json.loads(plan)[0]["Plan"]))
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("direction", ["next", "previous"])
+@pytest.mark.parametrize("creation_timestamp", [None, 100.0])
+async def test_reading_measurements_scans_the_index_in_order(
+    setup, connection, direction, creation_timestamp
+):
+    """Test that pages of measurements are read from the index without sorting."""
+    nodes = await _explain(
+        connection,
+        f"read-measurements-{direction}",
+        {
+            "sensor_identifier": "81bf7042-e20f-4a97-ac44-c15853e3618f",
+            "creation_timestamp": creation_timestamp,
+            "limit": 64,
+        },
+    )
+    assert not any(node["Node Type"] == "Sort" for node in nodes)
+    scans = [node for node in nodes if node.get("Relation Name") == "measurement"]
+    scans += [node for node in nodes if "_hyper_" in node.get("Relation Name", "")]
+    assert all("Index" in node["Node Type"] for node in scans)
+    assert all("creation_timestamp" in node["Index Cond"] for node in scans)
+
+
+@pytest.mark.anyio
+async def test_exporting_measurements_scans_the_index_in_order(setup, connection):
+    """Test that the export's cursor can stream from the index without sorting."""
+    nodes = await _explain(
+        connection,
+        "export-measurements",
+        {
+            "sensor_identifier": "81bf7042-e20f-4a97-ac44-c15853e3618f",
+            "start_timestamp": 100.0,
+            "end_timestamp": None,
+        },
+    )
+    assert not any(node["Node Type"] == "Sort" for node in nodes)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("direction", ["next", "previous"])
+@pytest.mark.parametrize("log_identifier", [None, 1])
+async def test_reading_logs_scans_the_index_in_order(
+    setup, connection, direction, log_identifier
+):
+    """Test that pages of logs are read from the index, sorting only the page."""
+    nodes = await _explain(
+        connection,
+        f"read-logs-{direction}",
+        {
+            "sensor_identifier": "81bf7042-e20f-4a97-ac44-c15853e3618f",
+            "creation_timestamp": 100.0,
+            "log_identifier": log_identifier,
+            "limit": 64,
+        },
+    )
+    # The page is limited before it's joined with the messages and sorted again
+    limit = next(node for node in nodes if node["Node Type"] == "Limit")
+    below = list(_nodes(limit))
+    assert not any(node["Node Type"] == "Sort" for node in below)
+    scans = [node for node in below if "Index Cond" in node]
+    assert len(scans) > 0
+    assert all("creation_timestamp" in node["Index Cond"] for node in scans)
+
+
+########################################################################################
+# Codecs
+########################################################################################
+
+
+@pytest.mark.parametrize(
+    "typename, value",
+    [
+        ("timestamptz", 1683644400.0),
+        ("timestamptz", 0.0),
+        ("uuid", "575a7328-4e2e-4b88-afcc-e0b5ed3920cc"),
+        ("jsonb", {"measurement_interval": 8.5, "strategy": "default", "list": [1]}),
+        ("jsonb", "example"),
+    ],
+)
+def test_codecs_roundtrip(typename, value):
+    """Test that values are decoded to what they were encoded from."""
+    encoder, decoder, _ = database.CODECS[typename]
+    assert decoder(encoder(value)) == value
+
+
+def test_uuid_codec_rejects_malformed_identifiers():
+    """Test that malformed identifiers are rejected before they're sent."""
+    encoder, _, _ = database.CODECS["uuid"]
+    with pytest.raises(ValueError):
+        encoder("575a7328-4e2e-4b88-afcc-e0b5ed3920c")
@@ -0,0 +1,85 @@
+import datetime
+import json
+
+import pyarrow
+import pyarrow.ipc
+
+import app.export as export
+
+
+def _timestamp(x):
+    return datetime.datetime.fromtimestamp(x, tz=datetime.timezone.utc)
+
+
+########################################################################################
+# Format: NDJSON
+########################################################################################
+
+
+def test_ndjson():
+    """Test that each data point is a JSON object with the export's columns."""
+    encoder = export.NDJSON()
+    content = encoder.encode("a", [("temperature", 1.5, 2, 100.25)])
+    assert content.endswith(b"\n")
+    assert json.loads(content) == {
+        "sensor_identifier": "a",
+        "attribute": "temperature",
+        "value": 1.5,
+        "revision": 2,
+        "creation_timestamp": 100.25,
+    }
+
+
+def test_ndjson_with_non_finite_values():
+    """Test that non-finite values are written as valid JSON null."""
+    encoder = export.NDJSON()
+    rows = [("x", float("nan"), None, 0.0), ("y", float("inf"), None, 1.0)]
+    lines = encoder.encode("a", rows).splitlines()
+    assert [json.loads(line)["value"] for line in lines] == [None, None]
+
+
+########################################################################################
+# Format: Arrow
+########################################################################################
+
+
+def test_arrow():
+    """Test that pyarrow reads the stream with the same values across batches."""
+    encoder = export.Arrow()
+    batches = [
+        (
+            "a",
+            [
+                ("temperature", 1.5, None, 0.0),
+                ("humidity", -0.25, 1, 1.000001),
+                ("pressure", float("inf"), None, 1700000000.5),
+            ],
+        ),
+        ("b", [("temperature", 7800.0, 3, 2.0)]),
+        ("b", [("", 0.0, None, 3.0)] * 9),
+    ]
+    content = (
+        encoder.start()
+        + b"".join(encoder.encode(*batch) for batch in batches)
+        + encoder.stop()
+    )
+    reader = pyarrow.ipc.open_stream(content)
+    assert reader.schema.names == list(export.COLUMNS)
+    timestamps = reader.schema.field("creation_timestamp")
+    assert timestamps.type == pyarrow.timestamp("us", tz="UTC")
+    assert not reader.schema.field("value").nullable
+    assert reader.schema.field("revision").nullable
+    decoded = list(reader)
+    assert [batch.num_rows for batch in decoded] == [3, 1, 9]
+    expected = [
+        {
+            "sensor_identifier": sensor_identifier,
+            "attribute": attribute,
+            "value": value,
+            "revision": revision,
+            "creation_timestamp": _timestamp(creation_timestamp),
+        }
+        for sensor_identifier, rows in batches
+        for attribute, value, revision, creation_timestamp in rows
+    ]
+    assert [row for batch in decoded for row in batch.to_pylist()] == expected
@@ -1,6 +1,10 @@
+import asyncio
+import json
+
 import aiomqtt
 import pytest
 
+import app.ingestion as ingestion
 import app.mqtt as mqtt
 import app.settings as settings
 
@@ -32,3 +36,696 @@ async def test_receiving_measurements_message(mqtt_client):
         ),
         qos=1,
     )
+
+
+########################################################################################
+# Configurations
+########################################################################################
+
+
+class _Client:
+    """Record the published messages instead of sending them to a broker."""
+
+    def __init__(self):
+        self.messages = []
+
+    async def publish(self, topic, payload, qos, retain):
+        self.messages.append((topic.rsplit("/", 1)[1], json.loads(payload)))
+
+
+@pytest.mark.anyio
+async def test_publisher_publishes_newest_pending_revisions(setup, connection):
+    """Test that the outbox is drained with pending revisions coalesced per sensor."""
+    await connection.executemany(
+        (
+            "INSERT INTO configuration (sensor_identifier, value, revision,"
+            " creation_timestamp) VALUES ($1, $2, $3, $4);"
+        ),
+        [
+            ("81bf7042-e20f-4a97-ac44-c15853e3618f", {}, 3, 1000.0),
+            ("2d2a3794-2345-4500-8baa-493f88123087", {}, 1, 1001.0),
+            ("81bf7042-e20f-4a97-ac44-c15853e3618f", {"x": 1}, 4, 1002.0),
+        ],
+    )
+    client = _Client()
+    publisher = mqtt.Publisher(connection, client, batch_size=1, interval=None)
+    await publisher.drain()
+    assert client.messages == [
+        ("2d2a3794-2345-4500-8baa-493f88123087", {"revision": 1, "configuration": {}}),
+        (
+            "81bf7042-e20f-4a97-ac44-c15853e3618f",
+            {"revision": 4, "configuration": {"x": 1}},
+        ),
+    ]
+    # The superseded revision is skipped and marked as well, the outbox is empty
+    elements = await connection.fetch(
+        "SELECT revision FROM configuration WHERE publication_timestamp IS NULL;"
+    )
+    assert len(elements) == 0
+    await publisher.drain()
+    assert len(client.messages) == 2
+
+
+########################################################################################
+# Batched ingestion
+########################################################################################
+
+
+def _rows(sensor_identifier, count):
+    return [
+        (sensor_identifier, "temperature", 1.0, 0, 1000.0 + i, 1000.0 + i)
+        for i in range(count)
+    ]
+
+
+async def _count(connection, table="measurement"):
+    return await connection.fetchval(
+        f"SELECT count(*) FROM {table} WHERE creation_timestamp >= $1;", 1000.0
+    )
+
+
+async def _compact(connection):
+    """Return the function that encodes measurement rows into the table's layout."""
+    registry = ingestion.Registry(dbpool=connection, capacity=2, timeout=60)
+    await registry.load()
+    attributes = ingestion.Dictionary(
+        dbpool=connection, query="create-attributes", argument="attribute_names"
+    )
+    return mqtt._compact(registry, attributes)
+
+
+@pytest.mark.anyio
+async def test_batcher_flushes_when_full(setup, connection):
+    """Test that the batcher writes the rows as soon as the capacity is reached."""
+    batcher = ingestion.Batcher(
+        dbpool=connection,
+        table="measurement",
+        columns=mqtt.MEASUREMENT_COLUMNS,
+        capacity=4,
+        timeout=None,
+        prepare=await _compact(connection),
+    )
+    await batcher.put(_rows("81bf7042-e20f-4a97-ac44-c15853e3618f", 3))
+    assert len(batcher) == 3
+    assert await _count(connection) == 0
+    await batcher.put(_rows("81bf7042-e20f-4a97-ac44-c15853e3618f", 1))
+    assert len(batcher) == 0
+    assert await _count(connection) == 4
+
+
+@pytest.mark.anyio
+async def test_batcher_with_nonexistent_sensor(setup, connection):
+    """Test that rows of a nonexistent sensor don't prevent the others from writing."""
+    missing = []
+    batcher = ingestion.Batcher(
+        dbpool=connection,
+        table="log",
+        columns=mqtt.LOG_COLUMNS,
+        capacity=4096,
+        timeout=None,
+        missing=missing.append,
+        prepare=ingestion.Interner(
+            dbpool=connection,
+            table="log_message",
+            column="message",
+            index=mqtt.LOG_COLUMNS.index("message_identifier"),
+            capacity=16,
+        ),
+    )
+    for sensor_identifier in [
+        "81bf7042-e20f-4a97-ac44-c15853e3618f",
+        "00000000-0000-4000-8000-000000000000",
+    ]:
+        await batcher.put(
+            [(sensor_identifier, "info", "", 0, 1000.0 + i, 0.0) for i in range(2)]
+        )
+    await batcher.flush()
+    assert len(batcher) == 0
+    assert await _count(connection, table="log") == 2
+    assert missing == ["00000000-0000-4000-8000-000000000000"]
+
+
+@pytest.mark.anyio
+async def test_batcher_with_nonexistent_sensor_and_failure(setup, connection):
+    """Test that rows that fail for another reason while isolating are passed on."""
+    interner = ingestion.Interner(
+        dbpool=connection,
+        table="log_message",
+        column="message",
+        index=mqtt.LOG_COLUMNS.index("message_identifier"),
+        capacity=16,
+    )
+
+    async def prepare(rows):
+        if len(rows) == 1 and rows[0][0] == "2d2a3794-2345-4500-8baa-493f88123087":
+            raise RuntimeError("failure")
+        return await interner(rows)
+
+    async def failed(rows, error):
+        failures.append((rows, error))
+
+    missing, failures = [], []
+    batcher = ingestion.Batcher(
+        dbpool=connection,
+        table="log",
+        columns=mqtt.LOG_COLUMNS,
+        capacity=4096,
+        timeout=None,
+        missing=missing.append,
+        failed=failed,
+        prepare=prepare,
+    )
+    rows = [
+        (sensor_identifier, "info", "", 0, 1000.0, 0.0)
+        for sensor_identifier in [
+            "81bf7042-e20f-4a97-ac44-c15853e3618f",
+            "00000000-0000-4000-8000-000000000000",
+            "2d2a3794-2345-4500-8baa-493f88123087",
+        ]
+    ]
+    await batcher.put(rows)
+    await batcher.flush()
+    assert await _count(connection, table="log") == 1
+    assert missing == ["00000000-0000-4000-8000-000000000000"]
+    assert [(group, str(error)) for group, error in failures] == [
+        ([rows[2]], "failure")
+    ]
+
+
+@pytest.mark.anyio
+async def test_batcher_encodes_measurements(setup, connection):
+    """Test that measurements are written with surrogate keys and read back."""
+    batcher = ingestion.Batcher(
+        dbpool=connection,
+        table="measurement",
+        columns=mqtt.MEASUREMENT_COLUMNS,
+        capacity=4096,
+        timeout=None,
+        prepare=await _compact(connection),
+    )
+    rows = _rows("81bf7042-e20f-4a97-ac44-c15853e3618f", 1)
+    rows += [(*rows[0][:1], "co2", *rows[0][2:])]
+    # Rows of sensors that were deleted in the meantime are skipped
+    await batcher.put(rows + _rows("00000000-0000-4000-8000-000000000000", 1))
+    await batcher.flush()
+    elements = await connection.fetch(
+        (
+            "SELECT sensor.identifier, attribute.name FROM measurement"
+            " INNER JOIN sensor ON measurement.sensor_number = sensor.number"
+            " INNER JOIN attribute"
+            " ON measurement.attribute_identifier = attribute.identifier"
+            " WHERE creation_timestamp >= $1 ORDER BY attribute.name ASC;"
+        ),
+        1000.0,
+    )
+    assert [tuple(element) for element in elements] == [
+        ("81bf7042-e20f-4a97-ac44-c15853e3618f", "co2"),
+        ("81bf7042-e20f-4a97-ac44-c15853e3618f", "temperature"),
+    ]
+
+
+@pytest.mark.anyio
+async def test_batcher_skips_duplicates(setup, connection):
+    """Test that an idempotent batcher skips rows that were already written."""
+    batcher = ingestion.Batcher(
+        dbpool=connection,
+        table="measurement",
+        columns=mqtt.MEASUREMENT_COLUMNS,
+        capacity=4096,
+        timeout=None,
+        idempotent=True,
+        prepare=await _compact(connection),
+    )
+    await batcher.put(_rows("81bf7042-e20f-4a97-ac44-c15853e3618f", 2))
+    await batcher.flush()
+    await batcher.put(_rows("81bf7042-e20f-4a97-ac44-c15853e3618f", 3))
+    await batcher.flush()
+    assert await _count(connection) == 3
+
+
+########################################################################################
+# Deduplication
+########################################################################################
+
+
+def test_deduplicator_filters_recent_duplicates():
+    """Test that rows with a recently seen key are filtered out."""
+    deduplicator = ingestion.Deduplicator(
+        capacity=3, columns=mqtt.MEASUREMENT_COLUMNS, key=mqtt.MEASUREMENT_KEY
+    )
+    rows = _rows("81bf7042-e20f-4a97-ac44-c15853e3618f", 4)
+    assert deduplicator.filter(rows[:2]) == rows[:2]
+    # Other values or receipt timestamps don't matter
+    duplicate = rows[0][:2] + (2.0,) + rows[0][3:5] + (0.0,)
+    assert deduplicator.filter([duplicate, rows[2]]) == [rows[2]]
+    # The oldest key is forgotten when the capacity is exceeded
+    assert deduplicator.filter([rows[3], rows[0]]) == [rows[3], rows[0]]
+    assert deduplicator.statistics() == {"capacity": 3, "size": 3, "duplicates": 1}
+
+
+########################################################################################
+# Interning
+########################################################################################
+
+
+@pytest.mark.anyio
+async def test_snapshot_keeps_latest_values(setup, connection):
+    """Test that the latest value per sensor and attribute is kept across batches."""
+    batcher = ingestion.Batcher(
+        dbpool=connection,
+        table="measurement",
+        columns=mqtt.MEASUREMENT_COLUMNS,
+        capacity=4096,
+        timeout=None,
+        prepare=await _compact(connection),
+        committed=ingestion.Snapshot(
+            dbpool=connection,
+            query="upsert-measurements-latest",
+            columns=mqtt.MEASUREMENT_COLUMNS,
+            key=("sensor_number", "attribute_identifier"),
+            order="creation_timestamp",
+        ),
+    )
+    sensor_identifier = "81bf7042-e20f-4a97-ac44-c15853e3618f"
+    # The batches arrive out of order, the second one must not overwrite the first
+    for batch in [[2000.0, 1000.0], [1500.0]]:
+        await batcher.put(
+            [(sensor_identifier, "temperature", x, 0, x, x) for x in batch]
+        )
+        await batcher.flush()
+    elements = await connection.fetch(
+        "SELECT attribute.name, measurement_latest.value FROM measurement_latest"
+        " INNER JOIN attribute"
+        " ON measurement_latest.attribute_identifier = attribute.identifier"
+        " ORDER BY attribute.name ASC;"
+    )
+    assert [tuple(element) for element in elements] == [
+        ("humidity", 0.1),
+        ("pressure", -0.4),
+        ("temperature", 2000.0),
+    ]
+
+
+class _Pool:
+    """Record the arguments of executed queries instead of running them."""
+
+    def __init__(self):
+        self.arguments = []
+
+    async def execute(self, query, *arguments):
+        self.arguments.append(arguments)
+
+
+@pytest.mark.anyio
+async def test_snapshot_upserts_newest_record_per_key():
+    """Test that only the newest record per key is upserted, in a single query."""
+    dbpool = _Pool()
+    snapshot = ingestion.Snapshot(
+        dbpool=dbpool,
+        query="upsert-measurements-latest",
+        columns=mqtt.MEASUREMENT_COLUMNS,
+        key=("sensor_number", "attribute_identifier"),
+        order="creation_timestamp",
+    )
+    await snapshot([])
+    assert dbpool.arguments == []
+    await snapshot(
+        [
+            (1, 1, 1.0, 0, 20.0, 30.0),
+            (1, 1, 2.0, 0, 10.0, 30.0),
+            (1, 2, 3.0, None, 10.0, 30.0),
+            (2, 1, 4.0, 0, 10.0, 30.0),
+        ]
+    )
+    assert dbpool.arguments == [
+        (
+            [1, 1, 2],
+            [1, 2, 1],
+            [1.0, 3.0, 4.0],
+            [0, None, 0],
+            [20.0, 10.0, 10.0],
+            [30.0, 30.0, 30.0],
+        )
+    ]
+
+
+@pytest.mark.anyio
+async def test_interner_stores_messages_once(setup, connection):
+    """Test that repeated log messages are stored once and referenced by the logs."""
+    interner = ingestion.Interner(
+        dbpool=connection,
+        table="log_message",
+        column="message",
+        index=mqtt.LOG_COLUMNS.index("message_identifier"),
+        capacity=1,
+    )
+    batcher = ingestion.Batcher(
+        dbpool=connection,
+        table="log",
+        columns=mqtt.LOG_COLUMNS,
+        capacity=4096,
+        timeout=None,
+        prepare=interner,
+    )
+    sensor_identifier = "81bf7042-e20f-4a97-ac44-c15853e3618f"
+    # The first message is already part of the test data
+    messages = ["Everything is fine.", "Hello!", "Hello!", "Goodbye!", "Hello!"]
+    for i, message in enumerate(messages):
+        await batcher.put([(sensor_identifier, "info", message, 0, 1000.0 + i, 0.0)])
+        await batcher.flush()
+    elements = await connection.fetch(
+        (
+            "SELECT log_message.message FROM log"
+            " INNER JOIN log_message ON log.message_identifier = log_message.identifier"
+            " WHERE log.creation_timestamp >= $1 ORDER BY log.creation_timestamp ASC;"
+        ),
+        1000.0,
+    )
+    assert [element["message"] for element in elements] == messages
+    assert await connection.fetchval("SELECT count(*) FROM log_message;") == 5
+
+
+def test_interner_identifies_messages_by_content():
+    """Test that identifiers are stable, distinct, and fit into a BIGINT column."""
+    identifiers = [ingestion.Interner.identify(x) for x in ["", "a", "b", "x" * 20000]]
+    assert len(set(identifiers)) == 4
+    assert all(-(2**63) <= identifier < 2**63 for identifier in identifiers)
+    assert ingestion.Interner.identify("a") == identifiers[1]
+
+
+########################################################################################
+# Known sensors
+########################################################################################
+
+
+@pytest.mark.anyio
+async def test_registry_remembers_unknown_sensors(setup, connection):
+    """Test that unknown sensors are looked up in the database only once."""
+    registry = ingestion.Registry(dbpool=connection, capacity=2, timeout=60)
+    await registry.load()
+    assert await registry.contains("81bf7042-e20f-4a97-ac44-c15853e3618f")
+    assert not await registry.contains("00000000-0000-4000-8000-000000000000")
+    assert not await registry.contains("00000000-0000-4000-8000-000000000000")
+    statistics = registry.statistics()
+    assert statistics["lookups"] == 1
+    assert statistics["rejected"] == 2
+    assert statistics["unknown"] == 1
+
+
+@pytest.mark.anyio
+async def test_registry_forgets_oldest_unknown_sensors(setup, connection):
+    """Test that the number of remembered unknown sensors is bounded."""
+    registry = ingestion.Registry(dbpool=connection, capacity=2, timeout=60)
+    for i in range(3):
+        assert not await registry.contains(f"00000000-0000-4000-8000-00000000000{i}")
+    assert registry.statistics()["unknown"] == 2
+    # The first one was forgotten and is looked up again
+    assert not await registry.contains("00000000-0000-4000-8000-000000000000")
+    assert registry.statistics()["lookups"] == 4
+
+
+@pytest.mark.anyio
+async def test_registry_with_added_and_discarded_sensors(setup, connection):
+    """Test that added sensors are known and discarded ones are looked up again."""
+    registry = ingestion.Registry(dbpool=connection, capacity=2, timeout=60)
+    await registry.load()
+    assert not await registry.contains("00000000-0000-4000-8000-000000000000")
+    registry.add("00000000-0000-4000-8000-000000000000", 0)
+    assert await registry.contains("00000000-0000-4000-8000-000000000000")
+    registry.discard("81bf7042-e20f-4a97-ac44-c15853e3618f")
+    assert registry.number("81bf7042-e20f-4a97-ac44-c15853e3618f") is None
+    assert await registry.contains("81bf7042-e20f-4a97-ac44-c15853e3618f")
+    assert registry.number("81bf7042-e20f-4a97-ac44-c15853e3618f") == 1
+    assert registry.statistics()["lookups"] == 2
+
+
+########################################################################################
+# Dead letters
+########################################################################################
+
+
+def test_encoding_rows_roundtrips():
+    """Test that rows encoded back into payloads decode into the same rows."""
+    sensor_identifier = "81bf7042-e20f-4a97-ac44-c15853e3618f"
+    rows = [
+        (sensor_identifier, "temperature", 1.0, 0, 1000.0, 2000.0),
+        (sensor_identifier, "humidity", 2.0, 0, 1000.0, 2000.0),
+        (sensor_identifier, "temperature", 3.0, None, 1001.0, 2000.0),
+    ]
+    payload = mqtt._encode_measurements(rows)
+    assert (
+        mqtt.SUBSCRIPTIONS["measurements"](payload, sensor_identifier, 2000.0) == rows
+    )
+    rows = [(sensor_identifier, "info", "Hello", 0, 1000.0, 2000.0)]
+    payload = mqtt._encode_logs(rows)
+    assert mqtt.SUBSCRIPTIONS["logs"](payload, sensor_identifier, 2000.0) == rows
+    rows = [(sensor_identifier, 0, 1000.0, True, 2000.0)]
+    payload = mqtt._encode_acknowledgments(rows)
+    assert (
+        mqtt.SUBSCRIPTIONS["acknowledgments"](payload, sensor_identifier, 2000.0)
+        == rows
+    )
+
+
+@pytest.mark.anyio
+async def test_replaying_dead_letters(setup, connection):
+    """Test that replayed dead letters are written and deleted or kept again."""
+    sensor_identifier = "81bf7042-e20f-4a97-ac44-c15853e3618f"
+    await connection.executemany(
+        (
+            "INSERT INTO dead_letter (sensor_identifier, kind, payload, error,"
+            " receipt_timestamp) VALUES ($1, $2, $3, $4, $5);"
+        ),
+        [
+            (
+                sensor_identifier,
+                "measurements",
+                mqtt._encode_measurements(_rows(sensor_identifier, 3)),
+                "",
+                1000.0,
+            ),
+            (sensor_identifier, "measurements", b"[]", "", 1001.0),
+            (sensor_identifier, "logs", b"[]", "", 1002.0),
+        ],
+    )
+    count = await mqtt.replay(connection, kinds=["measurements"], batch_size=1)
+    assert count == 2
+    assert await _count(connection) == 3
+    # The malformed measurements message is kept again, the logs are untouched
+    elements = await connection.fetch("SELECT kind, error FROM dead_letter;")
+    assert sorted(element["kind"] for element in elements) == ["logs", "measurements"]
+    assert any(element["error"] != "" for element in elements)
+
+
+########################################################################################
+# Concurrent processing
+########################################################################################
+
+
+@pytest.mark.anyio
+async def test_dispatcher_keeps_order_per_key():
+    """Test that work items with the same key are processed in order."""
+    results = {"a": [], "b": []}
+
+    async def process(key, value):
+        # Yield control so that workers interleave
+        await asyncio.sleep(0.001 * (value % 3))
+        results[key].append(value)
+
+    async with ingestion.dispatcher(concurrency=2, capacity=4) as dispatcher:
+        for value in range(16):
+            await dispatcher.put("a", process, "a", value)
+            await dispatcher.put("b", process, "b", value)
+    assert results == {"a": list(range(16)), "b": list(range(16))}
+    assert sum(dispatcher.statistics()["processed"]) == 32
+
+
+########################################################################################
+# Prioritised buffering
+########################################################################################
+
+
+@pytest.mark.anyio
+async def test_queue_keeps_order_across_priorities():
+    """Test that elements are returned in the order they were put."""
+    queue = ingestion.Queue(capacity=4, priorities=("low", "high"))
+    for priority, element in [("low", 0), ("high", 1), ("low", 2), ("high", 3)]:
+        assert queue.put(priority, element)
+    assert [await queue.get() for _ in range(4)] == [0, 1, 2, 3]
+
+
+@pytest.mark.anyio
+async def test_queue_sheds_lower_priorities_when_full():
+    """Test that a full queue evicts the oldest lower priority element."""
+    queue = ingestion.Queue(capacity=2, priorities=("low", "high"))
+    assert queue.put("low", 0)
+    assert queue.put("low", 1)
+    assert queue.put("high", 2)
+    assert not queue.put("low", 3)
+    assert queue.put("high", 4)
+    assert not queue.put("high", 5)
+    assert [await queue.get() for _ in range(2)] == [2, 4]
+    statistics = queue.statistics()
+    assert statistics["lag_elements"] == 0
+    assert statistics["received"] == {"low": 3, "high": 3}
+    assert statistics["dropped"] == {"low": 3, "high": 1}
+
+
+@pytest.mark.anyio
+async def test_queue_join_waits_for_processing():
+    """Test that joining waits until all elements are marked as done."""
+    queue = ingestion.Queue(capacity=2, priorities=("low", "high"))
+    queue.put("low", 0)
+    await queue.get()
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(queue.join(), timeout=0.01)
+    queue.task_done()
+    await asyncio.wait_for(queue.join(), timeout=0.01)
+
+
+########################################################################################
+# Topic routing
+########################################################################################
+
+
+IDENTIFIER = "102ca8bb-6f1e-4c4e-9b35-5d1ac0d1c7b4"
+
+
+@pytest.mark.parametrize(
+    "topic, kind",
+    [
+        (f"hermes/measurements/{IDENTIFIER}", "measurements"),
+        (f"hermes/logs/{IDENTIFIER}", "logs"),
+        (f"hermes/acknowledgments/{IDENTIFIER}", "acknowledgments"),
+    ],
+)
+def test_router_resolves_topic(topic, kind):
+    """Test resolving topics to their kind, decoder and sensor identifier."""
+    router = mqtt.Router("hermes/", mqtt.SUBSCRIPTIONS)
+    assert router.resolve(topic) == (kind, mqtt.SUBSCRIPTIONS[kind], IDENTIFIER)
+
+
+@pytest.mark.parametrize(
+    "topic",
+    [
+        f"measurements/{IDENTIFIER}",
+        f"hermes/configurations/{IDENTIFIER}",
+        f"hermes/measurements/{IDENTIFIER}/x",
+        f"hermes/measurements/{IDENTIFIER.upper()}",
+        "hermes/measurements/sensor-identifier",
+        "hermes/measurements/102ca8bb-6f1e-1c4e-9b35-5d1ac0d1c7b4",
+        "hermes/measurements/",
+        "hermesxmeasurements/" + IDENTIFIER,
+    ],
+)
+def test_router_rejects_topic(topic):
+    """Test that topics with other kinds or malformed identifiers don't match."""
+    router = mqtt.Router("hermes/", mqtt.SUBSCRIPTIONS)
+    assert router.resolve(topic) is None
+
+
+def test_router_without_base_topic():
+    """Test resolving topics when no base topic is configured."""
+    router = mqtt.Router("", mqtt.SUBSCRIPTIONS)
+    assert router.wildcards == ["acknowledgments/+", "measurements/+", "logs/+"]
+    assert router.resolve(f"logs/{IDENTIFIER}")[2] == IDENTIFIER
+
+
+def test_router_with_shared_subscription():
+    """Test subscribing via a shared subscription group."""
+    router = mqtt.Router("hermes/", mqtt.SUBSCRIPTIONS, share="server")
+    assert router.wildcards[0] == "$share/server/hermes/acknowledgments/+"
+    # Messages arrive with their regular topic
+    assert router.resolve(f"hermes/logs/{IDENTIFIER}")[2] == IDENTIFIER
+
+
+########################################################################################
+# Dispatching
+########################################################################################
+
+
+class _Registry:
+    """Fail to look up the first sensor, accept all others."""
+
+    def __init__(self, failing):
+        self.failing = failing
+
+    async def contains(self, sensor_identifier):
+        if sensor_identifier == self.failing:
+            raise ConnectionError("Database unavailable")
+        return True
+
+
+class _Dispatcher:
+    """Record the dispatched rows instead of processing them."""
+
+    def __init__(self):
+        self.rows = []
+
+    async def put(self, key, function, rows):
+        self.rows.extend(rows)
+
+
+@pytest.mark.anyio
+async def test_dispatching_continues_after_errors():
+    """Test that a failing message doesn't stop the processing of later ones."""
+    queue = ingestion.Queue(capacity=8, priorities=mqtt.PRIORITIES)
+    dispatcher = _Dispatcher()
+    rows = [(IDENTIFIER, 0, 1000.0, True, 2000.0)]
+    payload = mqtt._encode_acknowledgments(rows)
+    for sensor_identifier in ["00000000-0000-4000-8000-000000000000", IDENTIFIER]:
+        queue.put(
+            "acknowledgments",
+            (
+                "acknowledgments",
+                mqtt.SUBSCRIPTIONS["acknowledgments"],
+                sensor_identifier,
+                payload,
+                2000.0,
+            ),
+        )
+    task = asyncio.create_task(
+        mqtt.dispatch(
+            queue=queue,
+            registry=_Registry("00000000-0000-4000-8000-000000000000"),
+            dispatcher=dispatcher,
+            sinks={"acknowledgments": None},
+            deadletters=None,
+            latencies=ingestion.Latencies(),
+        )
+    )
+    await asyncio.wait_for(queue.join(), timeout=1)
+    task.cancel()
+    assert dispatcher.rows == rows
+
+
+########################################################################################
+# Instrumentation
+########################################################################################
+
+
+def test_latencies_are_counted_in_buckets():
+    """Test recording latencies per stage, kind and sensor."""
+    latencies = ingestion.Latencies(bounds=[0.1, 1.0])
+    latencies.record("commit", "logs", "a", 0.05)
+    latencies.record("commit", "logs", "b", 0.1)
+    latencies.record("commit", "measurements", "a", 5.0)
+    statistics = latencies.statistics()
+    assert statistics["bounds"] == [0.1, 1.0]
+    assert statistics["kinds"]["commit"]["logs"]["counts"] == [2, 0, 0]
+    assert statistics["kinds"]["commit"]["measurements"]["counts"] == [0, 0, 1]
+    assert "sensors" not in statistics
+    statistics = latencies.statistics(sensors={"a"})
+    assert list(statistics["sensors"]) == ["a"]
+    assert statistics["sensors"]["a"]["commit"]["count"] == 2
+    assert statistics["sensors"]["a"]["commit"]["sum"] == 5.05
+
+
+def test_latencies_forget_the_oldest_sensors():
+    """Test that the histograms of at most `capacity` sensors are kept."""
+    latencies = ingestion.Latencies(bounds=[0.1, 1.0], capacity=2)
+    for sensor_identifier in ["a", "b", "a", "c"]:
+        latencies.record("commit", "logs", sensor_identifier, 0.05)
+    statistics = latencies.statistics(sensors={"a", "b", "c"})
+    assert list(statistics["sensors"]) == ["b", "c"]
+    assert statistics["kinds"]["commit"]["logs"]["counts"] == [4, 0, 0]
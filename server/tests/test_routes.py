@@ -1,8 +1,13 @@
+import csv
+import json
+
 import asgi_lifespan
 import httpx
+import pyarrow.ipc
 import pytest
 
 import app.errors as errors
+import app.export as export
 import app.main as main
 
 
@@ -90,6 +95,49 @@ async def test_read_status(client):
     )
 
 
+########################################################################################
+# Route: GET /metrics
+########################################################################################
+
+
+@pytest.mark.anyio
+async def test_read_metrics(client):
+    """Test reading the ingestion and authentication metrics."""
+    response = await client.get("/metrics")
+    assert returns(response, 200)
+    assert keys(
+        response,
+        {
+            "authentication",
+            "queue",
+            "dispatcher",
+            "registry",
+            "deduplicator",
+            "latencies",
+        },
+    )
+    assert "sensors" not in response.json()["latencies"]
+
+
+@pytest.mark.anyio
+async def test_read_metrics_with_sensors(setup, client, access_token):
+    """Test reading the ingestion metrics including the per-sensor latencies."""
+    response = await client.get(
+        url="/metrics",
+        params={"sensors": True},
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert returns(response, 200)
+    assert "sensors" in response.json()["latencies"]
+
+
+@pytest.mark.anyio
+async def test_read_metrics_with_sensors_without_authentication(client):
+    """Test that the per-sensor latencies aren't shown to anonymous requesters."""
+    response = await client.get("/metrics", params={"sensors": True})
+    assert returns(response, errors.UnauthorizedError)
+
+
 ########################################################################################
 # Route: POST /users
 ########################################################################################
@@ -168,6 +216,19 @@ async def test_read_networks(setup, client, access_token):
     assert keys(response, {"network_identifier", "network_name"})
 
 
+@pytest.mark.anyio
+async def test_read_networks_with_cached_authentication(setup, client, access_token):
+    """Test that the access token is looked up in the database only once."""
+    for _ in range(2):
+        response = await client.get(
+            url="/networks", headers={"Authorization": f"Bearer {access_token}"}
+        )
+        assert returns(response, 200)
+    response = await client.get("/metrics")
+    statistics = response.json()["authentication"]["identities"]
+    assert statistics["hits"] == 1 and statistics["misses"] == 1
+
+
 @pytest.mark.anyio
 async def test_read_networks_with_invalid_authentication(setup, client, token):
     """Test reading the networks with an invalid access token."""
@@ -274,6 +335,76 @@ async def test_read_sensors_with_invalid_authorization(
     assert returns(response, errors.ForbiddenError)
 
 
+########################################################################################
+# Route: GET /networks/<network_identifier>/overview
+########################################################################################
+
+
+@pytest.mark.anyio
+async def test_read_network_overview(
+    setup,
+    connection,
+    monkeypatch,
+    client,
+    network_identifier,
+    sensor_identifier,
+    access_token,
+):
+    """Test reading the latest data of all sensors of a network at once."""
+    await connection.execute(
+        "CALL refresh_continuous_aggregate('measurement_aggregation_1_minute', NULL,"
+        " NULL);"
+    )
+    await connection.execute(
+        "CALL refresh_continuous_aggregate('measurement_aggregation_1_hour', NULL,"
+        " NULL);"
+    )
+    # Include the test data, which is from the beginning of time
+    monkeypatch.setattr(main, "OVERVIEW_RANGE", main.utils.timestamp())
+    response = await client.get(
+        url=f"/networks/{network_identifier}/overview",
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert returns(response, 200)
+    assert len(response.json()) == 3
+    assert keys(
+        response,
+        {"sensor_identifier", "sensor_name", "latest", "aggregation", "logs"},
+    )
+    overview = {x["sensor_identifier"]: x for x in response.json()}
+    assert overview[sensor_identifier]["latest"]["temperature"] == {
+        "value": 7800.0,
+        "revision": 1,
+        "creation_timestamp": 300.0,
+    }
+    assert overview[sensor_identifier]["aggregation"] == {
+        "temperature": [{"bucket_timestamp": 0.0, "average": 7200.0}],
+        "humidity": [{"bucket_timestamp": 0.0, "average": pytest.approx(0.65)}],
+        "pressure": [{"bucket_timestamp": 0.0, "average": -0.4}],
+    }
+    assert [x["severity"] for x in overview[sensor_identifier]["logs"]] == [
+        "warning",
+        "error",
+    ]
+    assert all(
+        x["latest"] == {} and x["aggregation"] == {} and x["logs"] == []
+        for x in overview.values()
+        if x["sensor_identifier"] != sensor_identifier
+    )
+
+
+@pytest.mark.anyio
+async def test_read_network_overview_with_invalid_authorization(
+    setup, client, access_token
+):
+    """Test reading the overview of a network having unsufficient permissions."""
+    response = await client.get(
+        url="/networks/2f9a5285-4ce1-4ddb-a268-0164c70f4826/overview",
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert returns(response, errors.ForbiddenError)
+
+
 ########################################################################################
 # Route: PUT /networks/<network_identifier>/sensors/<sensor_identifier>
 ########################################################################################
@@ -488,7 +619,312 @@ async def test_read_measurements_with_previous_page(
     assert sorts(response, lambda x: x["creation_timestamp"])
 
 
-# TODO check logs
+@pytest.mark.anyio
+async def test_read_measurements_with_compressed_chunks(
+    setup, connection, client, network_identifier, sensor_identifier, access_token
+):
+    """Test that reading measurements works the same across compressed chunks."""
+    url = f"/networks/{network_identifier}/sensors/{sensor_identifier}/measurements"
+    headers = {"Authorization": f"Bearer {access_token}"}
+    expected = (await client.get(url=url, headers=headers)).json()
+    await connection.execute(
+        "SELECT compress_chunk(chunk) FROM show_chunks('measurement') AS chunk;"
+    )
+    try:
+        response = await client.get(url=url, headers=headers)
+        assert returns(response, 200)
+        assert response.json() == expected
+    finally:
+        await connection.execute(
+            "SELECT decompress_chunk(chunk) FROM show_chunks('measurement') AS chunk;"
+        )
+
+
+@pytest.mark.anyio
+async def test_read_measurements_aggregation(
+    setup, connection, client, network_identifier, sensor_identifier, access_token
+):
+    """Test reading aggregated measurements at the resolution fitting the range."""
+    for resolution in ["1_minute", "1_hour", "1_day"]:
+        await connection.execute(
+            "CALL refresh_continuous_aggregate("
+            f"'measurement_aggregation_{resolution}', NULL, NULL);"
+        )
+    url = f"/networks/{network_identifier}/sensors/{sensor_identifier}/measurements"
+    headers = {"Authorization": f"Bearer {access_token}"}
+    params = {"aggregate": True, "start_timestamp": 0, "end_timestamp": 3600}
+    response = await client.get(url=url, headers=headers, params=params)
+    assert returns(response, 200)
+    assert set(response.json().keys()) == {"temperature", "humidity", "pressure"}
+    # 60 points over an hour are only possible with the 1-minute resolution
+    response = await client.get(
+        url=url, headers=headers, params={**params, "points": 60}
+    )
+    assert len(response.json()["temperature"]) == 4
+    assert len(response.json()["humidity"]) == 2
+    # A single point is still possible with the 1-hour resolution
+    response = await client.get(
+        url=url, headers=headers, params={**params, "points": 1}
+    )
+    assert returns(response, 200)
+    assert response.json()["temperature"] == [
+        {
+            "bucket_timestamp": response.json()["temperature"][0]["bucket_timestamp"],
+            "average": 7200.0,
+            "minimum": 6000.0,
+            "maximum": 8200.0,
+            "count": 4,
+        }
+    ]
+
+
+@pytest.mark.anyio
+async def test_read_measurements_aggregation_with_selection(
+    setup, connection, client, network_identifier, sensor_identifier, access_token
+):
+    """Test reading aggregates of selected attributes, statistics and bucket width."""
+    for resolution in ["1_minute", "1_hour", "1_day"]:
+        await connection.execute(
+            "CALL refresh_continuous_aggregate("
+            f"'measurement_aggregation_{resolution}', NULL, NULL);"
+        )
+    url = f"/networks/{network_identifier}/sensors/{sensor_identifier}/measurements"
+    headers = {"Authorization": f"Bearer {access_token}"}
+    params = {"aggregate": True, "start_timestamp": 0, "end_timestamp": 3600}
+    # Combined from the rollups
+    response = await client.get(
+        url=url,
+        headers=headers,
+        params={
+            **params,
+            "width": 7200,
+            "attributes": "temperature,humidity",
+            "statistics": "count",
+        },
+    )
+    assert returns(response, 200)
+    assert response.json() == {
+        "temperature": [{"bucket_timestamp": 0.0, "count": 4}],
+        "humidity": [{"bucket_timestamp": 0.0, "count": 2}],
+    }
+    # Computed from the raw measurements
+    response = await client.get(
+        url=url,
+        headers=headers,
+        params={
+            **params,
+            "width": 3600,
+            "attributes": "temperature",
+            "statistics": "average,deviation",
+            "percentiles": "50",
+        },
+    )
+    assert returns(response, 200)
+    assert response.json() == {
+        "temperature": [
+            {
+                "bucket_timestamp": 0.0,
+                "average": 7200.0,
+                "deviation": pytest.approx(993.3, abs=0.1),
+                "percentiles": [7300.0],
+            }
+        ]
+    }
+
+
+@pytest.mark.anyio
+async def test_read_measurements_aggregation_with_too_many_buckets(
+    setup, client, network_identifier, sensor_identifier, access_token
+):
+    """Test that requesting more buckets than allowed fails."""
+    response = await client.get(
+        url=f"/networks/{network_identifier}/sensors/{sensor_identifier}/measurements",
+        headers={"Authorization": f"Bearer {access_token}"},
+        params={"aggregate": True, "start_timestamp": 0, "width": 1},
+    )
+    assert returns(response, errors.BadRequestError)
+
+
+def test_resolution_is_coarsest_with_enough_points():
+    """Test that the coarsest resolution yielding the requested points is chosen."""
+    assert main._resolution(0, 365 * 86400, 365) == "1-day"
+    assert main._resolution(0, 365 * 86400, 366) == "1-hour"
+    assert main._resolution(0, 4 * 7 * 86400, 512) == "1-hour"
+    assert main._resolution(0, 3600, 60) == "1-minute"
+    assert main._resolution(0, 60, 512) == "1-minute"
+
+
+def test_rollup_is_coarsest_dividing_the_width():
+    """Test that rollups are used only if they can be combined to the statistics."""
+    assert main._rollup(7 * 86400, {"average"}, None) == "1-day"
+    assert main._rollup(5400, {"average", "count"}, None) == "1-minute"
+    assert main._rollup(90, {"average"}, None) is None
+    assert main._rollup(3600, {"deviation"}, None) is None
+    assert main._rollup(3600, {"average"}, [50]) is None
+
+
+########################################################################################
+# Route: GET /networks/<network_identifier>/sensors/<sensor_identifier>/measurements/latest
+########################################################################################
+
+
+@pytest.mark.anyio
+async def test_read_measurements_latest(
+    setup, client, network_identifier, sensor_identifier, access_token
+):
+    """Test reading the latest value of each attribute of a sensor."""
+    response = await client.get(
+        url=f"/networks/{network_identifier}/sensors/{sensor_identifier}/measurements/latest",
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert returns(response, 200)
+    assert response.json() == {
+        "temperature": {"value": 7800.0, "revision": 1, "creation_timestamp": 300.0},
+        "humidity": {"value": 0.1, "revision": None, "creation_timestamp": 100.0},
+        "pressure": {"value": -0.4, "revision": None, "creation_timestamp": 0.0},
+    }
+
+
+########################################################################################
+# Route: GET /networks/<network_identifier>/sensors/<sensor_identifier>/measurements/export
+########################################################################################
+
+
+@pytest.mark.anyio
+async def test_export_measurements(
+    setup, client, network_identifier, sensor_identifier, access_token
+):
+    """Test exporting all data points of a sensor as NDJSON."""
+    response = await client.get(
+        url=f"/networks/{network_identifier}/sensors/{sensor_identifier}/measurements/export",
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert returns(response, 200)
+    assert response.headers["content-type"] == "application/x-ndjson"
+    elements = [json.loads(line) for line in response.text.splitlines()]
+    assert len(elements) == 7
+    assert all(tuple(element.keys()) == export.COLUMNS for element in elements)
+    assert all(
+        element["sensor_identifier"] == sensor_identifier for element in elements
+    )
+    assert elements == sorted(elements, key=lambda x: x["creation_timestamp"])
+
+
+@pytest.mark.anyio
+async def test_export_measurements_as_csv_in_range(
+    setup, client, network_identifier, sensor_identifier, access_token
+):
+    """Test exporting the data points between two timestamps as CSV."""
+    response = await client.get(
+        url=f"/networks/{network_identifier}/sensors/{sensor_identifier}/measurements/export",
+        headers={"Authorization": f"Bearer {access_token}"},
+        params={"format": "csv", "start_timestamp": 100, "end_timestamp": 300},
+    )
+    assert returns(response, 200)
+    assert response.headers["content-type"].startswith("text/csv")
+    rows = list(csv.reader(response.text.splitlines()))
+    assert tuple(rows[0]) == export.COLUMNS
+    assert [float(row[4]) for row in rows[1:]] == [100, 100, 200]
+    assert [row[3] for row in rows[1:]] == ["", "", "1"]
+
+
+@pytest.mark.anyio
+async def test_export_measurements_as_arrow(
+    setup, client, network_identifier, sensor_identifier, access_token
+):
+    """Test that the Arrow export contains the same data points as the NDJSON one."""
+    response = await client.get(
+        url=f"/networks/{network_identifier}/sensors/{sensor_identifier}/measurements/export",
+        headers={"Authorization": f"Bearer {access_token}"},
+        params={"format": "arrow"},
+    )
+    assert returns(response, 200)
+    assert response.headers["content-type"] == "application/vnd.apache.arrow.stream"
+    table = pyarrow.ipc.open_stream(response.content).read_all()
+    assert tuple(table.column_names) == export.COLUMNS
+    response = await client.get(
+        url=f"/networks/{network_identifier}/sensors/{sensor_identifier}/measurements/export",
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    elements = [json.loads(line) for line in response.text.splitlines()]
+    rows = table.to_pylist()
+    for row in rows:
+        row["creation_timestamp"] = row["creation_timestamp"].timestamp()
+    assert rows == elements
+
+
+@pytest.mark.anyio
+async def test_export_measurements_of_network(
+    setup, client, network_identifier, access_token
+):
+    """Test exporting the data points of all sensors of a network."""
+    response = await client.get(
+        url=f"/networks/{network_identifier}/measurements/export",
+        headers={"Authorization": f"Bearer {access_token}"},
+    )
+    assert returns(response, 200)
+    assert len(response.text.splitlines()) == 7
+
+
+########################################################################################
+# Route: GET /networks/<network_identifier>/sensors/<sensor_identifier>/logs
+########################################################################################
+
+
+async def _page(client, url, access_token, direction):
+    """Page through all elements in the given direction, two at a time."""
+    elements, params = [], {"direction": direction, "limit": 2}
+    while True:
+        response = await client.get(
+            url=url, headers={"Authorization": f"Bearer {access_token}"}, params=params
+        )
+        assert returns(response, 200)
+        if len(response.json()) == 0:
+            return elements
+        page = response.json() if direction == "next" else response.json()[::-1]
+        elements.extend(page)
+        params = {
+            **params,
+            "creation_timestamp": page[-1]["creation_timestamp"],
+            "log_identifier": page[-1]["log_identifier"],
+        }
+
+
+@pytest.mark.anyio
+async def test_read_logs_with_equal_timestamps(
+    setup, connection, client, network_identifier, sensor_identifier, access_token
+):
+    """Test that paging through logs returns each log once, even at equal timestamps."""
+    await connection.execute(
+        (
+            "INSERT INTO log (sensor_identifier, severity, message_identifier,"
+            " revision, creation_timestamp, receipt_timestamp) SELECT"
+            " sensor_identifier, severity, message_identifier, revision,"
+            " creation_timestamp, receipt_timestamp FROM log WHERE creation_timestamp"
+            " = $1;"
+        ),
+        200.0,
+    )
+    url = f"/networks/{network_identifier}/sensors/{sensor_identifier}/logs"
+    elements = await _page(client, url, access_token, "next")
+    assert len(elements) == 6
+    assert all(
+        set(element.keys())
+        == {
+            "log_identifier",
+            "severity",
+            "revision",
+            "creation_timestamp",
+            "subject",
+            "details",
+        }
+        for element in elements
+    )
+    assert [x["creation_timestamp"] for x in elements] == [0, 100, 200, 200, 300, 400]
+    assert len({x["log_identifier"] for x in elements}) == 6
+    assert await _page(client, url, access_token, "previous") == elements[::-1]
+
+
 # TODO check log aggregation
 # TODO check create sensor when network exists but user does not have permission
 # TODO check missing/wrong authentication
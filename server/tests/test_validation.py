@@ -99,3 +99,136 @@ def test_validate_route_create_configuration_body_fail(value):
         pydantic.TypeAdapter(
             validation.routes._CreateConfigurationRequestBody
         ).validate_python(value)
+
+
+########################################################################################
+# MQTT payloads
+########################################################################################
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b'[{"timestamp": 0, "value": {}}]',
+        b'[{"timestamp": 1683645000.0, "revision": 0, "value": {"x": 1.5, "y_1": 2}}]',
+        b'[{"timestamp": 1683645000, "revision": null, "value": {"x": 3}}]',
+        b'[{"timestamp": 1, "value": {"x": 1}}, {"timestamp": 2, "value": {"x": 2}}]',
+    ],
+)
+def test_decode_measurements_pass(payload):
+    expected = [
+        ("s", attribute, value, element.revision, element.timestamp, 9.0)
+        for element in validation.MeasurementsValidator.validate_json(payload)
+        for attribute, value in element.value.items()
+    ]
+    rows = validation.decode_measurements(payload, "s", 9.0)
+    assert rows == expected
+    assert all(type(row[2]) is float and type(row[4]) is float for row in rows)
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b"",
+        b"\xff",
+        b"{}",
+        b"[]",
+        b"[1]",
+        b'[{"value": {}}]',
+        b'[{"timestamp": 0}]',
+        b'[{"timestamp": 0, "value": {}, "extra": 0}]',
+        b'[{"timestamp": -1, "value": {}}]',
+        b'[{"timestamp": 2147483648, "value": {}}]',
+        b'[{"timestamp": NaN, "value": {}}]',
+        b'[{"timestamp": true, "value": {}}]',
+        b'[{"timestamp": "0", "value": {}}]',
+        b'[{"timestamp": 0, "revision": 1.0, "value": {}}]',
+        b'[{"timestamp": 0, "revision": -1, "value": {}}]',
+        b'[{"timestamp": 0, "revision": true, "value": {}}]',
+        b'[{"timestamp": 0, "value": []}]',
+        b'[{"timestamp": 0, "value": {"x": true}}]',
+        b'[{"timestamp": 0, "value": {"x": null}}]',
+        b'[{"timestamp": 0, "value": {"x": "1"}}]',
+        b'[{"timestamp": 0, "value": {"x_": 1}}]',
+        b'[{"timestamp": 0, "value": {"x\\n": 1}}]',
+        b'[{"timestamp": 0, "value": {"' + b"x" * 65 + b'": 1}}]',
+    ],
+)
+def test_decode_measurements_fail(payload):
+    with pytest.raises(pydantic.ValidationError):
+        validation.MeasurementsValidator.validate_json(payload)
+    with pytest.raises(ValueError):
+        validation.decode_measurements(payload, "s", 9.0)
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b'[{"timestamp": 0, "severity": "info", "message": ""}]',
+        b'[{"timestamp": 1.5, "revision": 3, "severity": "error", "message": "x"}]',
+        b'[{"timestamp": 1, "severity": "info", "message": "' + b"x" * 20000 + b'"}]',
+    ],
+)
+def test_decode_logs_pass(payload):
+    expected = [
+        (
+            "s",
+            element.severity,
+            element.message,
+            element.revision,
+            element.timestamp,
+            9.0,
+        )
+        for element in validation.LogsValidator.validate_json(payload)
+    ]
+    assert validation.decode_logs(payload, "s", 9.0) == expected
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b"[]",
+        b'[{"timestamp": 0, "severity": "debug", "message": ""}]',
+        b'[{"timestamp": 0, "severity": "info", "message": null}]',
+        b'[{"timestamp": 0, "severity": "info"}]',
+        b'[{"timestamp": 0, "severity": "info", "message": "", "extra": 0}]',
+        b'[{"timestamp": 0, "revision": 0.5, "severity": "info", "message": ""}]',
+    ],
+)
+def test_decode_logs_fail(payload):
+    with pytest.raises(pydantic.ValidationError):
+        validation.LogsValidator.validate_json(payload)
+    with pytest.raises(ValueError):
+        validation.decode_logs(payload, "s", 9.0)
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b'[{"timestamp": 0, "revision": 0, "success": true}]',
+        b'[{"timestamp": 1.5, "revision": 7, "success": false}]',
+    ],
+)
+def test_decode_acknowledgments_pass(payload):
+    expected = [
+        ("s", element.revision, element.timestamp, element.success, 9.0)
+        for element in validation.AcknowledgmentsValidator.validate_json(payload)
+    ]
+    assert validation.decode_acknowledgments(payload, "s", 9.0) == expected
+
+
+@pytest.mark.parametrize(
+    "payload",
+    [
+        b"[]",
+        b'[{"timestamp": 0, "success": true}]',
+        b'[{"timestamp": 0, "revision": null, "success": true}]',
+        b'[{"timestamp": 0, "revision": 0, "success": 1}]',
+        b'[{"timestamp": 0, "revision": 0}]',
+    ],
+)
+def test_decode_acknowledgments_fail(payload):
+    with pytest.raises(pydantic.ValidationError):
+        validation.AcknowledgmentsValidator.validate_json(payload)
+    with pytest.raises(ValueError):
+        validation.decode_acknowledgments(payload, "s", 9.0)